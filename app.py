@@ -1,15 +1,31 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response, stream_with_context, g
 from flask_cors import CORS
-import requests
 import json
+import hashlib
 import os
-import tempfile
 import time
 import base64
 import io
 import wave
-from tts_service import TTSService
-from asr_service import ASRService
+from collections import deque
+from tts_service import TTSService, TTSQueueFullError, streaming_wav_header
+from tts_cache import TTSCache
+from audio_storage import AudioStorage, AudioJanitor
+from audio_decoder import create_audio_decoder
+from audio_format import (sniff_audio_format, is_raw_pcm_content_type, is_untyped_content_type, wav_to_pcm16k,
+                          convert_to_pcm16k, parse_content_type_rate)
+from asr_service import ASRService, ASRQueueFullError
+from vad import SilenceTrimmer
+from xfyun_transport import XfyunTransport, TTS_URL, ASR_URL
+from kimi_client import KimiClient
+from text_segmenter import SentenceBuffer
+from session_store import SessionStore
+from reply_cache import ReplyCache
+from single_flight import SingleFlight
+from prompt_builder import HistorySummarizer, estimate_tokens, trim_history
+from metrics import (REGISTRY, HTTP_REQUESTS, HTTP_REQUEST_SECONDS, HTTP_INFLIGHT, UPSTREAM_ERRORS,
+                     AUDIO_BYTES, observe_stage)
+from tracing import TraceRecorder, start_trace, end_trace, current_trace, span, add_span
 import logging
 from config import config
 
@@ -36,18 +52,131 @@ if config_validation['warnings']:
     for warning in config_validation['warnings']:
         logger.warning(f"  - {warning}")
 
+# 初始化音频存储（按哈希前缀分目录）及后台清理线程
+audio_storage = AudioStorage(config.AUDIO_FILES_DIR)
+audio_janitor = AudioJanitor(
+    config.AUDIO_FILES_DIR,
+    ttl=config.AUDIO_RETENTION_SECONDS,
+    max_bytes=config.AUDIO_MAX_BYTES,
+    interval=config.AUDIO_JANITOR_INTERVAL,
+    exclude_dirs=[config.TTS_CACHE_DIR]  # TTS缓存自行按LRU管理容量
+)
+audio_janitor.start()
+
+# 初始化TTS缓存
+tts_cache = TTSCache(config.TTS_CACHE_DIR, config.TTS_CACHE_MAX_BYTES) if config.TTS_CACHE_ENABLED else None
+
+# 讯飞TTS/ASR共享的传输层：签名URL复用、预热连接
+def create_xfyun_transport(url):
+    return XfyunTransport(
+        url,
+        config.XFYUN_API_KEY,
+        config.XFYUN_API_SECRET,
+        pool_size=config.XFYUN_WARM_POOL_SIZE,
+        max_idle=config.XFYUN_WARM_MAX_IDLE,
+        url_ttl=config.XFYUN_URL_TTL
+    )
+
 # 初始化TTS服务
 tts_service = TTSService(
     config.XFYUN_APPID,
     config.XFYUN_API_KEY,
-    config.XFYUN_API_SECRET
+    config.XFYUN_API_SECRET,
+    max_workers=config.TTS_MAX_WORKERS,
+    queue_size=config.TTS_QUEUE_SIZE,
+    timeout=config.TTS_TIMEOUT,
+    cache=tts_cache,
+    storage=audio_storage,
+    segment_threshold=config.TTS_SEGMENT_THRESHOLD,
+    segment_max_chars=config.TTS_SEGMENT_MAX_CHARS,
+    segment_parallelism=config.TTS_SEGMENT_PARALLELISM,
+    coalesce=config.TTS_COALESCE,
+    transport=create_xfyun_transport(config.XFYUN_TTS_URL or TTS_URL)
 )
 
 # 初始化ASR服务
 asr_service = ASRService(
     config.XFYUN_APPID,
     config.XFYUN_API_KEY,
-    config.XFYUN_API_SECRET
+    config.XFYUN_API_SECRET,
+    max_workers=config.ASR_MAX_WORKERS,
+    queue_size=config.ASR_QUEUE_SIZE,
+    timeout=config.ASR_TIMEOUT,
+    frame_size=config.ASR_FRAME_SIZE,
+    frame_interval=config.ASR_FRAME_INTERVAL,
+    burst_mode=config.ASR_BURST_MODE,
+    transport=create_xfyun_transport(config.XFYUN_ASR_URL or ASR_URL)
+)
+
+# 识别前裁掉首尾静音（可选压缩过长停顿），减少按实时速率发送的音频时长
+silence_trimmer = SilenceTrimmer(
+    threshold_db=config.VAD_THRESHOLD_DB,
+    noise_margin_db=config.VAD_NOISE_MARGIN_DB,
+    padding_ms=config.VAD_PADDING_MS,
+    max_pause_ms=config.VAD_MAX_PAUSE_MS,
+    min_speech_ms=config.VAD_MIN_SPEECH_MS
+) if config.VAD_ENABLED else None
+
+# 初始化音频解码器（进程内PyAV或预启动的ffmpeg进程池，启动时检测一次可用性）
+audio_decoder = create_audio_decoder(
+    backend=config.AUDIO_DECODER_BACKEND,
+    pool_size=config.AUDIO_DECODER_POOL_SIZE,
+    health_interval=config.AUDIO_DECODER_HEALTH_INTERVAL,
+    timeout=config.FFMPEG_TIMEOUT,
+    max_output_bytes=config.FFMPEG_MAX_OUTPUT_BYTES
+)
+
+# 初始化Kimi API客户端（连接池在所有请求线程间共享）
+kimi_client = KimiClient(
+    config.KIMI_API_URL,
+    config.KIMI_API_KEY,
+    pool_connections=config.KIMI_POOL_CONNECTIONS,
+    pool_maxsize=config.KIMI_POOL_MAXSIZE,
+    pool_block=config.KIMI_POOL_BLOCK,
+    idle_timeout=config.KIMI_POOL_IDLE_TIMEOUT,
+    connect_timeout=config.KIMI_CONNECT_TIMEOUT,
+    read_timeout=config.KIMI_READ_TIMEOUT
+)
+
+# 并发的相同对话请求共享一次API调用
+kimi_flight = SingleFlight('Kimi') if config.KIMI_COALESCE else None
+
+# 服务端对话会话
+session_store = SessionStore(
+    max_messages=config.MAX_CONVERSATION_HISTORY,
+    ttl=config.SESSION_TTL,
+    max_sessions=config.SESSION_MAX_COUNT,
+    max_bytes=config.SESSION_MAX_BYTES,
+    keep_overflow=config.SUMMARY_ENABLED
+)
+
+# 滑出会话窗口的旧对话在后台合并为摘要
+history_summarizer = None
+if config.SUMMARY_ENABLED:
+    history_summarizer = HistorySummarizer(
+        session_store,
+        kimi_client,
+        config.KIMI_MODEL,
+        max_tokens=config.SUMMARY_MAX_TOKENS,
+        batch_messages=config.SUMMARY_BATCH_MESSAGES
+    )
+
+# 常见开场白的回复缓存（可选）
+reply_cache = None
+if config.REPLY_CACHE_ENABLED:
+    reply_cache = ReplyCache(
+        max_entries=config.REPLY_CACHE_MAX_ENTRIES,
+        ttl=config.REPLY_CACHE_TTL,
+        variants=config.REPLY_CACHE_VARIANTS,
+        similarity=config.REPLY_CACHE_SIMILARITY,
+        max_chars=config.REPLY_CACHE_MAX_CHARS
+    )
+
+# 请求追踪记录（按采样率或慢请求阈值输出）
+trace_recorder = TraceRecorder(
+    sample_rate=config.TRACE_SAMPLE_RATE,
+    slow_threshold=config.TRACE_SLOW_THRESHOLD,
+    path=config.TRACE_LOG_FILE or None
 )
 
 # 黄鹏的个性化设定
@@ -64,122 +193,330 @@ HUANG_PENG_PERSONA = """
 请记住你是黄鹏，要保持这个角色设定，每次回答都要体现出你对谢猪猪的关心和幽默感。
 """
 
+# Kimi API出错时的兜底回复
+KIMI_BUSY_REPLY = "哎呀，谢猪猪，我的大脑有点卡住了，稍等一下再聊吧~"
+KIMI_ERROR_REPLY = "哎呀，谢猪猪，我好像遇到了一点小问题，但我还是很想和你聊天的！"
+
+def build_kimi_request(message, conversation_history=None, stream=False):
+    """构造Kimi API请求体"""
+    messages = [
+        {"role": "system", "content": HUANG_PENG_PERSONA},
+    ]
+    
+    # 添加历史对话，按token预算截取，保证每轮提示词大小有上限
+    budget = config.PROMPT_MAX_TOKENS - estimate_tokens(HUANG_PENG_PERSONA) - estimate_tokens(message)
+    messages.extend(trim_history(conversation_history or [], budget))
+    
+    # 添加当前消息
+    messages.append({"role": "user", "content": message})
+    
+    data = {
+        "model": config.KIMI_MODEL,
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 1000
+    }
+    if stream:
+        data["stream"] = True
+    
+    return data
+
+def cached_reply(message, conversation_history):
+    """查找回复缓存，返回 (缓存的回复, 本次回复是否可以写入缓存)"""
+    if reply_cache is None or not reply_cache.accepts(message, conversation_history):
+        return None, False
+    return reply_cache.get(message), True
+
+def request_kimi_reply(data):
+    """发送一次Kimi API请求，返回回复内容，上游返回错误时返回兜底回复"""
+    response = kimi_client.post(data)
+    
+    if response.status_code == 200:
+        result = response.json()
+        return result['choices'][0]['message']['content']
+    else:
+        logger.error(f"Kimi API error: {response.status_code}, {response.text}")
+        UPSTREAM_ERRORS.inc('kimi', str(response.status_code))
+        return KIMI_BUSY_REPLY
+
+def kimi_request_key(data):
+    """请求体的SHA-256摘要，作为相同请求合并的键"""
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
 def call_kimi_api(message, conversation_history=[]):
     """调用Kimi API进行对话"""
+    with observe_stage('llm'):
+        return _call_kimi_api(message, conversation_history)
+
+def _call_kimi_api(message, conversation_history):
     try:
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {config.KIMI_API_KEY}'
-        }
-        
-        messages = [
-            {"role": "system", "content": HUANG_PENG_PERSONA},
-        ]
-        
-        # 添加历史对话
-        messages.extend(conversation_history)
+        reply, cacheable = cached_reply(message, conversation_history)
+        if reply is not None:
+            return reply
         
-        # 添加当前消息
-        messages.append({"role": "user", "content": message})
+        data = build_kimi_request(message, conversation_history)
         
-        data = {
-            "model": config.KIMI_MODEL,
-            "messages": messages,
-            "temperature": 0.7,
-            "max_tokens": 1000
-        }
-        
-        response = requests.post(
-            config.KIMI_API_URL,
-            headers=headers,
-            json=data,
-            timeout=config.REQUEST_TIMEOUT
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content']
+        # 请求体完全相同的并发调用只发起一次
+        if kimi_flight:
+            reply = kimi_flight.do(kimi_request_key(data), request_kimi_reply, data)
         else:
-            logger.error(f"Kimi API error: {response.status_code}, {response.text}")
-            return "哎呀，谢猪猪，我的大脑有点卡住了，稍等一下再聊吧~"
+            reply = request_kimi_reply(data)
+        
+        if cacheable and reply != KIMI_BUSY_REPLY:
+            reply_cache.put(message, reply)
+        return reply
             
     except Exception as e:
         logger.error(f"调用Kimi API失败: {str(e)}")
-        return "哎呀，谢猪猪，我好像遇到了一点小问题，但我还是很想和你聊天的！"
+        UPSTREAM_ERRORS.inc('kimi', 'exception')
+        return KIMI_ERROR_REPLY
+
+def stream_kimi_api(message, conversation_history=[]):
+    """以流式方式调用Kimi API，逐个产出回复增量文本
+    
+    上游出错时产出兜底回复，调用方无需区分成功与失败。
+    """
+    with observe_stage('llm_stream'):
+        yield from _stream_kimi_api(message, conversation_history)
+
+def _stream_kimi_api(message, conversation_history):
+    received = False
+    start = time.perf_counter()
+    try:
+        reply, cacheable = cached_reply(message, conversation_history)
+        if reply is not None:
+            yield reply
+            return
+        
+        parts = []
+        data = build_kimi_request(message, conversation_history, stream=True)
+        
+        with kimi_client.post(data, stream=True) as response:
+            if response.status_code != 200:
+                logger.error(f"Kimi API error: {response.status_code}, {response.text}")
+                UPSTREAM_ERRORS.inc('kimi', str(response.status_code))
+                yield KIMI_BUSY_REPLY
+                return
+            
+            # 按字节分行后再以UTF-8解码：响应头未声明charset时requests按ISO-8859-1解码，
+            # 中文的UTF-8字节中含有\x85，会被str.splitlines()误当作换行
+            for raw_line in response.iter_lines():
+                line = raw_line.decode('utf-8')
+                # SSE格式：每个事件以 "data: " 开头，空行分隔
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+                
+                chunk = json.loads(payload)
+                choices = chunk.get('choices') or []
+                if not choices:
+                    continue
+                delta = choices[0].get('delta', {}).get('content')
+                if delta:
+                    if not received:
+                        add_span('llm_first_token', start)
+                    received = True
+                    if cacheable:
+                        parts.append(delta)
+                    yield delta
+        
+        if not received:
+            logger.error("Kimi API流式响应为空")
+            yield KIMI_BUSY_REPLY
+        elif cacheable:
+            reply_cache.put(message, ''.join(parts))
+            
+    except Exception as e:
+        logger.error(f"流式调用Kimi API失败: {str(e)}")
+        UPSTREAM_ERRORS.inc('kimi', 'exception')
+        # 已经输出部分内容时不再追加兜底回复，避免拼出半句话
+        if not received:
+            yield KIMI_ERROR_REPLY
+
+def is_valid_history(history):
+    """客户端历史须为消息列表，每条消息的role为user或assistant、content为字符串"""
+    return isinstance(history, list) and all(
+        isinstance(m, dict) and m.get('role') in ('user', 'assistant') and isinstance(m.get('content'), str)
+        for m in history)
+
+def resolve_history(data):
+    """确定本轮对话使用的会话和历史
+    
+    带session_id时使用服务端保存的历史，会话不存在或已过期时新建会话；
+    只带history的旧客户端沿用客户端历史（截取最近的MAX_CONVERSATION_HISTORY条）；都没有时新建会话。
+    返回 (会话ID, 历史)，沿用客户端历史时会话ID为None。调用方须先用is_valid_history校验客户端历史。
+    """
+    session_id = data.get('session_id')
+    if session_id:
+        history = session_store.get_history(session_id)
+        if history is not None:
+            return session_id, history
+        logger.info(f"会话不存在或已过期，新建会话: {session_id}")
+    elif data.get('history'):
+        return None, data['history'][-config.MAX_CONVERSATION_HISTORY:]
+    return session_store.create(), []
+
+def remember_turn(session_id, message, reply):
+    """把一轮对话写入会话历史并按需安排摘要，兜底回复不记录"""
+    if session_id and reply not in (KIMI_BUSY_REPLY, KIMI_ERROR_REPLY):
+        session_store.append(session_id, message, reply)
+        if history_summarizer:
+            history_summarizer.schedule(session_id)
+
+def format_sse(data, event=None):
+    """将数据编码为一条Server-Sent Events消息"""
+    message = ''
+    if event:
+        message += f'event: {event}\n'
+    message += f'data: {json.dumps(data, ensure_ascii=False)}\n\n'
+    return message
 
 def convert_webm_to_pcm(webm_data):
     """将WebM音频数据转换为PCM格式"""
     try:
         logger.info("开始转换WebM音频格式")
         
-        # 检查是否安装了ffmpeg
-        import subprocess
-        try:
-            subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-            logger.info("FFmpeg已安装")
-        except (subprocess.CalledProcessError, FileNotFoundError):
+        # 解码器可用性在启动时已检测
+        if not audio_decoder.available:
             logger.error("FFmpeg未安装或不可用")
             # 尝试直接使用原始数据
             return webm_data
         
-        # 创建临时文件
-        with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as webm_file:
-            webm_file.write(webm_data)
-            webm_path = webm_file.name
-        
-        logger.info(f"临时WebM文件: {webm_path}")
-        
-        # 使用ffmpeg转换为PCM格式
-        pcm_path = webm_path.replace('.webm', '.pcm')
-        
-        cmd = [
-            'ffmpeg', '-i', webm_path,
-            '-acodec', 'pcm_s16le',
-            '-ar', '16000',
-            '-ac', '1',
-            '-f', 's16le',
-            '-y',  # 覆盖输出文件
-            pcm_path
-        ]
-        
-        logger.info(f"FFmpeg命令: {' '.join(cmd)}")
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            logger.error(f"FFmpeg转换失败: {result.stderr}")
-            # 清理临时文件
-            try:
-                os.unlink(webm_path)
-            except:
-                pass
-            return None
-        
-        # 检查PCM文件是否存在
-        if not os.path.exists(pcm_path):
-            logger.error(f"PCM文件未生成: {pcm_path}")
-            os.unlink(webm_path)
-            return None
-        
-        # 读取PCM数据
-        with open(pcm_path, 'rb') as pcm_file:
-            pcm_data = pcm_file.read()
-        
-        logger.info(f"PCM数据大小: {len(pcm_data)} bytes")
-        
-        # 清理临时文件
-        try:
-            os.unlink(webm_path)
-            os.unlink(pcm_path)
-        except Exception as e:
-            logger.warning(f"清理临时文件失败: {str(e)}")
-        
-        return pcm_data
+        # 通过管道转换，不产生临时文件
+        with span('ffmpeg'):
+            return audio_decoder.decode(webm_data)
         
     except Exception as e:
         logger.error(f"音频转换异常: {str(e)}", exc_info=True)
         return None
 
+def prepare_pcm_for_asr(audio_data, content_type):
+    """根据文件头识别上传音频的格式，并转换为16kHz单声道PCM
+    
+    WAV和裸PCM在进程内直接转换，其他容器格式交给解码器；启用静音裁剪时再去掉首尾静音。
+    """
+    with observe_stage('decode'):
+        pcm_data = _prepare_pcm_for_asr(audio_data, content_type)
+    
+    if silence_trimmer and pcm_data:
+        with observe_stage('vad'):
+            trimmed = silence_trimmer.trim(pcm_data)
+        AUDIO_BYTES.inc('vad_trimmed', amount=len(pcm_data) - len(trimmed))
+        pcm_data = trimmed
+    return pcm_data
+
+def _prepare_pcm_for_asr(audio_data, content_type):
+    # 明确声明为裸PCM时直接按声明处理，裸PCM的开头可能恰好像某种文件头
+    audio_format = 'pcm' if is_raw_pcm_content_type(content_type) else sniff_audio_format(audio_data)
+    logger.info(f"识别到音频格式: {audio_format}（声明类型: {content_type}）")
+    
+    if audio_format == 'wav':
+        pcm_data = wav_to_pcm16k(audio_data)
+        if pcm_data is not None:
+            return pcm_data
+        logger.info("WAV快速路径不可用，改用解码器")
+    elif audio_format == 'pcm' or (audio_format == 'unknown' and is_untyped_content_type(content_type)):
+        # 声明为裸PCM、或未声明类型且无法识别的数据按裸PCM处理，采样率取自MIME参数（如 audio/L16;rate=44100）；
+        # 声明了其他类型（如audio/aac、audio/amr）但认不出文件头的交给解码器探测
+        pcm_data = convert_to_pcm16k(audio_data, parse_content_type_rate(content_type))
+        if pcm_data is not None:
+            return pcm_data
+        logger.warning("裸PCM重采样失败，直接使用原始数据")
+        return audio_data
+    
+    pcm_data = convert_webm_to_pcm(audio_data)
+    if not pcm_data:
+        logger.error("音频格式转换失败，尝试直接使用原始数据")
+        # 如果转换失败，尝试直接使用原始数据
+        pcm_data = audio_data
+    return pcm_data
+
+def read_audio_upload():
+    """读取并校验上传的音频文件，返回 (音频数据, 声明类型, 错误响应)"""
+    # 检查是否有文件上传
+    if 'audio' not in request.files:
+        logger.error("没有音频文件")
+        return None, None, (jsonify({'error': '没有音频文件'}), 400)
+    
+    audio_file = request.files['audio']
+    if audio_file.filename == '':
+        logger.error("没有选择音频文件")
+        return None, None, (jsonify({'error': '没有选择音频文件'}), 400)
+    
+    logger.info(f"接收到音频文件: {audio_file.filename}, 类型: {audio_file.content_type}")
+    
+    # 读取音频数据
+    audio_data = audio_file.read()
+    logger.info(f"音频数据大小: {len(audio_data)} bytes")
+    AUDIO_BYTES.inc('upload', amount=len(audio_data))
+    
+    # 检查音频数据大小
+    if len(audio_data) > 5 * 1024 * 1024:  # 5MB限制
+        logger.error("音频文件太大")
+        return None, None, (jsonify({'error': '音频文件太大'}), 400)
+    
+    # 检查音频数据是否为空
+    if len(audio_data) == 0:
+        logger.error("音频数据为空")
+        return None, None, (jsonify({'error': '音频数据为空'}), 400)
+    
+    return audio_data, audio_file.content_type, None
+
+def pcm_to_wav_bytes(pcm_data):
+    """把16kHz单声道PCM封装为内存中的WAV数据"""
+    buffer = io.BytesIO()
+    with span('wav'), wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(16000)
+        wav_file.writeframes(pcm_data)
+    return buffer.getvalue()
+
+def metrics_endpoint():
+    """指标中使用的接口名：路由规则而非实际路径，避免标签数量无限增长"""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    HTTP_INFLIGHT.inc(metrics_endpoint())
+
+@app.after_request
+def count_request(response):
+    HTTP_REQUESTS.inc(metrics_endpoint(), request.method, str(response.status_code))
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    # 流式响应在内容发送完毕后才会执行到这里
+    start = g.pop('request_start', None)
+    if start is not None:
+        endpoint = metrics_endpoint()
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint)
+        HTTP_INFLIGHT.dec(endpoint)
+
+@app.before_request
+def start_request_trace():
+    if config.TRACE_ENABLED:
+        start_trace(request.method, request.path)
+
+@app.after_request
+def add_server_timing(response):
+    # 流式响应的响应头先于内容发送，只包含此前完成的阶段，完整耗时见追踪记录
+    trace = current_trace()
+    if trace is not None:
+        response.headers['Server-Timing'] = trace.server_timing()
+        g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_trace(error=None):
+    trace = end_trace()
+    if trace is not None:
+        trace_recorder.finish(trace, g.pop('response_status', 500))
+
 @app.route('/')
 def index():
     """主页面"""
@@ -194,7 +531,6 @@ def chat():
             return jsonify({'error': '请求数据格式错误'}), 400
             
         message = data.get('message', '')
-        history = data.get('history', [])
         
         if not message:
             return jsonify({'error': '消息不能为空'}), 400
@@ -202,11 +538,18 @@ def chat():
         if len(message) > config.MAX_MESSAGE_LENGTH:
             return jsonify({'error': f'消息长度不能超过{config.MAX_MESSAGE_LENGTH}字符'}), 400
         
+        if not is_valid_history(data.get('history') or []):
+            return jsonify({'error': '历史消息格式错误'}), 400
+        
+        session_id, history = resolve_history(data)
+        
         # 调用Kimi API获取回复
         response = call_kimi_api(message, history)
+        remember_turn(session_id, message, response)
         
         return jsonify({
             'response': response,
+            'session_id': session_id,
             'status': 'success'
         })
         
@@ -214,49 +557,68 @@ def chat():
         logger.error(f"处理对话请求失败: {str(e)}")
         return jsonify({'error': '处理请求失败'}), 500
 
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """以Server-Sent Events流式返回对话回复"""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'error': '请求数据格式错误'}), 400
+
+        message = data.get('message', '')
+
+        if not message:
+            return jsonify({'error': '消息不能为空'}), 400
+
+        if len(message) > config.MAX_MESSAGE_LENGTH:
+            return jsonify({'error': f'消息长度不能超过{config.MAX_MESSAGE_LENGTH}字符'}), 400
+
+        if not is_valid_history(data.get('history') or []):
+            return jsonify({'error': '历史消息格式错误'}), 400
+
+        session_id, history = resolve_history(data)
+
+        def generate():
+            parts = []
+            for delta in stream_kimi_api(message, history):
+                parts.append(delta)
+                yield format_sse({'delta': delta})
+
+            response = ''.join(parts)
+            remember_turn(session_id, message, response)
+
+            # 最后一条事件携带完整回复和会话ID
+            yield format_sse({
+                'response': response,
+                'session_id': session_id,
+                'status': 'success'
+            }, event='done')
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+
+    except Exception as e:
+        logger.error(f"处理流式对话请求失败: {str(e)}")
+        return jsonify({'error': '处理请求失败'}), 500
+
 @app.route('/recognize', methods=['POST'])
 def recognize():
     """语音识别接口"""
     try:
         logger.info("收到语音识别请求")
         
-        # 检查是否有文件上传
-        if 'audio' not in request.files:
-            logger.error("没有音频文件")
-            return jsonify({'error': '没有音频文件'}), 400
-        
-        audio_file = request.files['audio']
-        if audio_file.filename == '':
-            logger.error("没有选择音频文件")
-            return jsonify({'error': '没有选择音频文件'}), 400
-        
-        logger.info(f"接收到音频文件: {audio_file.filename}, 类型: {audio_file.content_type}")
-        
-        # 读取音频数据
-        audio_data = audio_file.read()
-        logger.info(f"音频数据大小: {len(audio_data)} bytes")
-        
-        # 检查音频数据大小
-        if len(audio_data) > 5 * 1024 * 1024:  # 5MB限制
-            logger.error("音频文件太大")
-            return jsonify({'error': '音频文件太大'}), 400
-        
-        # 检查音频数据是否为空
-        if len(audio_data) == 0:
-            logger.error("音频数据为空")
-            return jsonify({'error': '音频数据为空'}), 400
-        
-        # 转换音频格式（如果需要）
-        if audio_file.content_type == 'audio/webm':
-            logger.info("开始转换WebM格式音频")
-            pcm_data = convert_webm_to_pcm(audio_data)
-            if not pcm_data:
-                logger.error("音频格式转换失败，尝试直接使用原始数据")
-                # 如果转换失败，尝试直接使用原始数据
-                pcm_data = audio_data
-        else:
-            logger.info("直接使用原始音频数据")
-            pcm_data = audio_data
+        audio_data, content_type, error = read_audio_upload()
+        if error:
+            return error
+        
+        # 按实际格式转换为16kHz单声道PCM
+        pcm_data = prepare_pcm_for_asr(audio_data, content_type)
         
         logger.info(f"处理后的音频数据大小: {len(pcm_data)} bytes")
         
@@ -279,6 +641,8 @@ def recognize():
             logger.error("ASR服务返回空结果")
             return jsonify({'error': '语音识别失败，请确保音频清晰并重试'}), 500
             
+    except ASRQueueFullError:
+        return jsonify({'error': '语音识别繁忙，请稍后再试'}), 503
     except Exception as e:
         logger.error(f"语音识别异常: {str(e)}", exc_info=True)
         return jsonify({'error': f'语音识别异常: {str(e)}'}), 500
@@ -304,17 +668,200 @@ def synthesize():
         
         if audio_file:
             return jsonify({
-                'audio_url': f'/audio/{os.path.basename(audio_file)}',
+                'audio_url': get_audio_url(audio_file),
                 'status': 'success'
             })
         else:
             return jsonify({'error': '语音合成失败'}), 500
             
+    except TTSQueueFullError:
+        return jsonify({'error': '语音合成繁忙，请稍后再试'}), 503
     except Exception as e:
         logger.error(f"语音合成失败: {str(e)}")
         return jsonify({'error': '语音合成失败'}), 500
 
-@app.route('/audio/<filename>')
+@app.route('/synthesize/stream', methods=['GET', 'POST'])
+def synthesize_stream():
+    """流式语音合成接口，边合成边返回音频
+
+    支持GET（便于<audio>标签直接播放）和POST；format可选wav（默认，长度未知的WAV头）或pcm。
+    """
+    try:
+        data = request.get_json(silent=True) if request.method == 'POST' else request.args
+        if not data:
+            return jsonify({'error': '请求数据格式错误'}), 400
+
+        text = data.get('text', '')
+        audio_format = data.get('format', 'wav')
+
+        if not text:
+            return jsonify({'error': '文本不能为空'}), 400
+
+        if len(text) > config.MAX_MESSAGE_LENGTH:
+            return jsonify({'error': f'文本长度不能超过{config.MAX_MESSAGE_LENGTH}字符'}), 400
+
+        if audio_format not in ('wav', 'pcm'):
+            return jsonify({'error': '不支持的音频格式'}), 400
+
+        chunks = tts_service.stream(text)
+
+        def generate():
+            # 客户端在收到首块前断开时也要关闭chunks，撤销已提交的合成
+            try:
+                if audio_format == 'wav':
+                    yield streaming_wav_header()
+                for chunk in chunks:
+                    yield chunk
+            finally:
+                chunks.close()
+
+        mimetype = 'audio/wav' if audio_format == 'wav' else 'audio/L16;rate=16000;channels=1'
+        return Response(
+            stream_with_context(generate()),
+            mimetype=mimetype,
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+
+    except TTSQueueFullError:
+        return jsonify({'error': '语音合成繁忙，请稍后再试'}), 503
+    except Exception as e:
+        logger.error(f"流式语音合成失败: {str(e)}")
+        return jsonify({'error': '语音合成失败'}), 500
+
+@app.route('/voice_turn', methods=['POST'])
+def voice_turn():
+    """一次完成语音对话：识别 → 对话 → 合成，以Server-Sent Events返回
+    
+    事件依次为 transcript（识别文本）、多条 delta（回复增量）与 audio（逐句合成的base64 WAV，按句序产出），
+    最后是 done，其中 unsynthesized 列出没有音频的句子序号。回复边生成边按句提交合成，合成与生成重叠进行；
+    合成繁忙时不排队等待，跳过该句。
+    """
+    try:
+        audio_data, content_type, error = read_audio_upload()
+        if error:
+            return error
+        
+        try:
+            history = json.loads(request.form.get('history') or '[]')
+        except ValueError:
+            history = None
+        if not is_valid_history(history):
+            return jsonify({'error': '历史消息格式错误'}), 400
+        
+        session_id, history = resolve_history({
+            'session_id': request.form.get('session_id'),
+            'history': history
+        })
+        
+        # 识别在返回流之前完成，失败时仍可返回普通错误响应
+        pcm_data = prepare_pcm_for_asr(audio_data, content_type)
+        transcript = asr_service.recognize(pcm_data)
+        if not transcript:
+            logger.error("ASR服务返回空结果")
+            return jsonify({'error': '语音识别失败，请确保音频清晰并重试'}), 500
+        logger.info(f"识别结果: {transcript}")
+        
+        unsynthesized = []  # 没有音频的句子序号（繁忙跳过或合成失败），随done事件返回，客户端可自行补合成
+        
+        def audio_event(index, sentence, future):
+            if future is None:
+                unsynthesized.append(index)
+                return format_sse({'index': index, 'text': sentence, 'error': '语音合成繁忙，已跳过该句',
+                                   'skipped': True}, event='audio')
+            pcm = future.result()
+            if pcm is None:
+                unsynthesized.append(index)
+                return format_sse({'index': index, 'text': sentence, 'error': '语音合成失败'}, event='audio')
+            audio = base64.b64encode(pcm_to_wav_bytes(pcm)).decode('ascii')
+            return format_sse({'index': index, 'text': sentence, 'audio': audio}, event='audio')
+        
+        def generate():
+            yield format_sse({'text': transcript}, event='transcript')
+            
+            sentences = SentenceBuffer(max_chars=config.TTS_SEGMENT_MAX_CHARS)
+            pending = deque()
+            parts = []
+            count = 0
+            
+            def submit(sentence):
+                # 不等待合成名额，繁忙时跳过该句，避免整条事件流停在排队上
+                nonlocal count
+                try:
+                    future = tts_service.submit_segment(sentence, wait=False)
+                except TTSQueueFullError:
+                    future = None
+                pending.append((count, sentence, future))
+                count += 1
+            
+            try:
+                for delta in stream_kimi_api(transcript, history):
+                    parts.append(delta)
+                    yield format_sse({'delta': delta})
+                    
+                    for sentence in sentences.feed(delta):
+                        # 在途句数达到上限时先等最早的一句完成
+                        while len(pending) >= config.TTS_SEGMENT_PARALLELISM:
+                            yield audio_event(*pending.popleft())
+                        submit(sentence)
+                    
+                    # 按句序产出已经合成完的音频
+                    while pending and (pending[0][2] is None or pending[0][2].done()):
+                        yield audio_event(*pending.popleft())
+                
+                for sentence in sentences.flush():
+                    submit(sentence)
+                while pending:
+                    yield audio_event(*pending.popleft())
+            finally:
+                for _, _, future in pending:
+                    if future is not None:
+                        future.cancel()
+            
+            response = ''.join(parts)
+            remember_turn(session_id, transcript, response)
+            
+            # 响应头中的Server-Timing只包含识别阶段，完整的分阶段耗时随done事件返回
+            trace = current_trace()
+            yield format_sse({
+                'transcript': transcript,
+                'response': response,
+                'session_id': session_id,
+                'unsynthesized': unsynthesized,
+                'server_timing': trace.server_timing() if trace else None,
+                'status': 'success'
+            }, event='done')
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+    
+    except ASRQueueFullError:
+        return jsonify({'error': '语音识别繁忙，请稍后再试'}), 503
+    except Exception as e:
+        logger.error(f"语音对话处理失败: {str(e)}", exc_info=True)
+        return jsonify({'error': '语音对话处理失败'}), 500
+
+@app.route('/session/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """结束会话，清除服务端保存的历史"""
+    if session_store.delete(session_id):
+        return jsonify({'status': 'success'})
+    return jsonify({'error': '会话不存在'}), 404
+
+def get_audio_url(audio_path):
+    """根据音频文件路径生成访问URL（支持音频目录下的子目录）"""
+    relative_path = os.path.relpath(audio_path, config.AUDIO_FILES_DIR)
+    return '/audio/' + relative_path.replace(os.sep, '/')
+
+@app.route('/audio/<path:filename>')
 def serve_audio(filename):
     """提供音频文件"""
     try:
@@ -325,11 +872,12 @@ def serve_audio(filename):
         audio_path = os.path.join(config.AUDIO_FILES_DIR, filename)
         
         # 检查文件是否在允许的目录中
-        if not os.path.abspath(audio_path).startswith(os.path.abspath(config.AUDIO_FILES_DIR)):
+        audio_root = os.path.abspath(config.AUDIO_FILES_DIR)
+        if os.path.commonpath([os.path.abspath(audio_path), audio_root]) != audio_root:
             return jsonify({'error': '非法访问'}), 403
             
         if os.path.exists(audio_path):
-            return send_file(audio_path, mimetype='audio/wav')
+            return send_file(os.path.abspath(audio_path), mimetype='audio/wav')
         else:
             return jsonify({'error': '音频文件不存在'}), 404
     except Exception as e:
@@ -362,13 +910,8 @@ def test_status():
         except Exception as e:
             logger.error(f"ASR服务检查失败: {str(e)}")
         
-        # 检查FFmpeg
-        try:
-            import subprocess
-            subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-            status['ffmpeg'] = True
-        except:
-            pass
+        # 检查FFmpeg（使用启动时的检测结果）
+        status['ffmpeg'] = audio_decoder.available
         
         return jsonify(status)
         
@@ -376,6 +919,28 @@ def test_status():
         logger.error(f"系统状态检查失败: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/stats')
+def stats():
+    """获取运行统计信息（连接池等），用于监控"""
+    return jsonify({
+        'kimi_client': kimi_client.get_stats(),
+        'tts_service': tts_service.get_stats(),
+        'asr_service': asr_service.get_stats(),
+        'audio_janitor': audio_janitor.get_stats(),
+        'audio_decoder': audio_decoder.get_stats(),
+        'silence_trimmer': silence_trimmer.get_stats() if silence_trimmer else None,
+        'sessions': session_store.get_stats(),
+        'history_summarizer': history_summarizer.get_stats() if history_summarizer else None,
+        'reply_cache': reply_cache.get_stats() if reply_cache else None,
+        'kimi_single_flight': kimi_flight.get_stats() if kimi_flight else None,
+        'tracing': trace_recorder.get_stats()
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus文本格式的运行指标"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/health')
 def health():
     """健康检查接口"""
@@ -1,19 +1,15 @@
 # -*- coding:utf-8 -*-
 import websocket
-import datetime
-import hashlib
 import base64
-import hmac
 import json
-from urllib.parse import urlencode
 import time
-import ssl
-from wsgiref.handlers import format_date_time
-from datetime import datetime
-from time import mktime
-import _thread as thread
-import os
 import logging
+import threading
+import asyncio
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from xfyun_transport import XfyunTransport, ASR_URL
+from metrics import AUDIO_BYTES, UPSTREAM_ERRORS, observe_future
+from tracing import span, add_span, bind
 
 logger = logging.getLogger(__name__)
 
@@ -22,49 +18,53 @@ STATUS_CONTINUE_FRAME = 1  # 中间帧标识
 STATUS_LAST_FRAME = 2  # 最后一帧的标识
 
 
-class ASRService:
-    def __init__(self, appid, api_key, api_secret):
-        self.appid = appid
-        self.api_key = api_key
-        self.api_secret = api_secret
+def extract_text(data):
+    """从识别结果消息的data字段中拼接出文本"""
+    text = ""
+    result = data.get("result")
+    if result:
+        ws_list = result.get("ws")
+        if ws_list:
+            for ws_item in ws_list:
+                cw_list = ws_item.get("cw")
+                if cw_list:
+                    for cw_item in cw_list:
+                        text += cw_item.get("w", "")
+    return text
+
+
+def _resolve(future, result):
+    """完成Future，Future为空或已完成（如已被取消）时忽略"""
+    if future is None or future.done():
+        return
+    try:
+        future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class ASRQueueFullError(Exception):
+    """识别任务排队已满"""
+
+
+class ASRSession:
+    """单次语音识别会话，独立持有本次识别的连接、音频与识别结果"""
+
+    def __init__(self, service, audio_data, frame_size=1280, frame_interval=0.04, future=None):
+        self.service = service
+        self.audio_data = audio_data
+        self.frame_size = frame_size  # 每帧发送的音频字节数
+        self.frame_interval = frame_interval  # 帧间隔（秒），0表示不限速连续发送
+        self.ws = None
         self.recognition_result = ""
         self.recognition_complete = False
         self.recognition_error = None
-        
-    def create_url(self):
-        """生成websocket连接URL"""
-        url = 'wss://iat-api.xfyun.cn/v2/iat'
-        # 生成RFC1123格式的时间戳
-        now = datetime.now()
-        date = format_date_time(mktime(now.timetuple()))
-
-        # 拼接字符串
-        signature_origin = "host: " + "ws-api.xfyun.cn" + "\n"
-        signature_origin += "date: " + date + "\n"
-        signature_origin += "GET " + "/v2/iat " + "HTTP/1.1"
-        
-        # 进行hmac-sha256进行加密
-        signature_sha = hmac.new(
-            self.api_secret.encode('utf-8'), 
-            signature_origin.encode('utf-8'),
-            digestmod=hashlib.sha256
-        ).digest()
-        signature_sha = base64.b64encode(signature_sha).decode(encoding='utf-8')
-
-        authorization_origin = "api_key=\"%s\", algorithm=\"%s\", headers=\"%s\", signature=\"%s\"" % (
-            self.api_key, "hmac-sha256", "host date request-line", signature_sha)
-        authorization = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
-        
-        # 将请求的鉴权参数组合为字典
-        v = {
-            "authorization": authorization,
-            "date": date,
-            "host": "ws-api.xfyun.cn"
-        }
-        
-        # 拼接鉴权参数，生成url
-        url = url + '?' + urlencode(v)
-        return url
+        self.finished = threading.Event()  # 识别完成、出错或连接关闭时置位
+        self.last_frame_sent = None  # 最后一帧的发送时间（perf_counter）
+        self.future = future  # 识别结束时直接在消息回调中完成，结果为识别文本或None
+        self.cancelled = False
+        if future is not None:
+            future.add_done_callback(self._on_future_done)
 
     def on_message(self, ws, message):
         """处理websocket消息"""
@@ -78,169 +78,310 @@ class ASRService:
             if code != 0:
                 errMsg = message["message"]
                 logger.error(f"ASR Error: {errMsg}, Code: {code}")
+                UPSTREAM_ERRORS.inc('xfyun_asr', str(code))
                 self.recognition_error = errMsg
+                self.finished.set()
+                self._finish(None)
                 ws.close()
                 return
             
             # 处理识别结果
             data = message.get("data")
             if data:
-                result = data.get("result")
-                if result:
-                    ws_list = result.get("ws")
-                    if ws_list:
-                        for ws_item in ws_list:
-                            cw_list = ws_item.get("cw")
-                            if cw_list:
-                                for cw_item in cw_list:
-                                    self.recognition_result += cw_item.get("w", "")
+                self.recognition_result += extract_text(data)
                 
                 # 检查是否识别完成
                 if data.get("status") == 2:
                     logger.info("ASR recognition complete")
                     self.recognition_complete = True
+                    self.finished.set()
+                    self._finish(self.recognition_result)
                     ws.close()
                     
         except Exception as e:
             logger.error(f"处理ASR消息失败: {str(e)}")
             self.recognition_error = str(e)
+            self.finished.set()
+            self._finish(None)
 
     def on_error(self, ws, error):
         """处理websocket错误"""
         logger.error(f"ASR WebSocket错误: {error}")
+        UPSTREAM_ERRORS.inc('xfyun_asr', 'connection')
         self.recognition_error = str(error)
+        self.finished.set()
+        self._finish(None)
 
     def on_close(self, ws, close_status_code, close_msg):
         """处理websocket关闭"""
         logger.info("ASR WebSocket连接已关闭")
+        if not self.recognition_complete and not self.recognition_error:
+            self.recognition_error = "ASR连接在识别完成前关闭"
+        self.finished.set()
 
-    def on_open(self, ws):
-        """处理websocket连接打开"""
-        def run(*args):
-            # 公共参数
-            common_args = {"app_id": self.appid}
-            
-            # 业务参数
-            business_args = {
-                "domain": "iat",
-                "language": "zh_cn",
-                "accent": "mandarin",
-                "vinfo": 1,
-                "vad_eos": 10000
-            }
-            
-            d = {
-                "common": common_args,
-                "business": business_args,
-                "data": {
-                    "status": 0,
-                    "format": "audio/L16;rate=16000",
-                    "encoding": "raw",
-                    "audio": ""
-                }
-            }
-            
-            data = json.dumps(d)
-            logger.info("发送ASR初始化数据")
-            ws.send(data)
+    def abort(self):
+        """取消本次识别：停止发送并断开连接，唤醒阻塞在recv上的工作线程"""
+        self.cancelled = True
+        self.finished.set()
+        ws = self.ws
+        if ws is not None:
+            try:
+                ws.abort()
+            except OSError:
+                pass
+
+    def _on_future_done(self, future):
+        if future.cancelled():
+            self.abort()
 
-        thread.start_new_thread(run, ())
+    def _finish(self, result):
+        _resolve(self.future, result)
+        return result
 
     def send_audio_data(self, ws, audio_data, status):
         """发送音频数据"""
-        data = {
-            "data": {
-                "status": status,
-                "format": "audio/L16;rate=16000",
-                "encoding": "raw",
-                "audio": str(base64.b64encode(audio_data), 'utf-8')
-            }
-        }
-        
-        data_json = json.dumps(data)
+        data_json = json.dumps(self.service.build_audio_frame(audio_data, status))
         ws.send(data_json)
 
-    def recognize(self, audio_data):
-        """语音识别主方法"""
+    def run(self, timeout=15):
+        """执行识别，成功返回识别文本，失败返回None"""
+        if self.cancelled:
+            return None
+        deadline = time.monotonic() + timeout
+        ws = None
         try:
-            # 重置状态
-            self.recognition_result = ""
-            self.recognition_complete = False
-            self.recognition_error = None
-            
-            # 创建websocket连接
-            ws_url = self.create_url()
-            logger.info(f"连接ASR服务: {ws_url}")
-            
-            # 设置websocket选项
-            ws = websocket.WebSocketApp(
-                ws_url,
-                on_message=self.on_message,
-                on_error=self.on_error,
-                on_close=self.on_close,
-                on_open=self.on_open
-            )
-            
-            # 存储websocket实例和音频数据
+            # 优先取用已完成握手的预热连接，取到后立即开始发送音频
+            with span('asr_connect'):
+                ws = self.service.transport.connect()
             self.ws = ws
-            self.audio_data = audio_data
-            
-            # 在新线程中启动websocket连接
-            def run_websocket():
-                ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
-            
-            import threading
-            ws_thread = threading.Thread(target=run_websocket)
-            ws_thread.daemon = True
-            ws_thread.start()
-            
-            # 等待连接建立
-            time.sleep(0.5)
-            
-            # 发送音频数据
-            if not self.recognition_error:
-                self.send_audio_chunks()
-            
-            # 等待识别完成
-            timeout = 15  # 增加超时时间
-            start_time = time.time()
-            
-            while not self.recognition_complete and not self.recognition_error:
-                if time.time() - start_time > timeout:
-                    logger.error("ASR识别超时")
-                    return None
-                time.sleep(0.1)
-            
-            if self.recognition_error:
-                logger.error(f"ASR识别失败: {self.recognition_error}")
+            if self.cancelled:
+                # 建立连接期间已被取消
                 return None
+            sender = threading.Thread(target=bind(self.send_audio_chunks), args=(ws,), daemon=True)
+            sender.start()
             
-            return self.recognition_result
-            
-        except Exception as e:
-            logger.error(f"ASR识别异常: {str(e)}")
+            # 在当前线程阻塞读取识别结果，直到完成、出错或超时
+            while not self.finished.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise websocket.WebSocketTimeoutException()
+                ws.settimeout(remaining)
+                message = ws.recv()
+                if not message:
+                    self.on_close(ws, None, None)
+                    break
+                self.on_message(ws, message)
+        
+        except websocket.WebSocketTimeoutException:
+            logger.error("ASR识别超时")
+            return self._finish(None)
+        except (websocket.WebSocketException, OSError) as e:
+            if not self.cancelled:
+                self.on_error(ws, e)
+        finally:
+            self.finished.set()
+            if ws is not None:
+                ws.close()
+        
+        if self.cancelled:
+            logger.info("ASR识别已取消")
             return None
+        
+        if self.recognition_complete and self.last_frame_sent:
+            # 音频发送完毕到拿到最终结果的等待时间
+            add_span('asr_final', self.last_frame_sent)
+        
+        if self.recognition_error:
+            logger.error(f"ASR识别失败: {self.recognition_error}")
+            return self._finish(None)
+        
+        return self._finish(self.recognition_result)
 
-    def send_audio_chunks(self):
-        """分块发送音频数据"""
+    def send_audio_chunks(self, ws):
+        """分块发送音频数据
+        
+        按帧间隔以绝对时间排程，发送耗时不会累积成额外延迟；
+        帧间隔为0时连续发送，适用于已录制完成的音频。
+        """
         try:
-            chunk_size = 1280  # 每次发送的音频数据大小
+            frame_size = self.frame_size
             audio_len = len(self.audio_data)
+            started = time.perf_counter()
+            next_send = time.monotonic()
             
-            for i in range(0, audio_len, chunk_size):
-                chunk = self.audio_data[i:i+chunk_size]
+            for i in range(0, audio_len, frame_size):
+                if self.finished.is_set():
+                    return
                 
-                # 确定状态
-                if i == 0:
-                    status = STATUS_FIRST_FRAME
-                elif i + chunk_size >= audio_len:
-                    status = STATUS_LAST_FRAME
-                else:
-                    status = STATUS_CONTINUE_FRAME
+                chunk = self.audio_data[i:i+frame_size]
+                status = STATUS_FIRST_FRAME if i == 0 else STATUS_CONTINUE_FRAME
+                self.send_audio_data(ws, chunk, status)
                 
-                self.send_audio_data(self.ws, chunk, status)
-                time.sleep(0.04)  # 40ms间隔
+                if self.frame_interval > 0:
+                    next_send += self.frame_interval
+                    delay = next_send - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+            
+            # 以空的最后一帧结束音频流（音频只有一帧时也能正确结束）
+            self.send_audio_data(ws, b'', STATUS_LAST_FRAME)
+            self.last_frame_sent = time.perf_counter()
+            add_span('asr_send', started, self.last_frame_sent)
                 
         except Exception as e:
             logger.error(f"发送音频数据失败: {str(e)}")
-            self.recognition_error = str(e) 
\ No newline at end of file
+            self.recognition_error = str(e)
+            self.finished.set()
+
+
+class ASRService:
+    def __init__(self, appid, api_key, api_secret, max_workers=2, queue_size=8, timeout=15,
+                 frame_size=1280, frame_interval=0.04, burst_mode=False, transport=None):
+        self.appid = appid
+        self.api_key = api_key
+        self.api_secret = api_secret
+        # 讯飞连接（签名URL缓存、预热连接），未指定时不预热
+        self.transport = transport or XfyunTransport(ASR_URL, api_key, api_secret)
+        self.max_workers = max_workers  # 同时进行的识别会话上限（应与讯飞并发配额一致）
+        self.queue_size = queue_size  # 排队等待的识别任务上限
+        self.timeout = timeout  # 单次识别超时（秒）
+        self.frame_size = frame_size  # 每帧音频字节数
+        self.frame_interval = frame_interval  # 帧间隔（秒），按实时速率发送
+        self.burst_mode = burst_mode  # 已录制音频不按实时速率，连续发送
+        
+        # 工作线程池 + 信号量限制在途任务总数（执行中 + 排队中）
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asr')
+        self._slots = threading.BoundedSemaphore(max_workers + queue_size)
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'running': 0,
+            'completed': 0,
+            'failed': 0,
+            'cancelled': 0,
+        }
+        
+    def create_url(self):
+        """生成websocket连接URL（有效期内复用签名）"""
+        return self.transport.create_url()
+
+    def build_audio_frame(self, audio_data, status):
+        """构造音频数据帧，第一帧附带公共参数和业务参数"""
+        data = {
+            "data": {
+                "status": status,
+                "format": "audio/L16;rate=16000",
+                "encoding": "raw",
+                "audio": str(base64.b64encode(audio_data), 'utf-8')
+            }
+        }
+        
+        if status == STATUS_FIRST_FRAME:
+            # 公共参数
+            data["common"] = {"app_id": self.appid}
+            
+            # 业务参数
+            data["business"] = {
+                "domain": "iat",
+                "language": "zh_cn",
+                "accent": "mandarin",
+                "vinfo": 1,
+                "vad_eos": 10000
+            }
+        
+        return data
+
+    def recognize(self, audio_data, timeout=None):
+        """语音识别主方法
+        
+        识别任务提交到有界线程池执行，排队已满时抛出ASRQueueFullError。
+        """
+        return self.submit_recognize(audio_data, timeout).result()
+
+    async def recognize_async(self, audio_data, timeout=None):
+        """recognize的协程版本，等待结果时不占用线程；协程被取消时同时取消识别"""
+        return await asyncio.wrap_future(self.submit_recognize(audio_data, timeout))
+
+    def submit_recognize(self, audio_data, timeout=None):
+        """提交识别任务，立即返回结果为识别文本的Future（失败时结果为None）
+        
+        Future在收到最终识别结果时即完成，不等待连接关闭。取消Future会停止发送并断开连接；
+        timeout为本次调用的截止时间（秒，包含排队时间），默认使用服务的识别超时。
+        排队已满时抛出ASRQueueFullError。
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            logger.warning("ASR识别队列已满，拒绝请求")
+            raise ASRQueueFullError("ASR识别队列已满")
+        
+        AUDIO_BYTES.inc('asr_pcm', amount=len(audio_data))
+        future = Future()
+        try:
+            task = self._executor.submit(bind(self._recognize, 'asr_queue'), audio_data, future, deadline)
+        except Exception:
+            self._slots.release()
+            raise
+        
+        with self._lock:
+            self._stats['submitted'] += 1
+        task.add_done_callback(lambda t: self._slots.release())
+        # 任务异常结束时同样完成Future，调用方不会一直等待
+        task.add_done_callback(lambda t: _resolve(future, None))
+        future.add_done_callback(lambda f: self._on_cancel(f, task))
+        return observe_future('asr', future)
+
+    def _on_cancel(self, future, task):
+        """Future被取消时，撤销尚未开始执行的任务"""
+        if future.cancelled() and task.cancel():
+            with self._lock:
+                self._stats['cancelled'] += 1
+
+    def _recognize(self, audio_data, future=None, deadline=None):
+        """在工作线程中执行一次独立的识别会话"""
+        timeout = self.timeout if deadline is None else deadline - time.monotonic()
+        if timeout <= 0:
+            logger.error("ASR识别任务排队超过截止时间")
+            with self._lock:
+                self._stats['failed'] += 1
+            _resolve(future, None)
+            return None
+        
+        with self._lock:
+            self._stats['running'] += 1
+        try:
+            session = ASRSession(
+                self,
+                audio_data,
+                frame_size=self.frame_size,
+                frame_interval=0 if self.burst_mode else self.frame_interval,
+                future=future
+            )
+            result = session.run(timeout=timeout)
+        except Exception as e:
+            logger.error(f"ASR识别异常: {str(e)}")
+            result = None
+        
+        with self._lock:
+            self._stats['running'] -= 1
+            if future is not None and future.cancelled():
+                self._stats['cancelled'] += 1
+            else:
+                self._stats['completed' if result else 'failed'] += 1
+        return result
+
+    def get_stats(self):
+        """获取识别线程池统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = max(stats['submitted'] - stats['completed'] - stats['failed'] - stats['cancelled']
+                              - stats['running'], 0)
+        stats['max_workers'] = self.max_workers
+        stats['queue_size'] = self.queue_size
+        stats['frame_size'] = self.frame_size
+        stats['frame_interval'] = self.frame_interval
+        stats['burst_mode'] = self.burst_mode
+        stats['transport'] = self.transport.get_stats()
+        return stats
\ No newline at end of file
@@ -0,0 +1,520 @@
+# -*- coding: utf-8 -*-
+"""
+黄鹏AI对话工具 - 异步服务模式
+基于asyncio/aiohttp：Kimi使用异步HTTP客户端，讯飞TTS/ASR使用异步websocket客户端，
+等待上游期间不占用线程，单进程即可承载大量并发的语音请求。
+
+提供 /chat、/recognize、/synthesize、/audio/<path>、/health、/stats 接口，
+与Flask版本的请求和响应格式一致；页面仍由Flask版本提供。
+
+用法：
+    python async_app.py
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+
+import app as flask_app
+from app import (
+    config,
+    build_kimi_request,
+    kimi_request_key,
+    cached_reply,
+    prepare_pcm_for_asr,
+    get_audio_url,
+    is_valid_history,
+    resolve_history,
+    remember_turn,
+    KIMI_BUSY_REPLY,
+    KIMI_ERROR_REPLY,
+)
+from metrics import (REGISTRY, HTTP_REQUESTS, HTTP_REQUEST_SECONDS, HTTP_INFLIGHT, UPSTREAM_ERRORS, AUDIO_BYTES,
+                     observe_stage)
+from tracing import start_trace, end_trace, bind
+from single_flight import AsyncSingleFlight
+from asr_service import extract_text, STATUS_FIRST_FRAME, STATUS_CONTINUE_FRAME, STATUS_LAST_FRAME
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncKimiClient:
+    """基于aiohttp连接池的异步Kimi API客户端"""
+
+    def __init__(self, api_url, api_key, limit=100, limit_per_host=100, keepalive_timeout=60,
+                 connect_timeout=5, read_timeout=30, coalesce=False):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self._session = None
+        # 请求体完全相同的并发调用只发起一次，与Flask版本使用相同的键
+        self._flight = AsyncSingleFlight('Kimi') if coalesce else None
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            headers={'Authorization': f'Bearer {self.api_key}'}
+        )
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+
+    async def chat(self, message, conversation_history=None):
+        """调用Kimi API进行对话，出错时返回兜底回复"""
+        with observe_stage('llm'):
+            return await self._chat(message, conversation_history)
+
+    async def _chat(self, message, conversation_history):
+        try:
+            reply, cacheable = cached_reply(message, conversation_history)
+            if reply is not None:
+                return reply
+
+            data = build_kimi_request(message, conversation_history)
+            if self._flight:
+                reply = await self._flight.do(kimi_request_key(data), self._request_reply, data)
+            else:
+                reply = await self._request_reply(data)
+
+            if cacheable and reply != KIMI_BUSY_REPLY:
+                flask_app.reply_cache.put(message, reply)
+            return reply
+
+        except Exception as e:
+            logger.error(f"调用Kimi API失败: {str(e)}")
+            UPSTREAM_ERRORS.inc('kimi', 'exception')
+            return KIMI_ERROR_REPLY
+
+    async def _request_reply(self, data):
+        """发送一次对话请求，上游返回错误状态时返回繁忙提示"""
+        async with self._session.post(self.api_url, json=data) as response:
+            if response.status == 200:
+                result = await response.json()
+                return result['choices'][0]['message']['content']
+            logger.error(f"Kimi API error: {response.status}, {await response.text()}")
+            UPSTREAM_ERRORS.inc('kimi', str(response.status))
+            return KIMI_BUSY_REPLY
+
+    def get_flight_stats(self):
+        """相同请求合并的统计信息，未启用时返回None"""
+        return self._flight.get_stats() if self._flight else None
+
+
+class AsyncTTSClient:
+    """通过异步websocket调用讯飞TTS，复用同步服务的鉴权、请求参数、缓存和存储"""
+
+    def __init__(self, service, session, max_concurrency=64, coalesce=False):
+        self.service = service
+        self.session = session
+        self._semaphore = asyncio.Semaphore(max_concurrency)  # 与讯飞并发配额对应
+        self._flight = AsyncSingleFlight('TTS') if coalesce else None  # 并发的相同文本只合成一次
+
+    async def synthesize(self, text):
+        """语音合成，成功返回WAV文件路径，失败返回None"""
+        with observe_stage('tts'):
+            return await self._synthesize(text)
+
+    async def _synthesize(self, text):
+        service = self.service
+        cache_key = None
+        if service.cache:
+            cache_key = service.cache.make_key(text, service.get_cache_params())
+            cached_path = service.cache.get(cache_key)
+            if cached_path:
+                logger.info(f"TTS缓存命中: {cached_path}")
+                return cached_path
+
+        if self._flight:
+            return await self._flight.do(text, self._synthesize_uncached, text, cache_key)
+        return await self._synthesize_uncached(text, cache_key)
+
+    async def _synthesize_uncached(self, text, cache_key):
+        """未命中缓存时的合成流程，返回WAV文件路径"""
+        service = self.service
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._semaphore:
+                pcm_data = await asyncio.wait_for(self._synthesize_pcm(text), service.timeout)
+        except asyncio.TimeoutError:
+            logger.error("TTS合成超时")
+            return None
+        except aiohttp.ClientError as e:
+            logger.error(f"TTS WebSocket错误: {str(e)}")
+            UPSTREAM_ERRORS.inc('xfyun_tts', 'connection')
+            return None
+        except Exception as e:
+            logger.error(f"TTS合成异常: {str(e)}")
+            return None
+
+        if pcm_data is None:
+            return None
+        AUDIO_BYTES.inc('tts_pcm', amount=len(pcm_data))
+
+        # 写文件放到线程池执行，不阻塞事件循环
+        if cache_key:
+            return await loop.run_in_executor(
+                None, bind(service.cache.put), cache_key, lambda path: service.convert_pcm_to_wav(pcm_data, path)
+            )
+        return await loop.run_in_executor(None, bind(service.convert_pcm_to_wav), pcm_data)
+
+    async def _synthesize_pcm(self, text):
+        audio_data = bytearray()
+        async with self.session.ws_connect(self.service.create_url(), ssl=False) as ws:
+            await ws.send_str(json.dumps(self.service.build_request(text)))
+
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    break
+                message = json.loads(msg.data)
+                code = message["code"]
+                if code != 0:
+                    logger.error(f"TTS Error: {message.get('message')}, Code: {code}")
+                    UPSTREAM_ERRORS.inc('xfyun_tts', str(code))
+                    return None
+
+                data = message["data"]
+                audio_data.extend(base64.b64decode(data["audio"]))
+                if data["status"] == 2:
+                    logger.info("TTS synthesis complete")
+                    return bytes(audio_data)
+
+        logger.error("TTS连接在合成完成前关闭")
+        UPSTREAM_ERRORS.inc('xfyun_tts', 'connection')
+        return None
+
+    def get_flight_stats(self):
+        """相同文本合并的统计信息，未启用时返回None"""
+        return self._flight.get_stats() if self._flight else None
+
+
+class AsyncASRClient:
+    """通过异步websocket调用讯飞IAT，发送与接收在同一事件循环中并发进行"""
+
+    def __init__(self, service, session, max_concurrency=64):
+        self.service = service
+        self.session = session
+        self._semaphore = asyncio.Semaphore(max_concurrency)  # 与讯飞并发配额对应
+
+    async def recognize(self, audio_data):
+        """语音识别，成功返回识别文本，失败返回None"""
+        AUDIO_BYTES.inc('asr_pcm', amount=len(audio_data))
+        with observe_stage('asr'):
+            return await self._recognize_with_timeout(audio_data)
+
+    async def _recognize_with_timeout(self, audio_data):
+        try:
+            async with self._semaphore:
+                return await asyncio.wait_for(self._recognize(audio_data), self.service.timeout)
+        except asyncio.TimeoutError:
+            logger.error("ASR识别超时")
+        except aiohttp.ClientError as e:
+            logger.error(f"ASR WebSocket错误: {str(e)}")
+            UPSTREAM_ERRORS.inc('xfyun_asr', 'connection')
+        except Exception as e:
+            logger.error(f"ASR识别异常: {str(e)}")
+        return None
+
+    async def _recognize(self, audio_data):
+        async with self.session.ws_connect(self.service.create_url(), ssl=False) as ws:
+            sender = asyncio.ensure_future(self._send_audio(ws, audio_data))
+            try:
+                text = ""
+                async for msg in ws:
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        break
+                    message = json.loads(msg.data)
+                    code = message["code"]
+                    if code != 0:
+                        logger.error(f"ASR Error: {message.get('message')}, Code: {code}")
+                        UPSTREAM_ERRORS.inc('xfyun_asr', str(code))
+                        return None
+
+                    data = message.get("data")
+                    if data:
+                        text += extract_text(data)
+                        if data.get("status") == 2:
+                            logger.info("ASR recognition complete")
+                            return text
+            finally:
+                # 等发送任务真正结束，不留下未取回结果的任务
+                sender.cancel()
+                try:
+                    await sender
+                except asyncio.CancelledError:
+                    pass
+
+        logger.error("ASR连接在识别完成前关闭")
+        UPSTREAM_ERRORS.inc('xfyun_asr', 'connection')
+        return None
+
+    async def _send_audio(self, ws, audio_data):
+        """按配置的帧大小和帧间隔发送音频"""
+        service = self.service
+        frame_size = service.frame_size
+        frame_interval = 0 if service.burst_mode else service.frame_interval
+        loop = asyncio.get_running_loop()
+        next_send = loop.time()
+
+        try:
+            for i in range(0, len(audio_data), frame_size):
+                status = STATUS_FIRST_FRAME if i == 0 else STATUS_CONTINUE_FRAME
+                await ws.send_str(json.dumps(service.build_audio_frame(audio_data[i:i+frame_size], status)))
+                if frame_interval > 0:
+                    next_send += frame_interval
+                    await asyncio.sleep(max(next_send - loop.time(), 0))
+
+            await ws.send_str(json.dumps(service.build_audio_frame(b'', STATUS_LAST_FRAME)))
+        except Exception as e:
+            # 发送失败时关闭连接，让接收循环立即结束，而不是一直等到识别超时
+            logger.error(f"ASR发送音频失败: {str(e)}")
+            await ws.close()
+
+
+def error_response(message, status):
+    return web.json_response({'error': message}, status=status)
+
+
+async def chat(request):
+    """处理对话请求"""
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        data = None
+    if not data:
+        return error_response('请求数据格式错误', 400)
+
+    message = data.get('message', '')
+
+    if not message:
+        return error_response('消息不能为空', 400)
+
+    if len(message) > config.MAX_MESSAGE_LENGTH:
+        return error_response(f'消息长度不能超过{config.MAX_MESSAGE_LENGTH}字符', 400)
+
+    if not is_valid_history(data.get('history') or []):
+        return error_response('历史消息格式错误', 400)
+
+    session_id, history = resolve_history(data)
+    response = await request.app['kimi'].chat(message, history)
+    remember_turn(session_id, message, response)
+    return web.json_response({'response': response, 'session_id': session_id, 'status': 'success'})
+
+
+async def recognize(request):
+    """语音识别接口"""
+    try:
+        form = await request.post()
+        audio_file = form.get('audio')
+        if audio_file is None or not hasattr(audio_file, 'file'):
+            return error_response('没有音频文件', 400)
+        if audio_file.filename == '':
+            return error_response('没有选择音频文件', 400)
+
+        audio_data = audio_file.file.read()
+        AUDIO_BYTES.inc('upload', amount=len(audio_data))
+        if len(audio_data) > 5 * 1024 * 1024:  # 5MB限制
+            return error_response('音频文件太大', 400)
+        if len(audio_data) == 0:
+            return error_response('音频数据为空', 400)
+
+        # 格式转换是CPU/子进程工作，放到线程池执行
+        loop = asyncio.get_running_loop()
+        pcm_data = await loop.run_in_executor(None, bind(prepare_pcm_for_asr), audio_data, audio_file.content_type)
+
+        recognition_result = await request.app['asr'].recognize(pcm_data)
+        if recognition_result:
+            return web.json_response({'text': recognition_result, 'status': 'success'})
+        return error_response('语音识别失败，请确保音频清晰并重试', 500)
+
+    except web.HTTPRequestEntityTooLarge:
+        # 请求体超过client_max_size时aiohttp在读取表单时抛出
+        logger.error("音频文件太大")
+        return error_response('音频文件太大', 413)
+    except Exception as e:
+        logger.error(f"语音识别异常: {str(e)}", exc_info=True)
+        return error_response(f'语音识别异常: {str(e)}', 500)
+
+
+async def synthesize(request):
+    """语音合成接口"""
+    try:
+        data = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        data = None
+    if not data:
+        return error_response('请求数据格式错误', 400)
+
+    text = data.get('text', '')
+    if not text:
+        return error_response('文本不能为空', 400)
+    if len(text) > config.MAX_MESSAGE_LENGTH:
+        return error_response(f'文本长度不能超过{config.MAX_MESSAGE_LENGTH}字符', 400)
+
+    audio_file = await request.app['tts'].synthesize(text)
+    if audio_file:
+        return web.json_response({'audio_url': get_audio_url(audio_file), 'status': 'success'})
+    return error_response('语音合成失败', 500)
+
+
+async def serve_audio(request):
+    """提供音频文件"""
+    filename = request.match_info['filename']
+    if not filename.endswith('.wav'):
+        return error_response('不支持的文件格式', 400)
+
+    audio_path = os.path.join(config.AUDIO_FILES_DIR, filename)
+    audio_root = os.path.abspath(config.AUDIO_FILES_DIR)
+    if os.path.commonpath([os.path.abspath(audio_path), audio_root]) != audio_root:
+        return error_response('非法访问', 403)
+
+    if os.path.exists(audio_path):
+        return web.FileResponse(audio_path, headers={'Content-Type': 'audio/wav'})
+    return error_response('音频文件不存在', 404)
+
+
+async def health(request):
+    """健康检查接口"""
+    return web.json_response({
+        'status': 'healthy',
+        'message': '黄鹏AI对话工具运行正常',
+        'version': '1.0.0',
+        'mode': 'async',
+        'features': {
+            'tts': True,
+            'asr': True,
+            'chat': True
+        }
+    })
+
+
+async def stats(request):
+    """获取运行统计信息"""
+    return web.json_response({
+        'tts_cache': flask_app.tts_cache.get_stats() if flask_app.tts_cache else None,
+        'audio_janitor': flask_app.audio_janitor.get_stats(),
+        'audio_decoder': flask_app.audio_decoder.get_stats(),
+        'silence_trimmer': flask_app.silence_trimmer.get_stats() if flask_app.silence_trimmer else None,
+        'sessions': flask_app.session_store.get_stats(),
+        'reply_cache': flask_app.reply_cache.get_stats() if flask_app.reply_cache else None,
+        'tracing': flask_app.trace_recorder.get_stats(),
+        'kimi_single_flight': request.app['kimi'].get_flight_stats(),
+        'tts_single_flight': request.app['tts'].get_flight_stats(),
+    })
+
+
+async def metrics(request):
+    """Prometheus文本格式的运行指标"""
+    return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """统计各接口的请求数、耗时和在途数"""
+    resource = request.match_info.route.resource
+    endpoint = resource.canonical if resource else 'unmatched'
+    start = time.perf_counter()
+    status = 500
+    HTTP_INFLIGHT.inc(endpoint)
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        HTTP_REQUESTS.inc(endpoint, request.method, str(status))
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint)
+        HTTP_INFLIGHT.dec(endpoint)
+
+
+@web.middleware
+async def tracing_middleware(request, handler):
+    """记录请求的分阶段耗时，以Server-Timing头返回"""
+    if not config.TRACE_ENABLED:
+        return await handler(request)
+    trace = start_trace(request.method, request.path)
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        response.headers['Server-Timing'] = trace.server_timing()
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        end_trace()
+        flask_app.trace_recorder.finish(trace, status)
+
+
+async def on_startup(application):
+    kimi = AsyncKimiClient(
+        config.KIMI_API_URL,
+        config.KIMI_API_KEY,
+        limit=config.ASYNC_MAX_CONNECTIONS,
+        limit_per_host=config.ASYNC_MAX_CONNECTIONS,
+        keepalive_timeout=config.KIMI_POOL_IDLE_TIMEOUT,
+        connect_timeout=config.KIMI_CONNECT_TIMEOUT,
+        read_timeout=config.KIMI_READ_TIMEOUT,
+        coalesce=config.KIMI_COALESCE
+    )
+    await kimi.start()
+
+    # 讯飞websocket连接共用一个会话
+    xfyun_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=config.ASYNC_MAX_CONNECTIONS)
+    )
+
+    application['kimi'] = kimi
+    application['xfyun_session'] = xfyun_session
+    application['tts'] = AsyncTTSClient(flask_app.tts_service, xfyun_session, config.ASYNC_TTS_CONCURRENCY,
+                                        coalesce=config.TTS_COALESCE)
+    application['asr'] = AsyncASRClient(flask_app.asr_service, xfyun_session, config.ASYNC_ASR_CONCURRENCY)
+
+
+async def on_cleanup(application):
+    await application['kimi'].close()
+    await application['xfyun_session'].close()
+
+
+def create_app():
+    """创建aiohttp应用"""
+    application = web.Application(client_max_size=6 * 1024 * 1024, middlewares=[metrics_middleware, tracing_middleware])
+    application.router.add_post('/chat', chat)
+    application.router.add_post('/recognize', recognize)
+    application.router.add_post('/synthesize', synthesize)
+    application.router.add_get('/audio/{filename:.+}', serve_audio)
+    application.router.add_get('/health', health)
+    application.router.add_get('/stats', stats)
+    application.router.add_get('/metrics', metrics)
+    application.on_startup.append(on_startup)
+    application.on_cleanup.append(on_cleanup)
+    return application
+
+
+if __name__ == '__main__':
+    os.makedirs(config.AUDIO_FILES_DIR, exist_ok=True)
+
+    print("=" * 60)
+    print("🎉 黄鹏AI对话工具启动中（异步模式）...")
+    print(f"📱 访问地址: http://{config.HOST}:{config.PORT}")
+    print("=" * 60)
+
+    web.run_app(create_app(), host=config.HOST, port=config.PORT)
@@ -0,0 +1,350 @@
+# -*- coding:utf-8 -*-
+"""
+音频解码
+把上传的音频转换为16kHz单声道16位PCM，全程不落盘。
+优先使用进程内的PyAV解码；不可用时使用预先启动的ffmpeg进程池，
+进程启动开销不再出现在请求路径上。
+"""
+
+import io
+import logging
+import subprocess
+import threading
+from collections import deque
+
+try:
+    import av
+except ImportError:
+    av = None
+
+logger = logging.getLogger(__name__)
+
+# 16kHz 单声道 s16le，即讯飞IAT要求的输入格式
+PCM_SAMPLE_RATE = 16000
+PCM_CHANNELS = 1
+
+
+class FFmpegDecoder:
+    """基于ffmpeg管道的音频解码器，可用性只在启动时检测一次"""
+
+    def __init__(self, ffmpeg_path='ffmpeg', timeout=10, max_output_bytes=PCM_SAMPLE_RATE * 2 * 60):
+        self.ffmpeg_path = ffmpeg_path
+        self.timeout = timeout  # 单次解码超时（秒）
+        self.max_output_bytes = max_output_bytes  # 输出PCM上限，默认60秒音频
+        self.available = self.probe()
+
+    def probe(self):
+        """检测ffmpeg是否可用"""
+        try:
+            subprocess.run([self.ffmpeg_path, '-version'], capture_output=True, check=True, timeout=5)
+            logger.info("FFmpeg已安装")
+            return True
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError, OSError):
+            logger.warning("FFmpeg未安装或不可用")
+            return False
+
+    def build_command(self):
+        """ffmpeg命令：从stdin读取任意格式，向stdout输出PCM"""
+        return [
+            self.ffmpeg_path,
+            '-hide_banner',
+            '-loglevel', 'error',
+            '-i', 'pipe:0',
+            '-acodec', 'pcm_s16le',
+            '-ar', str(PCM_SAMPLE_RATE),
+            '-ac', str(PCM_CHANNELS),
+            '-f', 's16le',
+            'pipe:1'
+        ]
+
+    def spawn(self):
+        """启动一个等待输入的ffmpeg进程"""
+        return subprocess.Popen(
+            self.build_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+
+    def decode(self, data):
+        """解码音频数据，成功返回PCM字节，失败、超时或输出超限返回None"""
+        return self.run(self.spawn(), data)
+
+    def run(self, process, data):
+        """把音频数据送入一个已启动的ffmpeg进程并读取PCM输出"""
+        stderr_chunks = []
+        failure = []
+
+        def feed_stdin():
+            try:
+                process.stdin.write(data)
+            except (BrokenPipeError, OSError):
+                # ffmpeg提前退出（格式错误或被终止），错误由返回码体现
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    pass
+
+        def drain_stderr():
+            for line in process.stderr:
+                # 只保留最后几行错误信息，避免无界增长
+                stderr_chunks.append(line)
+                del stderr_chunks[:-20]
+
+        def on_timeout():
+            failure.append('timeout')
+            process.kill()
+
+        writer = threading.Thread(target=feed_stdin, daemon=True)
+        err_reader = threading.Thread(target=drain_stderr, daemon=True)
+        timer = threading.Timer(self.timeout, on_timeout)
+        writer.start()
+        err_reader.start()
+        timer.start()
+
+        output = bytearray()
+        try:
+            while True:
+                chunk = process.stdout.read(65536)
+                if not chunk:
+                    break
+                output.extend(chunk)
+                if len(output) > self.max_output_bytes:
+                    failure.append('too_large')
+                    process.kill()
+                    break
+            process.wait()
+        finally:
+            timer.cancel()
+            writer.join(timeout=1)
+            err_reader.join(timeout=1)
+            process.stdout.close()
+            process.stderr.close()
+
+        if 'timeout' in failure:
+            logger.error(f"FFmpeg转换超时（{self.timeout}秒）")
+            return None
+        if 'too_large' in failure:
+            logger.error(f"FFmpeg输出超过上限 {self.max_output_bytes} bytes")
+            return None
+        if process.returncode != 0:
+            stderr = b''.join(stderr_chunks).decode('utf-8', errors='replace')
+            logger.error(f"FFmpeg转换失败: {stderr}")
+            return None
+
+        logger.info(f"PCM数据大小: {len(output)} bytes")
+        return bytes(output)
+
+    def get_stats(self):
+        """获取解码器统计信息"""
+        return {'backend': 'ffmpeg', 'available': self.available}
+
+    def close(self):
+        pass
+
+
+class FFmpegWorkerPool:
+    """预先启动的ffmpeg进程池
+
+    每个请求取走一个已完成启动、正在等待输入的进程，后台线程随即补充新进程；
+    空闲进程定期做存活检查，异常退出的进程会被替换。
+    """
+
+    def __init__(self, decoder, size=2, health_interval=30):
+        self.decoder = decoder
+        self.size = size  # 保持就绪的进程数
+        self.health_interval = health_interval  # 存活检查周期（秒）
+        self.available = decoder.available
+
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._stats = {
+            'spawned': 0,
+            'warm_starts': 0,
+            'cold_starts': 0,
+            'restarts': 0,
+            'failures': 0,
+        }
+
+        self._thread = None
+        if self.available:
+            self._thread = threading.Thread(target=self._maintain, name='ffmpeg-pool', daemon=True)
+            self._thread.start()
+
+    def _maintain(self):
+        """补充进程并检查空闲进程是否存活"""
+        while not self._stop.is_set():
+            self._reap_dead()
+            while not self._stop.is_set():
+                with self._lock:
+                    if len(self._idle) >= self.size:
+                        break
+                try:
+                    process = self.decoder.spawn()
+                except OSError as e:
+                    logger.error(f"启动ffmpeg进程失败: {str(e)}")
+                    break
+                with self._lock:
+                    self._idle.append(process)
+                    self._stats['spawned'] += 1
+            self._wakeup.wait(self.health_interval)
+            self._wakeup.clear()
+
+    def _reap_dead(self):
+        """移除已退出的空闲进程"""
+        alive = deque()
+        dead = []
+        with self._lock:
+            for process in self._idle:
+                (alive if process.poll() is None else dead).append(process)
+            self._idle = alive
+            self._stats['restarts'] += len(dead)
+        for process in dead:
+            logger.warning(f"ffmpeg空闲进程异常退出（返回码 {process.returncode}），将重新启动")
+            self._cleanup(process)
+
+    @staticmethod
+    def _cleanup(process):
+        for stream in (process.stdin, process.stdout, process.stderr):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+    def _take(self):
+        """取出一个存活的就绪进程，没有时返回None"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                process = self._idle.popleft()
+            if process.poll() is None:
+                return process
+            with self._lock:
+                self._stats['restarts'] += 1
+            self._cleanup(process)
+
+    def decode(self, data):
+        """使用就绪进程解码，进程池为空时临时启动新进程"""
+        process = self._take()
+        if process is None:
+            process = self.decoder.spawn()
+            with self._lock:
+                self._stats['cold_starts'] += 1
+        else:
+            with self._lock:
+                self._stats['warm_starts'] += 1
+        self._wakeup.set()
+
+        pcm_data = self.decoder.run(process, data)
+        if pcm_data is None:
+            with self._lock:
+                self._stats['failures'] += 1
+        return pcm_data
+
+    def get_stats(self):
+        """获取进程池统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        stats['backend'] = 'ffmpeg_pool'
+        stats['available'] = self.available
+        stats['size'] = self.size
+        return stats
+
+    def close(self):
+        """停止补充进程并终止全部空闲进程"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for process in idle:
+            process.kill()
+            process.wait()
+            self._cleanup(process)
+
+
+class PyAVDecoder:
+    """基于PyAV（libav）的进程内解码器，无需启动子进程"""
+
+    def __init__(self, max_output_bytes=PCM_SAMPLE_RATE * 2 * 60):
+        self.max_output_bytes = max_output_bytes
+        self.available = av is not None
+        self._lock = threading.Lock()
+        self._stats = {'decodes': 0, 'failures': 0}
+
+    def decode(self, data):
+        """解码音频数据，成功返回PCM字节，失败或输出超限返回None"""
+        try:
+            pcm_data = self._decode(data)
+        except Exception as e:
+            logger.error(f"PyAV解码失败: {str(e)}")
+            pcm_data = None
+
+        with self._lock:
+            self._stats['decodes' if pcm_data is not None else 'failures'] += 1
+        if pcm_data is not None:
+            logger.info(f"PCM数据大小: {len(pcm_data)} bytes")
+        return pcm_data
+
+    def _decode(self, data):
+        output = bytearray()
+        resampler = av.AudioResampler(format='s16', layout='mono', rate=PCM_SAMPLE_RATE)
+
+        def append(frames):
+            # 旧版PyAV返回单个帧，新版返回帧列表
+            if frames is None:
+                return
+            if not isinstance(frames, list):
+                frames = [frames]
+            for frame in frames:
+                # 平面缓冲区可能带有对齐填充，只取有效采样
+                output.extend(bytes(frame.planes[0])[:frame.samples * 2])
+
+        with av.open(io.BytesIO(data)) as container:
+            stream = container.streams.audio[0]
+            for frame in container.decode(stream):
+                append(resampler.resample(frame))
+                if len(output) > self.max_output_bytes:
+                    logger.error(f"解码输出超过上限 {self.max_output_bytes} bytes")
+                    return None
+            append(resampler.resample(None))
+
+        return bytes(output)
+
+    def get_stats(self):
+        """获取解码器统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['backend'] = 'pyav'
+        stats['available'] = self.available
+        return stats
+
+    def close(self):
+        pass
+
+
+def create_audio_decoder(backend='auto', pool_size=2, health_interval=30, timeout=10,
+                         max_output_bytes=PCM_SAMPLE_RATE * 2 * 60):
+    """根据配置创建解码器
+
+    backend: auto（优先PyAV，其次ffmpeg进程池）、pyav、ffmpeg_pool、ffmpeg（每次启动新进程）
+    """
+    if backend in ('auto', 'pyav'):
+        decoder = PyAVDecoder(max_output_bytes=max_output_bytes)
+        if decoder.available:
+            logger.info("使用PyAV进程内解码")
+            return decoder
+        if backend == 'pyav':
+            logger.warning("PyAV未安装，改用ffmpeg进程池")
+
+    ffmpeg = FFmpegDecoder(timeout=timeout, max_output_bytes=max_output_bytes)
+    if backend == 'ffmpeg' or pool_size <= 0:
+        return ffmpeg
+    return FFmpegWorkerPool(ffmpeg, size=pool_size, health_interval=health_interval)
@@ -0,0 +1,206 @@
+# -*- coding:utf-8 -*-
+"""
+上传音频格式识别与WAV/PCM快速处理
+根据文件头识别格式；WAV和裸PCM直接在进程内转换为16kHz单声道16位PCM，不经过ffmpeg
+"""
+
+import logging
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+TARGET_SAMPLE_RATE = 16000
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+RAW_PCM_CONTENT_TYPES = ('audio/l16', 'audio/pcm')  # 声明为裸PCM的MIME类型
+UNTYPED_CONTENT_TYPES = ('', 'application/octet-stream')  # 等同于没有声明类型
+
+
+def sniff_audio_format(data):
+    """根据文件头魔数识别音频容器格式，无法识别时返回'unknown'"""
+    if len(data) >= 12 and data[:4] in (b'RIFF', b'RIFX') and data[8:12] == b'WAVE':
+        return 'wav'
+    if data[:4] == b'\x1a\x45\xdf\xa3':
+        return 'webm'  # EBML头，WebM/Matroska
+    if data[:4] == b'OggS':
+        return 'ogg'
+    if data[:4] == b'fLaC':
+        return 'flac'
+    if len(data) >= 8 and data[4:8] == b'ftyp':
+        return 'mp4'
+    if data[:3] == b'ID3' or is_mpeg_frame_header(data):
+        return 'mp3'
+    return 'unknown'
+
+
+def is_mpeg_frame_header(data):
+    """判断开头是否为完整合法的MPEG音频帧头
+
+    只看同步位时，首个采样为-1、-257等值的裸PCM也会被误认成MP3，
+    因此还要求版本、层、码率索引和采样率索引都不是保留值（码率索引也排除不常见的free格式）。
+    """
+    if len(data) < 4 or data[0] != 0xFF or data[1] & 0xE0 != 0xE0:
+        return False
+    version = (data[1] >> 3) & 0x03
+    layer = (data[1] >> 1) & 0x03
+    bitrate_index = data[2] >> 4
+    sample_rate_index = (data[2] >> 2) & 0x03
+    return version != 1 and layer != 0 and bitrate_index not in (0, 15) and sample_rate_index != 3
+
+
+def is_raw_pcm_content_type(content_type):
+    """声明类型是否为裸PCM（如 audio/L16;rate=44100），此时不再按文件头猜测格式"""
+    mime = (content_type or '').split(';')[0].strip().lower()
+    return mime in RAW_PCM_CONTENT_TYPES
+
+
+def is_untyped_content_type(content_type):
+    """是否没有声明具体类型（缺失或application/octet-stream）"""
+    mime = (content_type or '').split(';')[0].strip().lower()
+    return mime in UNTYPED_CONTENT_TYPES
+
+
+def parse_content_type_rate(content_type, default=TARGET_SAMPLE_RATE):
+    """从 audio/L16;rate=44100 这类MIME类型中取出采样率"""
+    for param in (content_type or '').split(';')[1:]:
+        key, _, value = param.strip().partition('=')
+        if key.lower() == 'rate' and value.isdigit():
+            return int(value)
+    return default
+
+
+def parse_wav(data):
+    """解析WAV文件头
+
+    返回 (格式信息, 采样数据)，格式信息包含 format/channels/sample_rate/sample_width；
+    不是合法WAV时返回 (None, None)。
+    """
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        return None, None
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack_from('<I', data, offset + 4)[0]
+        body = offset + 8
+
+        if chunk_id == b'fmt ' and chunk_size >= 16:
+            if body + 16 > len(data):
+                return None, None  # fmt块被截断
+            audio_format, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', data, body)
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40 and body + 26 <= len(data):
+                # 子格式GUID的前两个字节即实际格式编号
+                audio_format = struct.unpack_from('<H', data, body + 24)[0]
+            fmt = {
+                'format': audio_format,
+                'channels': channels,
+                'sample_rate': sample_rate,
+                'sample_width': bits // 8,
+            }
+        elif chunk_id == b'data':
+            if fmt is None:
+                return None, None
+            # 浏览器流式录制的WAV可能把data长度写成0或0xFFFFFFFF，此时取到文件末尾
+            end = len(data) if chunk_size in (0, 0xFFFFFFFF) else min(body + chunk_size, len(data))
+            return fmt, data[body:end]
+
+        # 块按偶数字节对齐
+        offset = body + chunk_size + (chunk_size & 1)
+
+    return None, None
+
+
+def _design_lowpass(cutoff, num_taps=63):
+    """设计加窗sinc低通滤波器，cutoff为相对于采样率的归一化截止频率（0~0.5）"""
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(num_taps)
+    return taps / taps.sum()
+
+
+def _to_float_samples(samples, sample_width, audio_format):
+    """把交织的原始采样转换为[-1, 1]范围的float32数组"""
+    if audio_format == WAVE_FORMAT_IEEE_FLOAT:
+        dtype = {4: '<f4', 8: '<f8'}.get(sample_width)
+        if dtype is None:
+            return None
+        return np.frombuffer(samples, dtype=dtype).astype(np.float32)
+
+    if sample_width == 1:
+        return (np.frombuffer(samples, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    if sample_width == 2:
+        return np.frombuffer(samples, dtype='<i2').astype(np.float32) / 32768.0
+    if sample_width == 3:
+        raw = np.frombuffer(samples, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        values = np.where(values & 0x800000, values - 0x1000000, values)
+        return values.astype(np.float32) / 8388608.0
+    if sample_width == 4:
+        return np.frombuffer(samples, dtype='<i4').astype(np.float32) / 2147483648.0
+    return None
+
+
+def convert_to_pcm16k(samples, sample_rate, channels=1, sample_width=2, audio_format=WAVE_FORMAT_PCM):
+    """把任意采样率/声道/位深的采样转换为16kHz单声道s16le
+
+    已经是目标格式时原样返回；需要转换但NumPy不可用或格式不支持时返回None。
+    """
+    if (audio_format == WAVE_FORMAT_PCM and sample_width == 2 and channels == 1
+            and sample_rate == TARGET_SAMPLE_RATE):
+        return samples[:len(samples) - len(samples) % 2]
+
+    if np is None:
+        logger.warning("NumPy未安装，无法在进程内重采样")
+        return None
+    if channels < 1 or sample_rate <= 0:
+        return None
+
+    frame_bytes = sample_width * channels
+    samples = samples[:len(samples) - len(samples) % frame_bytes]
+    values = _to_float_samples(samples, sample_width, audio_format)
+    if values is None:
+        return None
+
+    # 多声道取平均混为单声道
+    mono = values.reshape(-1, channels).mean(axis=1) if channels > 1 else values
+
+    if sample_rate != TARGET_SAMPLE_RATE and len(mono):
+        if sample_rate > TARGET_SAMPLE_RATE:
+            # 降采样前先低通滤波，防止混叠
+            cutoff = 0.5 * TARGET_SAMPLE_RATE / sample_rate
+            mono = np.convolve(mono, _design_lowpass(cutoff), mode='same')
+        duration = len(mono) / sample_rate
+        target_len = int(round(duration * TARGET_SAMPLE_RATE))
+        positions = np.arange(target_len) * (sample_rate / TARGET_SAMPLE_RATE)
+        mono = np.interp(positions, np.arange(len(mono)), mono)
+
+    pcm = np.clip(np.round(mono * 32767.0), -32768, 32767).astype('<i2')
+    return pcm.tobytes()
+
+
+def wav_to_pcm16k(data):
+    """WAV快速路径：解析文件头并转换为16kHz单声道s16le，无法处理时返回None"""
+    fmt, samples = parse_wav(data)
+    if fmt is None:
+        logger.warning("WAV文件头解析失败")
+        return None
+    if fmt['format'] not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        logger.warning(f"不支持的WAV编码: {fmt['format']}")
+        return None
+
+    logger.info(f"WAV格式: {fmt['sample_rate']}Hz, {fmt['channels']}声道, {fmt['sample_width'] * 8}位")
+    return convert_to_pcm16k(
+        samples,
+        fmt['sample_rate'],
+        channels=fmt['channels'],
+        sample_width=fmt['sample_width'],
+        audio_format=fmt['format']
+    )
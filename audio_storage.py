@@ -0,0 +1,146 @@
+# -*- coding:utf-8 -*-
+"""
+合成音频文件存储
+文件按随机ID哈希前缀分目录存放，并由后台清理线程按保留时间和总大小回收
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class AudioStorage:
+    """分片目录布局的音频文件存储"""
+
+    def __init__(self, root_dir, shard_width=2):
+        self.root_dir = root_dir
+        self.shard_width = shard_width  # 子目录名取文件ID的前几位十六进制字符
+
+    def new_path(self, suffix='.wav'):
+        """分配一个不会冲突的新文件路径，并确保所在子目录存在"""
+        file_id = uuid.uuid4().hex
+        shard_dir = os.path.join(self.root_dir, file_id[:self.shard_width])
+        os.makedirs(shard_dir, exist_ok=True)
+        return os.path.join(shard_dir, f"audio_{file_id}{suffix}")
+
+
+class AudioJanitor:
+    """后台清理过期音频文件，并把目录总大小控制在上限以内"""
+
+    def __init__(self, root_dir, ttl=3600, max_bytes=500 * 1024 * 1024, interval=300, exclude_dirs=()):
+        self.root_dir = root_dir
+        self.ttl = ttl  # 文件保留时间（秒）
+        self.max_bytes = max_bytes  # 目录总大小上限（字节）
+        self.interval = interval  # 清理周期（秒）
+        self.exclude_dirs = {os.path.abspath(d) for d in exclude_dirs}  # 自行管理容量的目录（如TTS缓存）
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {
+            'sweeps': 0,
+            'files_reclaimed': 0,
+            'bytes_reclaimed': 0,
+            'files': 0,
+            'bytes': 0,
+            'last_sweep_seconds': 0.0,
+        }
+
+    def start(self):
+        """启动后台清理线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='audio-janitor', daemon=True)
+        self._thread.start()
+        logger.info(f"音频清理线程已启动: 保留 {self.ttl}s, 上限 {self.max_bytes} bytes, 周期 {self.interval}s")
+
+    def stop(self):
+        """停止后台清理线程"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"音频清理失败: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def _scan(self):
+        """列出受管理的全部音频文件 (修改时间, 大小, 路径)"""
+        files = []
+        pending = [self.root_dir]
+        while pending:
+            directory = pending.pop()
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if os.path.abspath(entry.path) not in self.exclude_dirs:
+                        pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and entry.name.endswith('.wav'):
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, entry.path))
+        return files
+
+    def sweep(self):
+        """执行一次清理：先删除过期文件，再按从旧到新删除直至低于大小上限"""
+        started = time.monotonic()
+        now = time.time()
+        files = sorted(self._scan())
+        total_bytes = sum(size for _, size, _ in files)
+        reclaimed_files = 0
+        reclaimed_bytes = 0
+
+        remaining = []
+        for mtime, size, path in files:
+            expired = self.ttl and now - mtime > self.ttl
+            over_budget = self.max_bytes and total_bytes > self.max_bytes
+            if not expired and not over_budget:
+                remaining.append(path)
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"删除音频文件失败: {str(e)}")
+                remaining.append(path)
+                continue
+            total_bytes -= size
+            reclaimed_files += 1
+            reclaimed_bytes += size
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._stats['sweeps'] += 1
+            self._stats['files_reclaimed'] += reclaimed_files
+            self._stats['bytes_reclaimed'] += reclaimed_bytes
+            self._stats['files'] = len(remaining)
+            self._stats['bytes'] = total_bytes
+            self._stats['last_sweep_seconds'] = round(elapsed, 4)
+
+        if reclaimed_files:
+            logger.info(f"音频清理完成: 回收 {reclaimed_files} 个文件, {reclaimed_bytes} bytes")
+        return reclaimed_files, reclaimed_bytes
+
+    def get_stats(self):
+        """获取清理统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['ttl'] = self.ttl
+        stats['max_bytes'] = self.max_bytes
+        stats['interval'] = self.interval
+        return stats
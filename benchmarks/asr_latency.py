@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+黄鹏AI对话工具 - ASR发送链路延迟基准测试
+使用本地模拟的websocket连接，对比旧版（固定等待0.5秒 + 40ms帧间隔 + 100ms轮询）
+与事件驱动版本（含预热连接）的单次识别耗时，无需讯飞API密钥和网络
+
+用法：
+    python benchmarks/asr_latency.py [--seconds 2] [--rounds 5] [--handshake 0.15]
+"""
+
+import argparse
+import json
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asr_service
+from asr_service import ASRService, STATUS_FIRST_FRAME, STATUS_CONTINUE_FRAME, STATUS_LAST_FRAME
+
+BYTES_PER_SECOND = 16000 * 2  # 16kHz 16bit 单声道
+
+
+class FakeWebSocketApp:
+    """模拟讯飞IAT websocket：握手延迟后触发on_open，收到最后一帧后返回识别结果"""
+
+    handshake_delay = 0.15
+    result_delay = 0.05
+
+    def __init__(self, url, on_message=None, on_error=None, on_close=None, on_open=None):
+        self.on_message = on_message
+        self.on_error = on_error
+        self.on_close = on_close
+        self.on_open = on_open
+        self.frames = queue.Queue()
+        self.closed = threading.Event()
+
+    def send(self, data):
+        self.frames.put(json.loads(data))
+
+    def close(self):
+        self.closed.set()
+
+    def run_forever(self, **kwargs):
+        time.sleep(self.handshake_delay)
+        if self.on_open:
+            self.on_open(self)
+        while not self.closed.is_set():
+            try:
+                frame = self.frames.get(timeout=0.01)
+            except queue.Empty:
+                continue
+            if frame["data"]["status"] == STATUS_LAST_FRAME:
+                time.sleep(self.result_delay)
+                self.on_message(self, json.dumps({
+                    "code": 0,
+                    "sid": "bench",
+                    "data": {"status": 2, "result": {"ws": [{"cw": [{"w": "你好"}]}]}}
+                }))
+        if self.on_close:
+            self.on_close(self, None, None)
+
+
+class FakeWebSocket:
+    """模拟讯飞传输层返回的同步websocket连接，warm为True时表示预热连接，没有握手延迟"""
+
+    def __init__(self, warm=False):
+        if not warm:
+            time.sleep(FakeWebSocketApp.handshake_delay)
+        self.frames = queue.Queue()
+        self.connected = True
+        self.replied = False
+
+    def send(self, data):
+        self.frames.put(json.loads(data))
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self):
+        if self.replied:
+            return ''
+        while True:
+            frame = self.frames.get()
+            if frame["data"]["status"] == STATUS_LAST_FRAME:
+                time.sleep(FakeWebSocketApp.result_delay)
+                self.replied = True
+                return json.dumps({
+                    "code": 0,
+                    "sid": "bench",
+                    "data": {"status": 2, "result": {"ws": [{"cw": [{"w": "你好"}]}]}}
+                })
+
+    def close(self):
+        self.connected = False
+
+
+def legacy_recognize(service, audio_data, timeout=15):
+    """复现旧版识别流程：固定等待连接、40ms节奏发送、100ms轮询完成状态"""
+    session = asr_service.ASRSession(service, audio_data)
+    ws = asr_service.websocket.WebSocketApp(
+        service.create_url(),
+        on_message=session.on_message,
+        on_error=session.on_error,
+        on_close=lambda *args: None,
+        on_open=lambda *args: None
+    )
+    threading.Thread(target=ws.run_forever, daemon=True).start()
+
+    time.sleep(0.5)
+
+    chunk_size = 1280
+    audio_len = len(audio_data)
+    for i in range(0, audio_len, chunk_size):
+        chunk = audio_data[i:i+chunk_size]
+        if i == 0:
+            status = STATUS_FIRST_FRAME
+        elif i + chunk_size >= audio_len:
+            status = STATUS_LAST_FRAME
+        else:
+            status = STATUS_CONTINUE_FRAME
+        session.send_audio_data(ws, chunk, status)
+        time.sleep(0.04)
+
+    start_time = time.time()
+    while not session.recognition_complete and not session.recognition_error:
+        if time.time() - start_time > timeout:
+            return None
+        time.sleep(0.1)
+    return session.recognition_result
+
+
+def measure(func, rounds):
+    """多次执行并返回每次耗时（秒）"""
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+        if not result:
+            raise RuntimeError("识别失败")
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ASR发送链路延迟基准测试')
+    parser.add_argument('--seconds', type=float, default=2.0, help='模拟音频时长（秒）')
+    parser.add_argument('--rounds', type=int, default=5, help='每种模式的执行次数')
+    parser.add_argument('--handshake', type=float, default=0.15, help='模拟握手延迟（秒）')
+    args = parser.parse_args()
+
+    FakeWebSocketApp.handshake_delay = args.handshake
+    asr_service.websocket.WebSocketApp = FakeWebSocketApp
+
+    audio_data = b'\x00\x00' * int(BYTES_PER_SECOND / 2 * args.seconds)
+    realtime = ASRService('bench', 'key', 'secret')
+    burst = ASRService('bench', 'key', 'secret', burst_mode=True)
+    warm = ASRService('bench', 'key', 'secret', burst_mode=True)
+    realtime.transport.connect = FakeWebSocket
+    burst.transport.connect = FakeWebSocket
+    warm.transport.connect = lambda: FakeWebSocket(warm=True)
+
+    cases = [
+        ("旧版（固定等待 + 轮询）", lambda: legacy_recognize(realtime, audio_data)),
+        ("事件驱动（实时帧间隔）", lambda: realtime.recognize(audio_data)),
+        ("事件驱动（连续发送）", lambda: burst.recognize(audio_data)),
+        ("预热连接（连续发送）", lambda: warm.recognize(audio_data)),
+    ]
+
+    print("=" * 60)
+    print(f"🎤 ASR延迟基准: 音频 {args.seconds}s, 握手 {args.handshake * 1000:.0f}ms, 每项 {args.rounds} 次")
+    print("=" * 60)
+
+    for name, func in cases:
+        samples = measure(func, args.rounds)
+        print(f"{name}: 平均 {statistics.mean(samples) * 1000:.0f}ms, "
+              f"最小 {min(samples) * 1000:.0f}ms, 最大 {max(samples) * 1000:.0f}ms")
+
+
+if __name__ == '__main__':
+    main()
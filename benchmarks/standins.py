@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+黄鹏AI对话工具 - 本地上游替身服务
+在本机模拟Kimi对话补全HTTP接口（含SSE流式）和讯飞TTS/IAT websocket接口，
+延迟、抖动、分帧大小和错误率均可配置，用于没有API密钥和网络时测量本服务的性能。
+
+单独运行后，通过环境变量把服务指向替身：
+    python benchmarks/standins.py --port 18080
+    KIMI_API_URL=http://127.0.0.1:18080/v1/chat/completions \\
+    XFYUN_TTS_URL=ws://127.0.0.1:18080/v2/tts \\
+    XFYUN_ASR_URL=ws://127.0.0.1:18080/v2/iat \\
+    python app.py
+
+基准测试脚本 benchmarks/upstream_bench.py 会在子进程中自动启动替身服务。
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import ssl
+import time
+
+from aiohttp import web
+
+# 替身回复的素材，按句拼接成指定长度，保证回复中有可供分句的标点
+REPLY_SENTENCES = [
+    "谢猪猪，今天过得怎么样呀？",
+    "我刚刚想到一个特别好笑的故事，",
+    "等你有空的时候讲给你听。",
+    "记得多喝水，早点休息哦！",
+    "有什么想聊的随时找我~",
+]
+
+DEFAULT_TRANSCRIPT = "今天天气怎么样"
+
+
+class Behavior:
+    """单个接口的延迟与错误模型：延迟服从截断到0的正态分布"""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rng=None):
+        self.latency = latency  # 平均延迟（秒）
+        self.jitter = jitter  # 延迟的标准差（秒）
+        self.error_rate = error_rate  # 返回错误的概率
+        self.rng = rng or random.Random()
+
+    def delay(self):
+        if not self.jitter:
+            return self.latency
+        return max(self.rng.gauss(self.latency, self.jitter), 0.0)
+
+    def should_fail(self):
+        return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+
+def make_reply(chars):
+    """生成不少于chars个字的回复"""
+    parts = []
+    length = 0
+    index = 0
+    while length < chars:
+        sentence = REPLY_SENTENCES[index % len(REPLY_SENTENCES)]
+        parts.append(sentence)
+        length += len(sentence)
+        index += 1
+    return ''.join(parts)
+
+
+class StandinServer:
+    """Kimi与讯飞接口的替身，一个aiohttp应用同时提供三个接口"""
+
+    def __init__(self, seed=1,
+                 kimi_latency=0.3, kimi_jitter=0.05, kimi_error_rate=0.0, kimi_error_status=429,
+                 kimi_token_interval=0.02, kimi_chunk_chars=2, kimi_reply_chars=40,
+                 handshake_latency=0.05, handshake_jitter=0.01,
+                 tts_latency=0.15, tts_jitter=0.03, tts_error_rate=0.0,
+                 tts_frame_bytes=8000, tts_frame_interval=0.02, tts_bytes_per_char=8000,
+                 asr_latency=0.2, asr_jitter=0.05, asr_error_rate=0.0, asr_transcript=DEFAULT_TRANSCRIPT):
+        rng = random.Random(seed)
+        self.kimi = Behavior(kimi_latency, kimi_jitter, kimi_error_rate, rng)
+        self.kimi_error_status = kimi_error_status  # 注入错误时返回的HTTP状态码
+        self.kimi_token_interval = kimi_token_interval  # 流式响应相邻两块的间隔（秒）
+        self.kimi_chunk_chars = kimi_chunk_chars  # 流式响应每块的字数
+        self.kimi_reply = make_reply(kimi_reply_chars)
+
+        self.handshake = Behavior(handshake_latency, handshake_jitter, rng=rng)  # websocket升级前的等待
+        self.tts = Behavior(tts_latency, tts_jitter, tts_error_rate, rng)  # 首帧音频前的等待
+        self.tts_frame_bytes = tts_frame_bytes  # 每帧音频的字节数
+        self.tts_frame_interval = tts_frame_interval  # 相邻音频帧的间隔（秒）
+        self.tts_bytes_per_char = tts_bytes_per_char  # 每个字对应的PCM字节数（默认0.25秒）
+        self.asr = Behavior(asr_latency, asr_jitter, asr_error_rate, rng)  # 最后一帧到最终结果的等待
+        self.asr_transcript = asr_transcript
+
+        self.stats = {'kimi': 0, 'kimi_stream': 0, 'tts': 0, 'asr': 0, 'errors': 0}
+
+    def create_app(self):
+        application = web.Application(client_max_size=16 * 1024 * 1024)
+        application.router.add_post('/v1/chat/completions', self.chat_completions)
+        application.router.add_get('/v2/tts', self.tts_socket)
+        application.router.add_get('/v2/iat', self.iat_socket)
+        application.router.add_get('/stats', self.get_stats)
+        return application
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+    async def chat_completions(self, request):
+        """Kimi对话补全接口（OpenAI兼容格式）"""
+        data = await request.json()
+        stream = bool(data.get('stream'))
+        self.stats['kimi_stream' if stream else 'kimi'] += 1
+
+        await asyncio.sleep(self.kimi.delay())
+        if self.kimi.should_fail():
+            self.stats['errors'] += 1
+            return web.json_response(
+                {'error': {'message': 'injected error', 'type': 'rate_limit_reached_error'}},
+                status=self.kimi_error_status
+            )
+
+        completion_id = f'chatcmpl-{random.getrandbits(48):012x}'
+        created = int(time.time())
+        model = data.get('model', 'moonshot-v1-8k')
+
+        if not stream:
+            return web.json_response({
+                'id': completion_id,
+                'object': 'chat.completion',
+                'created': created,
+                'model': model,
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': self.kimi_reply},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(self.kimi_reply), 'total_tokens': 0},
+            })
+
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+
+        async def send(delta, finish_reason=None):
+            chunk = {
+                'id': completion_id,
+                'object': 'chat.completion.chunk',
+                'created': created,
+                'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }
+            await response.write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+
+        try:
+            await send({'role': 'assistant', 'content': ''})
+            reply = self.kimi_reply
+            for i in range(0, len(reply), self.kimi_chunk_chars):
+                if i:
+                    await asyncio.sleep(self.kimi_token_interval)
+                await send({'content': reply[i:i + self.kimi_chunk_chars]})
+            await send({}, finish_reason='stop')
+            await response.write(b'data: [DONE]\n\n')
+            await response.write_eof()
+        except ConnectionResetError:
+            # 客户端提前断开（如调用方出错或取消）
+            pass
+        return response
+
+    async def _accept(self, request):
+        await asyncio.sleep(self.handshake.delay())
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        return ws
+
+    async def tts_socket(self, request):
+        """讯飞在线语音合成：收到请求帧后按帧推送音频，最后一帧status为2"""
+        ws = await self._accept(request)
+        self.stats['tts'] += 1
+        msg = await ws.receive()
+        if msg.type != web.WSMsgType.TEXT:
+            return ws
+
+        frame = json.loads(msg.data)
+        text = base64.b64decode(frame['data']['text']).decode('utf-8')
+        sid = f'tts{random.getrandbits(32):08x}'
+
+        await asyncio.sleep(self.tts.delay())
+        if self.tts.should_fail():
+            self.stats['errors'] += 1
+            await ws.send_str(json.dumps({'code': 10114, 'message': 'injected error', 'sid': sid}))
+            await ws.close()
+            return ws
+
+        total = max(len(text), 1) * self.tts_bytes_per_char
+        # 模拟一段低幅度的非静音信号，避免被当作静音处理
+        pcm = (b'\x10\x00\xf0\xff' * (total // 4 + 1))[:total]
+        for offset in range(0, total, self.tts_frame_bytes):
+            if offset:
+                await asyncio.sleep(self.tts_frame_interval)
+            last = offset + self.tts_frame_bytes >= total
+            await ws.send_str(json.dumps({
+                'code': 0,
+                'message': 'success',
+                'sid': sid,
+                'data': {
+                    'audio': base64.b64encode(pcm[offset:offset + self.tts_frame_bytes]).decode('ascii'),
+                    'status': 2 if last else 1,
+                    'ced': str(offset),
+                },
+            }))
+        await ws.close()
+        return ws
+
+    async def iat_socket(self, request):
+        """讯飞语音听写：接收音频帧，收到最后一帧（status为2）后返回识别结果"""
+        ws = await self._accept(request)
+        self.stats['asr'] += 1
+        sid = f'iat{random.getrandbits(32):08x}'
+        received = 0
+
+        async for msg in ws:
+            if msg.type != web.WSMsgType.TEXT:
+                break
+            frame = json.loads(msg.data)
+            data = frame.get('data', {})
+            received += len(data.get('audio', ''))
+            if data.get('status') != 2:
+                continue
+
+            await asyncio.sleep(self.asr.delay())
+            if self.asr.should_fail() or not received:
+                self.stats['errors'] += 1
+                await ws.send_str(json.dumps({'code': 10165, 'message': 'injected error', 'sid': sid}))
+                break
+
+            await ws.send_str(json.dumps({
+                'code': 0,
+                'message': 'success',
+                'sid': sid,
+                'data': {
+                    'status': 2,
+                    'result': {
+                        'sn': 1,
+                        'ls': True,
+                        'ws': [{'bg': 0, 'cw': [{'sc': 0, 'w': self.asr_transcript}]}],
+                    },
+                },
+            }))
+            break
+
+        await ws.close()
+        return ws
+
+
+async def serve(options, host='127.0.0.1', port=0, certfile=None, keyfile=None, ready=None):
+    """启动替身服务并一直运行；ready为队列时启动后放入实际端口"""
+    server = StandinServer(**options)
+    runner = web.AppRunner(server.create_app(), access_log=None)
+    await runner.setup()
+
+    ssl_context = None
+    if certfile:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(certfile, keyfile)
+
+    site = web.TCPSite(runner, host, port, ssl_context=ssl_context)
+    await site.start()
+    actual_port = runner.addresses[0][1]
+    if ready is not None:
+        ready.put(actual_port)
+    else:
+        print(f"替身服务已启动: {'https' if ssl_context else 'http'}://{host}:{actual_port}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def run_process(options, host, port, certfile, keyfile, ready):
+    """子进程入口"""
+    try:
+        asyncio.run(serve(options, host, port, certfile, keyfile, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+def add_arguments(parser):
+    """替身服务的命令行参数，基准测试脚本共用"""
+    group = parser.add_argument_group('上游替身')
+    group.add_argument('--seed', type=int, default=1, help='延迟与错误注入的随机种子')
+    group.add_argument('--kimi-latency', type=float, default=0.3, help='Kimi首个响应前的平均延迟（秒）')
+    group.add_argument('--kimi-jitter', type=float, default=0.05, help='Kimi延迟的标准差（秒）')
+    group.add_argument('--kimi-error-rate', type=float, default=0.0, help='Kimi返回错误的概率')
+    group.add_argument('--kimi-error-status', type=int, default=429, help='Kimi注入错误的HTTP状态码')
+    group.add_argument('--kimi-token-interval', type=float, default=0.02, help='流式响应相邻两块的间隔（秒）')
+    group.add_argument('--kimi-chunk-chars', type=int, default=2, help='流式响应每块的字数')
+    group.add_argument('--kimi-reply-chars', type=int, default=40, help='回复的字数')
+    group.add_argument('--handshake-latency', type=float, default=0.05, help='讯飞websocket握手延迟（秒）')
+    group.add_argument('--handshake-jitter', type=float, default=0.01, help='握手延迟的标准差（秒）')
+    group.add_argument('--tts-latency', type=float, default=0.15, help='TTS首帧音频前的平均延迟（秒）')
+    group.add_argument('--tts-jitter', type=float, default=0.03, help='TTS延迟的标准差（秒）')
+    group.add_argument('--tts-error-rate', type=float, default=0.0, help='TTS返回错误的概率')
+    group.add_argument('--tts-frame-bytes', type=int, default=8000, help='TTS每帧音频字节数')
+    group.add_argument('--tts-frame-interval', type=float, default=0.02, help='TTS相邻音频帧的间隔（秒）')
+    group.add_argument('--tts-bytes-per-char', type=int, default=8000, help='每个字合成的PCM字节数')
+    group.add_argument('--asr-latency', type=float, default=0.2, help='最后一帧音频到识别结果的平均延迟（秒）')
+    group.add_argument('--asr-jitter', type=float, default=0.05, help='识别延迟的标准差（秒）')
+    group.add_argument('--asr-error-rate', type=float, default=0.0, help='识别返回错误的概率')
+    group.add_argument('--asr-transcript', default=DEFAULT_TRANSCRIPT, help='返回的识别文本')
+
+
+def options_from_args(args):
+    """从命令行参数构造StandinServer的参数"""
+    names = [
+        'seed',
+        'kimi_latency', 'kimi_jitter', 'kimi_error_rate', 'kimi_error_status',
+        'kimi_token_interval', 'kimi_chunk_chars', 'kimi_reply_chars',
+        'handshake_latency', 'handshake_jitter',
+        'tts_latency', 'tts_jitter', 'tts_error_rate',
+        'tts_frame_bytes', 'tts_frame_interval', 'tts_bytes_per_char',
+        'asr_latency', 'asr_jitter', 'asr_error_rate', 'asr_transcript',
+    ]
+    return {name: getattr(args, name) for name in names}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Kimi与讯飞接口的本地替身服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=18080, help='监听端口')
+    parser.add_argument('--certfile', help='TLS证书（提供后以https/wss方式服务）')
+    parser.add_argument('--keyfile', help='TLS私钥')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(options_from_args(args), args.host, args.port, args.certfile, args.keyfile))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+黄鹏AI对话工具 - 组件基准测试
+在子进程中启动本地上游替身服务（benchmarks/standins.py），把服务指向替身后，
+以指定并发驱动 call_kimi_api、stream_kimi_api、ASRService 和 TTSService，
+统计吞吐量与 p50/p95/p99 延迟，无需API密钥和网络，相同参数与随机种子下结果可复现。
+
+服务本身的配置仍从环境变量读取（如 TTS_MAX_WORKERS、XFYUN_WARM_POOL_SIZE），便于对比调优效果。
+
+用法：
+    python benchmarks/upstream_bench.py [--suites kimi,kimi_stream,asr,tts,tts_stream]
+                                        [--requests 40] [--concurrency 4] [--json result.json]
+                                        [--kimi-latency 0.3] [--tts-error-rate 0.05] ...
+"""
+
+import argparse
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import standins
+
+SUITES = ['kimi', 'kimi_stream', 'asr', 'tts', 'tts_stream']
+BYTES_PER_SECOND = 16000 * 2  # 16kHz 16bit 单声道
+
+
+def percentile(samples, p):
+    """最近秩法百分位数"""
+    ordered = sorted(samples)
+    index = max(int(round(p / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(name, latencies, errors, elapsed):
+    """汇总一组请求的结果"""
+    result = {
+        'name': name,
+        'requests': len(latencies) + errors,
+        'ok': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+    if latencies:
+        result.update({
+            'mean_ms': round(statistics.mean(latencies) * 1000, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+            'max_ms': round(max(latencies) * 1000, 1),
+        })
+    return result
+
+
+def run_load(func, requests, concurrency):
+    """以固定并发执行func(i)，func返回None表示失败，否则返回本次的各项耗时 {指标: 秒}"""
+    timings = {}
+    errors = 0
+    lock = threading.Lock()
+
+    def one(index):
+        nonlocal errors
+        try:
+            result = func(index)
+        except Exception as e:
+            result = None
+            print(f"  请求{index}异常: {type(e).__name__}: {e}")
+        with lock:
+            if result is None:
+                errors += 1
+                return
+            for metric, seconds in result.items():
+                timings.setdefault(metric, []).append(seconds)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    return timings, errors, time.perf_counter() - start
+
+
+def start_standins(options):
+    """在子进程中启动替身服务，返回 (进程, 端口)；独立进程避免与被测代码争用GIL"""
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=standins.run_process,
+        args=(options, '127.0.0.1', 0, None, None, ready),
+        daemon=True
+    )
+    process.start()
+    return process, ready.get(timeout=10)
+
+
+def load_app(port, args):
+    """把环境变量指向替身服务后导入应用模块"""
+    base = f'127.0.0.1:{port}'
+    os.environ['KIMI_API_URL'] = f'http://{base}/v1/chat/completions'
+    os.environ['XFYUN_TTS_URL'] = f'ws://{base}/v2/tts'
+    os.environ['XFYUN_ASR_URL'] = f'ws://{base}/v2/iat'
+    for name in ('KIMI_API_KEY', 'XFYUN_APPID', 'XFYUN_API_KEY', 'XFYUN_API_SECRET'):
+        os.environ.setdefault(name, 'bench')
+    # 缓存会让重复请求不经过上游，默认关闭，需要时显式开启
+    os.environ.setdefault('TTS_CACHE_ENABLED', 'False')
+    os.environ.setdefault('REPLY_CACHE_ENABLED', 'False')
+    os.environ.setdefault('ASR_BURST_MODE', 'False' if args.asr_realtime else 'True')
+
+    # 音频文件写到临时目录，不污染工作目录
+    workdir = tempfile.mkdtemp(prefix='upstream_bench_')
+    atexit.register(shutil.rmtree, workdir, ignore_errors=True)
+    os.chdir(workdir)
+    if args.quiet:
+        logging.disable(logging.WARNING)
+    import app
+    return app
+
+
+def build_cases(app, args):
+    """各基准项：返回 {名称: 单次请求函数}"""
+    audio = b'\x00\x00' * int(BYTES_PER_SECOND / 2 * args.asr_seconds)
+
+    def kimi(index):
+        start = time.perf_counter()
+        reply = app.call_kimi_api(f"第{index}个问题：今天过得怎么样？")
+        if reply in (app.KIMI_BUSY_REPLY, app.KIMI_ERROR_REPLY):
+            return None
+        return {'total': time.perf_counter() - start}
+
+    def kimi_stream(index):
+        start = time.perf_counter()
+        first = None
+        parts = []
+        for delta in app.stream_kimi_api(f"第{index}个问题：今天过得怎么样？"):
+            if first is None:
+                first = time.perf_counter() - start
+            parts.append(delta)
+        reply = ''.join(parts)
+        if reply in (app.KIMI_BUSY_REPLY, app.KIMI_ERROR_REPLY):
+            return None
+        return {'total': time.perf_counter() - start, 'first_token': first}
+
+    def asr(index):
+        start = time.perf_counter()
+        if not app.asr_service.recognize(audio):
+            return None
+        return {'total': time.perf_counter() - start}
+
+    def tts(index):
+        start = time.perf_counter()
+        if not app.tts_service.synthesize(f"第{index}句：{args.tts_text}"):
+            return None
+        return {'total': time.perf_counter() - start}
+
+    def tts_stream(index):
+        start = time.perf_counter()
+        first = None
+        size = 0
+        for chunk in app.tts_service.stream(f"第{index}句：{args.tts_text}"):
+            if first is None:
+                first = time.perf_counter() - start
+            size += len(chunk)
+        if not size:
+            return None
+        return {'total': time.perf_counter() - start, 'first_chunk': first}
+
+    return {
+        'kimi': kimi,
+        'kimi_stream': kimi_stream,
+        'asr': asr,
+        'tts': tts,
+        'tts_stream': tts_stream,
+    }
+
+
+def print_result(result):
+    if not result['ok']:
+        print(f"{result['name']:<24} 全部失败（{result['errors']} 次）")
+        return
+    print(f"{result['name']:<24} {result['ok']:>4}/{result['requests']:<4} "
+          f"{result['throughput']:>8.2f}/s  p50 {result['p50_ms']:>7.1f}ms  "
+          f"p95 {result['p95_ms']:>7.1f}ms  p99 {result['p99_ms']:>7.1f}ms  max {result['max_ms']:>7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='使用本地上游替身的组件基准测试')
+    parser.add_argument('--suites', default=','.join(SUITES), help=f'逗号分隔的基准项，可选: {",".join(SUITES)}')
+    parser.add_argument('--requests', type=int, default=40, help='每项的请求数')
+    parser.add_argument('--concurrency', type=int, default=4, help='并发请求数')
+    parser.add_argument('--warmup', type=int, default=2, help='每项正式计时前的预热请求数')
+    parser.add_argument('--asr-seconds', type=float, default=2.0, help='识别音频时长（秒）')
+    parser.add_argument('--asr-realtime', action='store_true', help='识别按实时帧间隔发送（默认连续发送）')
+    parser.add_argument('--tts-text', default='今天天气真不错，我们一起出去走走吧。', help='合成文本')
+    parser.add_argument('--json', help='把结果写入JSON文件')
+    parser.add_argument('--verbose', dest='quiet', action='store_false', help='输出服务日志')
+    standins.add_arguments(parser)
+    args = parser.parse_args()
+
+    suites = [name.strip() for name in args.suites.split(',') if name.strip()]
+    unknown = [name for name in suites if name not in SUITES]
+    if unknown:
+        parser.error(f"未知的基准项: {', '.join(unknown)}")
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    options = standins.options_from_args(args)
+    process, port = start_standins(options)
+    app = load_app(port, args)
+    cases = build_cases(app, args)
+
+    print("=" * 96)
+    print(f"🏁 组件基准: 每项 {args.requests} 次, 并发 {args.concurrency}, 替身端口 {port}, 种子 {args.seed}")
+    print("=" * 96)
+
+    results = []
+    try:
+        for name in suites:
+            func = cases[name]
+            for i in range(args.warmup):
+                func(-1 - i)
+            timings, errors, elapsed = run_load(func, args.requests, args.concurrency)
+            total = summarize(name, timings.get('total', []), errors, elapsed)
+            results.append(total)
+            print_result(total)
+            # 流式项另外统计首块到达时间
+            for metric in ('first_token', 'first_chunk'):
+                if metric in timings:
+                    extra = summarize(f'{name}.{metric}', timings[metric], errors, elapsed)
+                    results.append(extra)
+                    print_result(extra)
+    finally:
+        process.terminate()
+
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'requests': args.requests,
+                'concurrency': args.concurrency,
+                'standins': options,
+                'results': results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {json_path}")
+
+
+if __name__ == '__main__':
+    main()
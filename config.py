@@ -13,36 +13,119 @@ class Config:
     # ===== Kimi API 配置 =====
     # 请在 https://platform.moonshot.cn/ 获取您的API密钥
     KIMI_API_KEY: str = os.getenv('KIMI_API_KEY', '')
-    KIMI_API_URL: str = 'https://api.moonshot.cn/v1/chat/completions'
+    KIMI_API_URL: str = os.getenv('KIMI_API_URL', 'https://api.moonshot.cn/v1/chat/completions')
     KIMI_MODEL: str = 'moonshot-v1-8k'
     
+    # ===== Kimi HTTP连接池配置 =====
+    KIMI_POOL_CONNECTIONS: int = int(os.getenv('KIMI_POOL_CONNECTIONS', '4'))  # 缓存的主机连接池个数
+    KIMI_POOL_MAXSIZE: int = int(os.getenv('KIMI_POOL_MAXSIZE', '16'))  # 每个主机的最大连接数
+    KIMI_POOL_BLOCK: bool = os.getenv('KIMI_POOL_BLOCK', 'False').lower() == 'true'  # 连接耗尽时是否等待
+    KIMI_POOL_IDLE_TIMEOUT: int = int(os.getenv('KIMI_POOL_IDLE_TIMEOUT', '60'))  # 空闲连接回收时间（秒）
+    KIMI_CONNECT_TIMEOUT: float = float(os.getenv('KIMI_CONNECT_TIMEOUT', '5'))  # 建立连接超时（秒）
+    KIMI_READ_TIMEOUT: float = float(os.getenv('KIMI_READ_TIMEOUT', os.getenv('REQUEST_TIMEOUT', '30')))  # 读取响应超时（秒），未设置时沿用REQUEST_TIMEOUT
+    KIMI_COALESCE: bool = os.getenv('KIMI_COALESCE', 'True').lower() == 'true'  # 并发的相同对话请求只调用一次API
+    
     # ===== 科大讯飞 TTS 配置 =====
     # 请在 https://console.xfyun.cn/ 获取您的API信息
     XFYUN_APPID: str = os.getenv('XFYUN_APPID', '')
     XFYUN_API_KEY: str = os.getenv('XFYUN_API_KEY', '')
     XFYUN_API_SECRET: str = os.getenv('XFYUN_API_SECRET', '')
+    XFYUN_TTS_URL: str = os.getenv('XFYUN_TTS_URL', '')  # TTS接口地址，为空时使用讯飞正式地址（本地替身服务可用ws://）
+    XFYUN_ASR_URL: str = os.getenv('XFYUN_ASR_URL', '')  # 听写接口地址，为空时使用讯飞正式地址
+    XFYUN_WARM_POOL_SIZE: int = int(os.getenv('XFYUN_WARM_POOL_SIZE', '1'))  # TTS/ASR各自保持的预热连接数，0为关闭
+    XFYUN_WARM_MAX_IDLE: float = float(os.getenv('XFYUN_WARM_MAX_IDLE', '8'))  # 预热连接最长空闲时间（秒）
+    XFYUN_URL_TTL: int = int(os.getenv('XFYUN_URL_TTL', '240'))  # 签名URL复用时间（秒），需小于300
     
     # ===== 应用配置 =====
     SECRET_KEY: str = os.getenv('SECRET_KEY', 'your-secret-key-here')
     DEBUG: bool = os.getenv('DEBUG', 'True').lower() == 'true'
     HOST: str = os.getenv('HOST', '0.0.0.0')
     PORT: int = int(os.getenv('PORT', '5000'))
+    SERVER_MODE: str = os.getenv('SERVER_MODE', 'flask')  # flask（多线程）或 async（asyncio/aiohttp）
+    
+    # ===== 异步模式配置 =====
+    ASYNC_MAX_CONNECTIONS: int = int(os.getenv('ASYNC_MAX_CONNECTIONS', '1000'))  # 上游连接总数上限
+    ASYNC_TTS_CONCURRENCY: int = int(os.getenv('ASYNC_TTS_CONCURRENCY', '64'))  # 同时进行的TTS会话数
+    ASYNC_ASR_CONCURRENCY: int = int(os.getenv('ASYNC_ASR_CONCURRENCY', '64'))  # 同时进行的ASR会话数
     
     # ===== 对话配置 =====
     MAX_CONVERSATION_HISTORY: int = 20  # 最大对话历史记录数
+    SESSION_TTL: int = int(os.getenv('SESSION_TTL', '1800'))  # 会话空闲过期时间（秒）
+    SESSION_MAX_COUNT: int = int(os.getenv('SESSION_MAX_COUNT', '1000'))  # 同时保存的会话数上限
+    SESSION_MAX_BYTES: int = int(os.getenv('SESSION_MAX_BYTES', str(8 * 1024 * 1024)))  # 所有会话历史的总字节数上限
+    PROMPT_MAX_TOKENS: int = int(os.getenv('PROMPT_MAX_TOKENS', '4000'))  # 单次请求提示词（人设+历史+消息）的估算token上限
+    SUMMARY_ENABLED: bool = os.getenv('SUMMARY_ENABLED', 'True').lower() == 'true'  # 滑出窗口的旧对话是否合并为摘要
+    SUMMARY_MAX_TOKENS: int = int(os.getenv('SUMMARY_MAX_TOKENS', '300'))  # 摘要的token上限
+    SUMMARY_BATCH_MESSAGES: int = int(os.getenv('SUMMARY_BATCH_MESSAGES', '4'))  # 攒够多少条旧消息生成一次摘要
+    
+    # ===== 回复缓存配置（只缓存没有历史的短消息） =====
+    REPLY_CACHE_ENABLED: bool = os.getenv('REPLY_CACHE_ENABLED', 'False').lower() == 'true'
+    REPLY_CACHE_MAX_ENTRIES: int = int(os.getenv('REPLY_CACHE_MAX_ENTRIES', '500'))  # 缓存的消息数上限
+    REPLY_CACHE_TTL: int = int(os.getenv('REPLY_CACHE_TTL', '3600'))  # 每个回复的有效期（秒）
+    REPLY_CACHE_VARIANTS: int = int(os.getenv('REPLY_CACHE_VARIANTS', '3'))  # 每条消息轮换使用的回复数
+    REPLY_CACHE_SIMILARITY: float = float(os.getenv('REPLY_CACHE_SIMILARITY', '0.6'))  # 近似匹配的相似度阈值
+    REPLY_CACHE_MAX_CHARS: int = int(os.getenv('REPLY_CACHE_MAX_CHARS', '20'))  # 可缓存消息的最大长度
     MAX_MESSAGE_LENGTH: int = 500  # 最大消息长度
-    REQUEST_TIMEOUT: int = 30  # 请求超时时间（秒）
+    REQUEST_TIMEOUT: int = int(os.getenv('REQUEST_TIMEOUT', '30'))  # 请求超时时间（秒），作为KIMI_READ_TIMEOUT的默认值
     
     # ===== 语音配置 =====
     VOICE_NAME: str = 'x4_yezi'  # 语音发音人
     AUDIO_FORMAT: str = 'wav'  # 音频格式
     AUDIO_SAMPLE_RATE: int = 16000  # 采样率
     
+    # ===== TTS并发配置 =====
+    TTS_MAX_WORKERS: int = int(os.getenv('TTS_MAX_WORKERS', '4'))  # 同时进行的合成会话数
+    TTS_QUEUE_SIZE: int = int(os.getenv('TTS_QUEUE_SIZE', '16'))  # 排队等待的合成任务数
+    TTS_TIMEOUT: int = int(os.getenv('TTS_TIMEOUT', '30'))  # 单次合成超时（秒）
+    TTS_SEGMENT_THRESHOLD: int = int(os.getenv('TTS_SEGMENT_THRESHOLD', '60'))  # 超过该字数的文本分句并行合成，0为关闭
+    TTS_SEGMENT_MAX_CHARS: int = int(os.getenv('TTS_SEGMENT_MAX_CHARS', '80'))  # 单个分句的最大字数
+    TTS_SEGMENT_PARALLELISM: int = int(os.getenv('TTS_SEGMENT_PARALLELISM', '3'))  # 单个请求同时合成的分句数
+    TTS_COALESCE: bool = os.getenv('TTS_COALESCE', 'True').lower() == 'true'  # 并发的相同文本只合成一次
+    
+    # ===== TTS缓存配置 =====
+    TTS_CACHE_ENABLED: bool = os.getenv('TTS_CACHE_ENABLED', 'True').lower() == 'true'  # 是否缓存合成结果
+    TTS_CACHE_DIR: str = os.getenv('TTS_CACHE_DIR', 'audio_files/tts_cache')  # 缓存目录（需位于音频目录下）
+    TTS_CACHE_MAX_BYTES: int = int(os.getenv('TTS_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))  # 缓存总大小上限
+    
+    # ===== ASR并发配置 =====
+    ASR_MAX_WORKERS: int = int(os.getenv('ASR_MAX_WORKERS', '2'))  # 同时进行的识别会话数（与讯飞并发配额一致）
+    ASR_QUEUE_SIZE: int = int(os.getenv('ASR_QUEUE_SIZE', '8'))  # 排队等待的识别任务数
+    ASR_TIMEOUT: int = int(os.getenv('ASR_TIMEOUT', '15'))  # 单次识别超时（秒）
+    ASR_FRAME_SIZE: int = int(os.getenv('ASR_FRAME_SIZE', '1280'))  # 每帧发送的音频字节数
+    ASR_FRAME_INTERVAL: float = float(os.getenv('ASR_FRAME_INTERVAL', '0.04'))  # 帧间隔（秒），0为不限速
+    ASR_BURST_MODE: bool = os.getenv('ASR_BURST_MODE', 'False').lower() == 'true'  # 已录制音频连续发送
+    
+    # ===== 识别前静音裁剪配置 =====
+    VAD_ENABLED: bool = os.getenv('VAD_ENABLED', 'True').lower() == 'true'  # 识别前裁掉首尾静音
+    VAD_THRESHOLD_DB: float = float(os.getenv('VAD_THRESHOLD_DB', '-45'))  # 语音能量下限（dBFS）
+    VAD_NOISE_MARGIN_DB: float = float(os.getenv('VAD_NOISE_MARGIN_DB', '10'))  # 高出底噪多少分贝才算语音，0为只用固定阈值
+    VAD_PADDING_MS: int = int(os.getenv('VAD_PADDING_MS', '200'))  # 语音前后保留的静音（毫秒）
+    VAD_MAX_PAUSE_MS: int = int(os.getenv('VAD_MAX_PAUSE_MS', '0'))  # 句间停顿压缩上限（毫秒），0为不压缩
+    VAD_MIN_SPEECH_MS: int = int(os.getenv('VAD_MIN_SPEECH_MS', '100'))  # 语音短于该值时不裁剪（毫秒）
+    
+    # ===== 音频解码配置 =====
+    AUDIO_DECODER_BACKEND: str = os.getenv('AUDIO_DECODER_BACKEND', 'auto')  # auto / pyav / ffmpeg_pool / ffmpeg
+    AUDIO_DECODER_POOL_SIZE: int = int(os.getenv('AUDIO_DECODER_POOL_SIZE', '2'))  # 预启动的ffmpeg进程数
+    AUDIO_DECODER_HEALTH_INTERVAL: int = int(os.getenv('AUDIO_DECODER_HEALTH_INTERVAL', '30'))  # 进程存活检查周期（秒）
+    FFMPEG_TIMEOUT: int = int(os.getenv('FFMPEG_TIMEOUT', '10'))  # 单次转码超时（秒）
+    FFMPEG_MAX_OUTPUT_BYTES: int = int(os.getenv('FFMPEG_MAX_OUTPUT_BYTES', str(16000 * 2 * 60)))  # 转码输出上限（默认60秒PCM）
+    
     # ===== 文件路径配置 =====
     AUDIO_FILES_DIR: str = 'audio_files'  # 音频文件存储目录
     STATIC_DIR: str = 'static'  # 静态文件目录
     TEMPLATES_DIR: str = 'templates'  # 模板文件目录
     
+    # ===== 音频文件清理配置 =====
+    AUDIO_RETENTION_SECONDS: int = int(os.getenv('AUDIO_RETENTION_SECONDS', '3600'))  # 合成音频保留时间（秒）
+    AUDIO_MAX_BYTES: int = int(os.getenv('AUDIO_MAX_BYTES', str(500 * 1024 * 1024)))  # 合成音频总大小上限
+    AUDIO_JANITOR_INTERVAL: int = int(os.getenv('AUDIO_JANITOR_INTERVAL', '300'))  # 清理周期（秒）
+    
+    # ===== 请求追踪配置 =====
+    TRACE_ENABLED: bool = os.getenv('TRACE_ENABLED', 'True').lower() == 'true'  # 记录各阶段耗时并返回Server-Timing头
+    TRACE_SAMPLE_RATE: float = float(os.getenv('TRACE_SAMPLE_RATE', '0'))  # 随机输出JSON追踪记录的比例，0为不采样
+    TRACE_SLOW_THRESHOLD: float = float(os.getenv('TRACE_SLOW_THRESHOLD', '0'))  # 耗时超过该值（秒）的请求总是输出追踪记录，0为关闭
+    TRACE_LOG_FILE: str = os.getenv('TRACE_LOG_FILE', '')  # 追踪记录文件（每行一条JSON），为空时写入日志
+    
     @classmethod
     def validate(cls) -> Dict[str, Any]:
         """验证配置并返回验证结果"""
@@ -82,22 +165,85 @@ class Config:
             'KIMI_API_KEY': cls.KIMI_API_KEY,
             'KIMI_API_URL': cls.KIMI_API_URL,
             'KIMI_MODEL': cls.KIMI_MODEL,
+            'KIMI_POOL_CONNECTIONS': cls.KIMI_POOL_CONNECTIONS,
+            'KIMI_POOL_MAXSIZE': cls.KIMI_POOL_MAXSIZE,
+            'KIMI_POOL_BLOCK': cls.KIMI_POOL_BLOCK,
+            'KIMI_POOL_IDLE_TIMEOUT': cls.KIMI_POOL_IDLE_TIMEOUT,
+            'KIMI_CONNECT_TIMEOUT': cls.KIMI_CONNECT_TIMEOUT,
+            'KIMI_READ_TIMEOUT': cls.KIMI_READ_TIMEOUT,
+            'KIMI_COALESCE': cls.KIMI_COALESCE,
             'XFYUN_APPID': cls.XFYUN_APPID,
             'XFYUN_API_KEY': cls.XFYUN_API_KEY,
             'XFYUN_API_SECRET': cls.XFYUN_API_SECRET,
+            'XFYUN_WARM_POOL_SIZE': cls.XFYUN_WARM_POOL_SIZE,
+            'XFYUN_WARM_MAX_IDLE': cls.XFYUN_WARM_MAX_IDLE,
+            'XFYUN_URL_TTL': cls.XFYUN_URL_TTL,
+            'XFYUN_TTS_URL': cls.XFYUN_TTS_URL,
+            'XFYUN_ASR_URL': cls.XFYUN_ASR_URL,
             'SECRET_KEY': cls.SECRET_KEY,
             'DEBUG': cls.DEBUG,
             'HOST': cls.HOST,
             'PORT': cls.PORT,
+            'SERVER_MODE': cls.SERVER_MODE,
+            'ASYNC_MAX_CONNECTIONS': cls.ASYNC_MAX_CONNECTIONS,
+            'ASYNC_TTS_CONCURRENCY': cls.ASYNC_TTS_CONCURRENCY,
+            'ASYNC_ASR_CONCURRENCY': cls.ASYNC_ASR_CONCURRENCY,
             'MAX_CONVERSATION_HISTORY': cls.MAX_CONVERSATION_HISTORY,
+            'SESSION_TTL': cls.SESSION_TTL,
+            'SESSION_MAX_COUNT': cls.SESSION_MAX_COUNT,
+            'SESSION_MAX_BYTES': cls.SESSION_MAX_BYTES,
+            'PROMPT_MAX_TOKENS': cls.PROMPT_MAX_TOKENS,
+            'SUMMARY_ENABLED': cls.SUMMARY_ENABLED,
+            'SUMMARY_MAX_TOKENS': cls.SUMMARY_MAX_TOKENS,
+            'SUMMARY_BATCH_MESSAGES': cls.SUMMARY_BATCH_MESSAGES,
+            'REPLY_CACHE_ENABLED': cls.REPLY_CACHE_ENABLED,
+            'REPLY_CACHE_MAX_ENTRIES': cls.REPLY_CACHE_MAX_ENTRIES,
+            'REPLY_CACHE_TTL': cls.REPLY_CACHE_TTL,
+            'REPLY_CACHE_VARIANTS': cls.REPLY_CACHE_VARIANTS,
+            'REPLY_CACHE_SIMILARITY': cls.REPLY_CACHE_SIMILARITY,
+            'REPLY_CACHE_MAX_CHARS': cls.REPLY_CACHE_MAX_CHARS,
             'MAX_MESSAGE_LENGTH': cls.MAX_MESSAGE_LENGTH,
             'REQUEST_TIMEOUT': cls.REQUEST_TIMEOUT,
             'VOICE_NAME': cls.VOICE_NAME,
             'AUDIO_FORMAT': cls.AUDIO_FORMAT,
             'AUDIO_SAMPLE_RATE': cls.AUDIO_SAMPLE_RATE,
+            'AUDIO_DECODER_BACKEND': cls.AUDIO_DECODER_BACKEND,
+            'AUDIO_DECODER_POOL_SIZE': cls.AUDIO_DECODER_POOL_SIZE,
+            'AUDIO_DECODER_HEALTH_INTERVAL': cls.AUDIO_DECODER_HEALTH_INTERVAL,
+            'FFMPEG_TIMEOUT': cls.FFMPEG_TIMEOUT,
+            'FFMPEG_MAX_OUTPUT_BYTES': cls.FFMPEG_MAX_OUTPUT_BYTES,
+            'TTS_MAX_WORKERS': cls.TTS_MAX_WORKERS,
+            'TTS_QUEUE_SIZE': cls.TTS_QUEUE_SIZE,
+            'TTS_TIMEOUT': cls.TTS_TIMEOUT,
+            'TTS_SEGMENT_THRESHOLD': cls.TTS_SEGMENT_THRESHOLD,
+            'TTS_SEGMENT_MAX_CHARS': cls.TTS_SEGMENT_MAX_CHARS,
+            'TTS_SEGMENT_PARALLELISM': cls.TTS_SEGMENT_PARALLELISM,
+            'TTS_COALESCE': cls.TTS_COALESCE,
+            'TTS_CACHE_ENABLED': cls.TTS_CACHE_ENABLED,
+            'TTS_CACHE_DIR': cls.TTS_CACHE_DIR,
+            'TTS_CACHE_MAX_BYTES': cls.TTS_CACHE_MAX_BYTES,
+            'ASR_MAX_WORKERS': cls.ASR_MAX_WORKERS,
+            'ASR_QUEUE_SIZE': cls.ASR_QUEUE_SIZE,
+            'ASR_TIMEOUT': cls.ASR_TIMEOUT,
+            'ASR_FRAME_SIZE': cls.ASR_FRAME_SIZE,
+            'ASR_FRAME_INTERVAL': cls.ASR_FRAME_INTERVAL,
+            'ASR_BURST_MODE': cls.ASR_BURST_MODE,
+            'VAD_ENABLED': cls.VAD_ENABLED,
+            'VAD_THRESHOLD_DB': cls.VAD_THRESHOLD_DB,
+            'VAD_NOISE_MARGIN_DB': cls.VAD_NOISE_MARGIN_DB,
+            'VAD_PADDING_MS': cls.VAD_PADDING_MS,
+            'VAD_MAX_PAUSE_MS': cls.VAD_MAX_PAUSE_MS,
+            'VAD_MIN_SPEECH_MS': cls.VAD_MIN_SPEECH_MS,
             'AUDIO_FILES_DIR': cls.AUDIO_FILES_DIR,
             'STATIC_DIR': cls.STATIC_DIR,
             'TEMPLATES_DIR': cls.TEMPLATES_DIR,
+            'AUDIO_RETENTION_SECONDS': cls.AUDIO_RETENTION_SECONDS,
+            'AUDIO_MAX_BYTES': cls.AUDIO_MAX_BYTES,
+            'AUDIO_JANITOR_INTERVAL': cls.AUDIO_JANITOR_INTERVAL,
+            'TRACE_ENABLED': cls.TRACE_ENABLED,
+            'TRACE_SAMPLE_RATE': cls.TRACE_SAMPLE_RATE,
+            'TRACE_SLOW_THRESHOLD': cls.TRACE_SLOW_THRESHOLD,
+            'TRACE_LOG_FILE': cls.TRACE_LOG_FILE,
         }
 
 # 开发环境配置
@@ -0,0 +1,112 @@
+# -*- coding:utf-8 -*-
+"""
+Kimi API HTTP客户端
+所有Flask工作线程共享一个带连接池的keep-alive会话，避免每轮对话都重新进行TCP+TLS握手
+"""
+
+import threading
+import time
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class KimiClient:
+    """线程安全、复用连接的Kimi API客户端"""
+
+    def __init__(self, api_url, api_key, pool_connections=4, pool_maxsize=16,
+                 pool_block=False, idle_timeout=60, connect_timeout=5, read_timeout=30):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.pool_connections = pool_connections  # 缓存的主机连接池个数
+        self.pool_maxsize = pool_maxsize  # 每个主机最多保持的连接数
+        self.pool_block = pool_block  # 连接耗尽时是否阻塞等待
+        self.idle_timeout = idle_timeout  # 空闲超过该秒数后丢弃已有连接
+        self.timeout = (connect_timeout, read_timeout)  # (连接超时, 读取超时)
+
+        self._lock = threading.Lock()
+        self._last_used = time.monotonic()
+        self._stats = {
+            'requests': 0,
+            'errors': 0,
+            'idle_resets': 0,
+        }
+
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block
+        )
+        self._session = requests.Session()
+        self._session.mount('https://', self._adapter)
+        self._session.mount('http://', self._adapter)
+        self._session.headers.update({
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {api_key}'
+        })
+
+    def _check_idle(self):
+        """连接空闲过久时清空连接池，避免复用已被服务端断开的连接"""
+        with self._lock:
+            now = time.monotonic()
+            if self.idle_timeout and now - self._last_used > self.idle_timeout:
+                self._adapter.poolmanager.clear()
+                self._stats['idle_resets'] += 1
+                logger.info("Kimi连接池空闲超时，已重置")
+            self._last_used = now
+            self._stats['requests'] += 1
+
+    def post(self, data, stream=False):
+        """发送对话补全请求，返回requests响应对象"""
+        self._check_idle()
+        try:
+            return self._session.post(
+                self.api_url,
+                json=data,
+                timeout=self.timeout,
+                stream=stream
+            )
+        except requests.RequestException:
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+
+    def get_stats(self):
+        """获取连接池统计信息"""
+        pools = []
+        poolmanager = self._adapter.poolmanager
+        for key in poolmanager.pools.keys():
+            pool = poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                'host': pool.host,
+                'port': pool.port,
+                'connections_created': pool.num_connections,
+                'requests_sent': pool.num_requests,
+                # 连接队列中预填充了None占位，只统计真实的空闲连接
+                'idle_connections': sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0,
+            })
+
+        with self._lock:
+            stats = dict(self._stats)
+            idle_seconds = time.monotonic() - self._last_used
+
+        stats.update({
+            'pool_connections': self.pool_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'pool_block': self.pool_block,
+            'idle_timeout': self.idle_timeout,
+            'connect_timeout': self.timeout[0],
+            'read_timeout': self.timeout[1],
+            'idle_seconds': round(idle_seconds, 3),
+            'pools': pools,
+        })
+        return stats
+
+    def close(self):
+        """关闭会话及其全部连接"""
+        self._session.close()
@@ -0,0 +1,209 @@
+# -*- coding:utf-8 -*-
+"""
+运行指标（Prometheus文本格式）
+记录时只修改当前线程自己的分片，热路径上不加锁；抓取/metrics时再汇总全部分片。
+已退出线程的分片在新建分片时按摊还方式并入累计值（抓取时也会合并），没有抓取时线程频繁创建也不会无限增长。
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import span, current_trace
+
+# 默认的耗时分桶（秒），覆盖从毫秒级缓存命中到数十秒的上游调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class _ShardedValues:
+    """按线程分片累加的数值表"""
+
+    MIN_SWEEP_SHARDS = 64  # 分片数达到该值才开始清理已退出线程的分片
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []  # [(线程, 分片)]
+        self._retired = {}  # 已退出线程的累计值
+        self._sweep_at = self.MIN_SWEEP_SHARDS  # 分片数达到该值时清理一次
+
+    def add(self, key, amount):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) >= self._sweep_at:
+                    # 每次清理后阈值翻倍于存活分片数，清理开销摊还到每个新分片上是常数
+                    self._retire_dead()
+                    self._sweep_at = max(2 * len(self._shards), self.MIN_SWEEP_SHARDS)
+        shard[key] = shard.get(key, 0) + amount
+
+    def snapshot(self):
+        """汇总所有分片"""
+        with self._lock:
+            self._retire_dead()
+            totals = dict(self._retired)
+            for _, shard in self._shards:
+                for key, value in dict(shard).items():
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _retire_dead(self):
+        """把已退出线程的分片并入累计值（调用方持有锁）"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for key, value in shard.items():
+                    self._retired[key] = self._retired.get(key, 0) + value
+        self._shards = alive
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数器"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = _ShardedValues()
+
+    def inc(self, *labels, amount=1):
+        self._values.add(labels, amount)
+
+    def samples(self):
+        for labels, value in sorted(self._values.snapshot().items()):
+            yield self.name + _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    """可增可减的当前值，如在途请求数"""
+
+    type_name = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self._values.add(labels, -amount)
+
+
+class Histogram:
+    """按固定分桶统计的分布，如各阶段耗时"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = _ShardedValues()
+
+    def observe(self, value, *labels):
+        # 分片中保存各桶的非累积计数，输出时再累加
+        self._values.add((labels, bisect.bisect_left(self.buckets, value)), 1)
+        self._values.add((labels, 'sum'), value)
+
+    def samples(self):
+        grouped = {}
+        for (labels, slot), value in self._values.snapshot().items():
+            grouped.setdefault(labels, {})[slot] = value
+
+        for labels in sorted(grouped):
+            slots = grouped[labels]
+            cumulative = 0
+            for index, bound in enumerate(self.buckets + (float('inf'),)):
+                cumulative += slots.get(index, 0)
+                le = '+Inf' if bound == float('inf') else _format_value(float(bound))
+                yield self.name + '_bucket' + _format_labels(self.labelnames, labels, f'le="{le}"'), cumulative
+            yield self.name + '_sum' + _format_labels(self.labelnames, labels), slots.get('sum', 0)
+            yield self.name + '_count' + _format_labels(self.labelnames, labels), cumulative
+
+
+class Registry:
+    """指标注册表，负责输出Prometheus文本格式"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            for sample, value in metric.samples():
+                lines.append(f'{sample} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    'http_requests_total', '按接口、方法和状态码统计的请求数', ('endpoint', 'method', 'status')))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', '接口处理耗时（流式响应包含传输时间）', ('endpoint',)))
+HTTP_INFLIGHT = REGISTRY.register(Gauge(
+    'http_requests_inflight', '正在处理的请求数', ('endpoint',)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'stage_duration_seconds', '各处理阶段耗时：decode、vad、asr、llm、llm_stream、tts、tts_stream、tts_segment', ('stage',)))
+STAGE_INFLIGHT = REGISTRY.register(Gauge(
+    'stage_inflight', '各处理阶段正在执行的调用数', ('stage',)))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    'upstream_errors_total', '上游服务错误数，按服务和错误码统计', ('service', 'code')))
+AUDIO_BYTES = REGISTRY.register(Counter(
+    'audio_bytes_total', '处理的音频字节数：upload（上传）、vad_trimmed（裁掉的静音）、asr_pcm（送识别）、tts_pcm（合成输出）', ('kind',)))
+
+
+@contextmanager
+def observe_stage(stage):
+    """统计一个处理阶段的耗时和在途数，同时记入当前请求的追踪"""
+    STAGE_INFLIGHT.inc(stage)
+    start = time.perf_counter()
+    try:
+        with span(stage):
+            yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+        STAGE_INFLIGHT.dec(stage)
+
+
+def observe_future(stage, future):
+    """统计一个以Future完成的阶段：从提交到Future完成（含取消）的耗时和在途数，同时记入提交时请求的追踪"""
+    STAGE_INFLIGHT.inc(stage)
+    trace = current_trace()
+    start = time.perf_counter()
+
+    def done(f):
+        end = time.perf_counter()
+        STAGE_SECONDS.observe(end - start, stage)
+        STAGE_INFLIGHT.dec(stage)
+        if trace is not None:
+            trace.add(stage, start, end)
+
+    future.add_done_callback(done)
+    return future
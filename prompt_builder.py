@@ -0,0 +1,147 @@
+# -*- coding:utf-8 -*-
+"""
+对话提示词的token预算与历史摘要
+按估算的token数截取历史，保证每轮请求大小有上限；
+滑出会话窗口的旧对话由后台线程合并进滚动摘要，不占用请求路径。
+"""
+
+import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 中日韩文字及全角标点，大致一个字一个token
+_CJK_CHARS = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]')
+# 每条消息的角色、分隔符等固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "你负责为一段持续进行的聊天维护摘要。请把已有摘要和新增的对话合并成一段新的摘要，"
+    "保留用户的称呼、偏好、提到的重要事实和尚未结束的话题，省略寒暄和玩笑。"
+    "只输出摘要正文，不超过200字。"
+)
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数：中文按每字一个token，其余字符按每4个一个token，宁多勿少"""
+    if not text:
+        return 0
+    cjk = len(_CJK_CHARS.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_message_tokens(message):
+    """估算一条对话消息的token数"""
+    return estimate_tokens(message.get('content') or '') + MESSAGE_OVERHEAD_TOKENS
+
+
+def trim_history(history, max_tokens):
+    """按token预算截取历史
+
+    摘要等system消息优先保留，其余消息从最新往前取，放不下的更早消息被丢弃；
+    截取结果不以assistant消息开头，避免出现没有提问的回答。
+    """
+    pinned = [m for m in history if m.get('role') == 'system']
+    turns = [m for m in history if m.get('role') != 'system']
+
+    used = sum(estimate_message_tokens(m) for m in pinned)
+    if used > max_tokens:
+        logger.warning("对话摘要超出token预算，本轮不携带摘要")
+        pinned = []
+        used = 0
+
+    kept = []
+    for message in reversed(turns):
+        cost = estimate_message_tokens(message)
+        if used + cost > max_tokens:
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+
+    while kept and kept[0].get('role') == 'assistant':
+        kept.pop(0)
+
+    if len(kept) < len(turns):
+        logger.info(f"历史超出token预算，保留最近 {len(kept)}/{len(turns)} 条消息")
+    return pinned + kept
+
+
+class HistorySummarizer:
+    """后台把会话中滑出窗口的旧消息合并进滚动摘要
+
+    每个会话同一时间最多一个摘要任务；待合并的消息攒够一批才调用一次Kimi API。
+    """
+
+    def __init__(self, store, client, model, max_tokens=300, batch_messages=4):
+        self.store = store
+        self.client = client
+        self.model = model
+        self.max_tokens = max_tokens  # 摘要回复的token上限
+        self.batch_messages = batch_messages  # 攒够多少条旧消息才生成一次摘要
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-summary')
+        self._inflight = set()
+        self._lock = threading.Lock()
+        self._stats = {'scheduled': 0, 'completed': 0, 'failed': 0}
+
+    def schedule(self, session_id):
+        """会话有足够的待合并消息时提交摘要任务"""
+        if self.store.pending_count(session_id) < self.batch_messages:
+            return
+        with self._lock:
+            if session_id in self._inflight:
+                return
+            self._inflight.add(session_id)
+            self._stats['scheduled'] += 1
+        self._executor.submit(self._run, session_id)
+
+    def _run(self, session_id):
+        try:
+            pending = self.store.pending_overflow(session_id)
+            if not pending:
+                return
+            summary, messages, last_seq = pending
+            new_summary = self.summarize(summary, messages)
+            if new_summary:
+                self.store.commit_summary(session_id, new_summary, last_seq)
+            with self._lock:
+                self._stats['completed' if new_summary else 'failed'] += 1
+        finally:
+            with self._lock:
+                self._inflight.discard(session_id)
+
+    def summarize(self, summary, messages):
+        """调用Kimi API生成新的摘要，失败时返回None"""
+        names = {'user': '用户', 'assistant': '助手'}
+        dialogue = '\n'.join(f"{names.get(m['role'], m['role'])}：{m['content']}" for m in messages)
+        data = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"已有摘要：{summary or '（无）'}\n\n新增对话：\n{dialogue}"},
+            ],
+            "temperature": 0.3,
+            "max_tokens": self.max_tokens
+        }
+        try:
+            response = self.client.post(data)
+            if response.status_code != 200:
+                logger.error(f"生成对话摘要失败: {response.status_code}, {response.text}")
+                return None
+            return response.json()['choices'][0]['message']['content'].strip() or None
+        except Exception as e:
+            logger.error(f"生成对话摘要异常: {str(e)}")
+            return None
+
+    def get_stats(self):
+        """获取摘要任务统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['running'] = len(self._inflight)
+        return stats
+
+    def close(self):
+        self._executor.shutdown(wait=False)
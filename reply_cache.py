@@ -0,0 +1,186 @@
+# -*- coding:utf-8 -*-
+"""
+对话回复缓存
+只缓存没有历史的短消息（如“你好”“在吗”“讲个笑话”），
+先按归一化文本精确匹配，再用字符n-gram的MinHash+LSH索引查找近似重复的消息。
+每条消息保存多个不同的回复轮流使用，每个回复单独过期。
+"""
+
+import logging
+import random
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 归一化时去掉的字符：空白、标点、符号（含表情）
+_STRIP_CATEGORIES = ('Z', 'P', 'S', 'C')
+# 口语里不影响意思的语气词结尾
+_TRAILING_PARTICLES = re.compile(r'[呀啊吖哇嘛呢吧哦噢喔]+$')
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize_message(text):
+    """归一化消息：全半角统一、转小写、去掉标点符号和句尾语气词"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    text = ''.join(ch for ch in text if unicodedata.category(ch)[0] not in _STRIP_CATEGORIES)
+    return _TRAILING_PARTICLES.sub('', text) or text
+
+
+def shingles(text, n=2):
+    """字符n-gram集合，文本短于n时使用整个文本"""
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class MinHashIndex:
+    """MinHash签名+LSH分桶的近似重复索引"""
+
+    def __init__(self, num_perm=32, bands=16, seed=1):
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self._params = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+                        for _ in range(num_perm)]
+        self._buckets = {}
+        self._keys = {}  # key -> 所在的桶
+
+    def signature(self, grams):
+        hashes = [zlib.crc32(gram.encode('utf-8')) for gram in grams]
+        return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._params]
+
+    def _band_keys(self, signature):
+        return [(i, tuple(signature[i * self.rows:(i + 1) * self.rows])) for i in range(self.bands)]
+
+    def add(self, key, grams):
+        bands = self._band_keys(self.signature(grams))
+        for band in bands:
+            self._buckets.setdefault(band, set()).add(key)
+        self._keys[key] = bands
+
+    def remove(self, key):
+        for band in self._keys.pop(key, ()):
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def candidates(self, grams):
+        """与给定n-gram集合至少落入一个相同桶的key"""
+        found = set()
+        for band in self._band_keys(self.signature(grams)):
+            found.update(self._buckets.get(band, ()))
+        return found
+
+
+class _Entry:
+    __slots__ = ('grams', 'replies')
+
+    def __init__(self, grams):
+        self.grams = grams
+        self.replies = []  # [(回复, 过期时间)]
+
+
+class ReplyCache:
+    """线程安全的短消息回复缓存"""
+
+    def __init__(self, max_entries=500, ttl=3600, variants=3, similarity=0.6, max_chars=20):
+        self.max_entries = max_entries  # 缓存的消息数上限
+        self.ttl = ttl  # 每个回复的有效期（秒）
+        self.variants = variants  # 每条消息保存的回复数，攒够之前仍请求上游
+        self.similarity = similarity  # 近似匹配要求的n-gram Jaccard相似度
+        self.max_chars = max_chars  # 可缓存消息的最大长度
+
+        self._entries = OrderedDict()
+        self._index = MinHashIndex()
+        self._lock = threading.Lock()
+        self._stats = {'exact_hits': 0, 'similar_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def accepts(self, message, history=None):
+        """只缓存没有对话历史的短消息"""
+        return not history and len(message) <= self.max_chars
+
+    def get(self, message):
+        """查找缓存的回复，未命中或回复数未攒够时返回None"""
+        key = normalize_message(message)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            hit_type = 'exact_hits'
+            if entry is None:
+                key, entry = self._find_similar(key)
+                hit_type = 'similar_hits'
+
+            replies = self._live_replies(key, entry, now) if entry else []
+            if len(replies) < self.variants:
+                self._stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats[hit_type] += 1
+            return random.choice(replies)[0]
+
+    def put(self, message, reply):
+        """保存一个回复，同一消息的回复数达到上限后替换最早的一个"""
+        key = normalize_message(message)
+        if not key:
+            return
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = _Entry(shingles(key))
+                self._entries[key] = entry
+                self._index.add(key, entry.grams)
+            self._entries.move_to_end(key)
+
+            replies = self._live_replies(key, entry, now, remove_empty=False)
+            if any(existing == reply for existing, _ in replies):
+                return
+            replies.append((reply, now + self.ttl))
+            entry.replies = replies[-self.variants:]
+            self._stats['stores'] += 1
+
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._index.remove(old_key)
+                self._stats['evictions'] += 1
+
+    def _find_similar(self, key):
+        """在LSH候选中找相似度最高且达到阈值的消息"""
+        grams = shingles(key)
+        best_key, best_entry, best_score = None, None, self.similarity
+        for candidate in self._index.candidates(grams):
+            entry = self._entries.get(candidate)
+            if entry is None:
+                continue
+            score = len(grams & entry.grams) / len(grams | entry.grams)
+            if score >= best_score:
+                best_key, best_entry, best_score = candidate, entry, score
+        return best_key, best_entry
+
+    def _live_replies(self, key, entry, now, remove_empty=True):
+        """过滤掉过期的回复，全部过期时删除该消息"""
+        entry.replies = [item for item in entry.replies if item[1] > now]
+        if not entry.replies and remove_empty:
+            del self._entries[key]
+            self._index.remove(key)
+        return entry.replies
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        hits = stats['exact_hits'] + stats['similar_hits']
+        lookups = hits + stats['misses']
+        stats['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+        return stats
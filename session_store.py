@@ -0,0 +1,202 @@
+# -*- coding:utf-8 -*-
+"""
+服务端对话会话
+按会话ID保存对话历史，客户端每轮只需发送新消息。
+每个会话的历史是定长环形队列，会话空闲过期，所有会话共享一个内存上限。
+启用摘要时，滑出队列的旧消息暂存到待摘要列表，由后台合并进会话摘要。
+"""
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+
+def _text_bytes(text):
+    return len(text.encode('utf-8'))
+
+
+class ConversationSession:
+    """单个会话的历史记录，消息以 (角色, 内容) 元组保存"""
+
+    __slots__ = ('turns', 'overflow', 'next_seq', 'summary', 'size', 'last_active')
+
+    def __init__(self, max_messages, keep_overflow=False):
+        self.turns = deque(maxlen=max_messages)
+        self.overflow = [] if keep_overflow else None  # 滑出队列、尚未并入摘要的消息，(序号, 角色, 内容)
+        self.next_seq = 0  # 下一条待摘要消息的序号
+        self.summary = ''  # 更早对话的摘要
+        self.size = 0  # 历史内容占用的字节数
+        self.last_active = time.time()
+
+    def add(self, role, content):
+        """追加一条消息（队列已满时挤出最旧的一条），返回占用字节数的变化"""
+        before = self.size
+        if len(self.turns) == self.turns.maxlen:
+            if self.overflow is None:
+                self.size -= _text_bytes(self.turns[0][1])
+            else:
+                self.overflow.append((self.next_seq,) + self.turns[0])
+                self.next_seq += 1
+                # 摘要长期跟不上时丢弃最旧的待摘要消息，保证内存有上限
+                if len(self.overflow) > self.turns.maxlen:
+                    self.size -= _text_bytes(self.overflow.pop(0)[2])
+        self.turns.append((role, content))
+        self.size += _text_bytes(content)
+        return self.size - before
+
+    def fold(self, summary, last_seq):
+        """用新摘要替换序号不超过last_seq的待摘要消息，返回占用字节数的变化
+
+        按序号而不是条数移除：摘要期间队列可能因超出上限丢掉了最旧的消息，按条数会误删尚未摘要的新消息。
+        """
+        before = self.size
+        count = 0
+        while count < len(self.overflow) and self.overflow[count][0] <= last_seq:
+            count += 1
+        folded, self.overflow[:] = self.overflow[:count], self.overflow[count:]
+        self.size -= sum(_text_bytes(content) for _, _, content in folded)
+        self.size += _text_bytes(summary) - _text_bytes(self.summary)
+        self.summary = summary
+        return self.size - before
+
+    def messages(self):
+        """转换为Kimi API的消息格式，摘要作为system消息放在最前"""
+        messages = []
+        if self.summary:
+            messages.append({'role': 'system', 'content': f'此前对话的摘要：{self.summary}'})
+        for _, role, content in (self.overflow or []):
+            messages.append({'role': role, 'content': content})
+        for role, content in self.turns:
+            messages.append({'role': role, 'content': content})
+        return messages
+
+
+class SessionStore:
+    """线程安全的会话存储，按最近使用顺序淘汰"""
+
+    def __init__(self, max_messages=20, ttl=1800, max_sessions=1000, max_bytes=8 * 1024 * 1024,
+                 keep_overflow=False):
+        self.max_messages = max_messages  # 每个会话保留的消息条数
+        self.keep_overflow = keep_overflow  # 是否保留滑出队列的消息等待摘要
+        self.ttl = ttl  # 会话空闲过期时间（秒）
+        self.max_sessions = max_sessions  # 会话数上限
+        self.max_bytes = max_bytes  # 所有会话历史内容的总字节数上限
+
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'created': 0, 'expired': 0, 'evicted': 0}
+
+    def create(self):
+        """新建会话，返回会话ID"""
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._expire_idle()
+            self._sessions[session_id] = ConversationSession(self.max_messages, self.keep_overflow)
+            self._stats['created'] += 1
+            self._evict()
+        return session_id
+
+    def get_history(self, session_id):
+        """获取会话历史，会话不存在或已过期时返回None"""
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                return None
+            return session.messages()
+
+    def append(self, session_id, user_message, reply):
+        """记录一轮对话，会话已不存在时忽略"""
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                return False
+            self._total_bytes += session.add('user', user_message)
+            self._total_bytes += session.add('assistant', reply)
+            self._evict()
+            return True
+
+    def pending_count(self, session_id):
+        """待摘要的消息条数"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or not session.overflow:
+                return 0
+            return len(session.overflow)
+
+    def pending_overflow(self, session_id):
+        """取得 (当前摘要, 待摘要消息列表, 最后一条的序号) 的快照，没有待摘要消息时返回None"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or not session.overflow:
+                return None
+            messages = [{'role': role, 'content': content} for _, role, content in session.overflow]
+            return session.summary, messages, session.overflow[-1][0]
+
+    def commit_summary(self, session_id, summary, last_seq):
+        """写入新摘要并移除序号不超过last_seq的已合并待摘要消息"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            self._total_bytes += session.fold(summary, last_seq)
+            self._evict()
+            return True
+
+    def delete(self, session_id):
+        """删除会话"""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return False
+            self._total_bytes -= session.size
+            return True
+
+    def _touch(self, session_id):
+        """取出会话并刷新活跃时间，已过期的会话直接删除"""
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        now = time.time()
+        if now - session.last_active > self.ttl:
+            self._remove(session_id, 'expired')
+            return None
+        session.last_active = now
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def _remove(self, session_id, reason):
+        session = self._sessions.pop(session_id)
+        self._total_bytes -= session.size
+        self._stats[reason] += 1
+
+    def _expire_idle(self):
+        """删除空闲超时的会话（按最近使用顺序，遇到未过期的即停止）"""
+        deadline = time.time() - self.ttl
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_active > deadline:
+                break
+            self._remove(session_id, 'expired')
+
+    def _evict(self):
+        """超出会话数或内存上限时淘汰最久未使用的会话（保留最近使用的一个）"""
+        while len(self._sessions) > 1 and (
+                len(self._sessions) > self.max_sessions or self._total_bytes > self.max_bytes):
+            session_id = next(iter(self._sessions))
+            self._remove(session_id, 'evicted')
+            logger.info(f"会话超出上限被淘汰: {session_id}")
+
+    def get_stats(self):
+        """获取会话统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['active'] = len(self._sessions)
+            stats['bytes'] = self._total_bytes
+        stats['max_sessions'] = self.max_sessions
+        stats['max_bytes'] = self.max_bytes
+        return stats
@@ -0,0 +1,89 @@
+# -*- coding:utf-8 -*-
+"""
+相同请求合并（single-flight）
+同一时刻对同一个键只发起一次上游调用，其余并发调用等待并共享这次调用的结果或异常。
+SingleFlight用于线程模型，AsyncSingleFlight用于asyncio事件循环。
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """按键合并进行中的调用，线程安全"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {'originated': 0, 'coalesced': 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        """执行fn(*args, **kwargs)；相同键的调用正在进行时直接等待它的结果"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self._stats['originated'] += 1
+            else:
+                self._stats['coalesced'] += 1
+
+        if not leader:
+            logger.info(f"{self.name}: 合并到进行中的相同请求")
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def get_stats(self):
+        """获取合并统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['inflight'] = len(self._calls)
+        total = stats['originated'] + stats['coalesced']
+        stats['coalesce_rate'] = round(stats['coalesced'] / total, 4) if total else 0.0
+        return stats
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight的asyncio版本，只在事件循环线程中调用
+
+    上游调用在独立的任务中执行，发起者被取消（如客户端断开）时不影响其余等待者。
+    """
+
+    async def do(self, key, fn, *args, **kwargs):
+        """await fn(*args, **kwargs)；相同键的调用正在进行时直接等待它的结果"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda t: self._finish(key, t))
+            with self._lock:
+                self._calls[key] = task
+                self._stats['originated'] += 1
+        else:
+            with self._lock:
+                self._stats['coalesced'] += 1
+            logger.info(f"{self.name}: 合并到进行中的相同请求")
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        with self._lock:
+            if self._calls.get(key) is task:
+                del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # 所有等待者都已取消时也取回异常，避免未取回异常的警告
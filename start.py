@@ -20,6 +20,8 @@ def check_dependencies():
         import flask_cors
         import requests
         import websocket
+        if config.SERVER_MODE == 'async':
+            import aiohttp
         print("✅ 所有依赖包已安装")
         return True
     except ImportError as e:
@@ -108,6 +110,13 @@ def start_server():
     print("=" * 60)
     
     try:
+        # 异步模式：由aiohttp提供接口
+        if config.SERVER_MODE == 'async':
+            from aiohttp import web
+            from async_app import create_app
+            web.run_app(create_app(), host=config.HOST, port=config.PORT)
+            return
+        
         # 导入并运行Flask应用
         from app import app
         
@@ -3,13 +3,28 @@
 """
 黄鹏AI对话工具 - 系统测试脚本
 用于验证各项功能是否正常工作
+
+压力测试模式：按请求配比并发调用 /chat、/recognize、/synthesize，逐级提高并发数，
+找出吞吐量不再增长的饱和点，并输出各接口的吞吐量、错误率和延迟分位数报告（JSON/CSV）。
+    python test_system.py --load --concurrency 1,2,4,8,16 --duration 10 \\
+        --mix chat=2,recognize=1,synthesize=1 --report load_report.json --csv load_report.csv
 """
 
 import requests
+import argparse
+import csv
+import io
+import itertools
 import json
+import math
+import random
+import statistics
+import struct
+import threading
 import time
 import os
 import sys
+import wave
 from config import config
 
 def test_server_status():
@@ -215,6 +230,273 @@ def test_file_structure():
         print(f"⚠️ 缺失 {len(missing_files)} 个文件")
         return False
 
+# ===== 压力测试 =====
+
+LOAD_ENDPOINTS = ('chat', 'recognize', 'synthesize')
+
+# 压力测试使用的对话消息，附加序号避免命中回复缓存
+LOAD_MESSAGES = [
+    "你好，黄鹏！",
+    "今天天气怎么样？",
+    "给我讲个笑话吧",
+    "我有点累了，想休息一下",
+    "周末有什么好玩的推荐吗？",
+]
+
+LOAD_SAMPLE_TEXT = "你好，谢猪猪！今天过得开心吗？"
+
+
+def parse_mix(text):
+    """解析请求配比，如 chat=2,recognize=1,synthesize=1"""
+    weights = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in LOAD_ENDPOINTS:
+            raise ValueError(f"未知的接口: {name}")
+        weights[name] = float(weight or 1)
+    if not weights or sum(weights.values()) <= 0:
+        raise ValueError("请求配比为空")
+    return weights
+
+
+def generate_sample_wav(seconds=1.5, sample_rate=16000):
+    """生成一段16kHz单声道的合成语音WAV（滑音正弦波），用于无法获取真实语音时"""
+    frames = bytearray()
+    for i in range(int(seconds * sample_rate)):
+        t = i / sample_rate
+        frequency = 200 + 150 * math.sin(2 * math.pi * 3 * t)
+        frames += struct.pack('<h', int(8000 * math.sin(2 * math.pi * frequency * t)))
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+def load_sample_audio(base_url, audio_path=None):
+    """准备识别用的音频：指定文件 > 服务自身合成的语音 > 本地生成的WAV"""
+    if audio_path:
+        with open(audio_path, 'rb') as f:
+            return f.read(), os.path.basename(audio_path)
+    
+    try:
+        response = requests.post(f'{base_url}/synthesize', json={'text': LOAD_SAMPLE_TEXT}, timeout=30)
+        if response.status_code == 200:
+            audio = requests.get(base_url + response.json()['audio_url'], timeout=10)
+            if audio.status_code == 200 and audio.content:
+                return audio.content, 'sample.wav'
+    except (requests.exceptions.RequestException, ValueError, KeyError):
+        pass
+    
+    print("⚠️ 无法通过服务合成样本语音，使用本地生成的音频（真实识别服务可能返回空结果）")
+    return generate_sample_wav(), 'sample.wav'
+
+
+def send_load_request(session, base_url, endpoint, run_tag, seq, audio, audio_name):
+    """发送一个压测请求，返回 (是否成功, HTTP状态码)
+    
+    文本中带上本次压测的开始时间run_tag和序号seq，不会命中回复缓存和TTS缓存。
+    """
+    if endpoint == 'chat':
+        message = f"{LOAD_MESSAGES[seq % len(LOAD_MESSAGES)]}（{run_tag}-{seq}）"
+        response = session.post(f'{base_url}/chat', json={'message': message, 'history': []}, timeout=60)
+    elif endpoint == 'synthesize':
+        text = f"{LOAD_SAMPLE_TEXT}这是{run_tag}第{seq}次测试。"
+        response = session.post(f'{base_url}/synthesize', json={'text': text}, timeout=60)
+    else:
+        response = session.post(
+            f'{base_url}/recognize',
+            files={'audio': (audio_name, audio, 'audio/wav')},
+            timeout=60
+        )
+    
+    ok = response.status_code == 200
+    if ok:
+        try:
+            ok = response.json().get('status') == 'success'
+        except ValueError:
+            ok = False
+    return ok, response.status_code
+
+
+def percentile(samples, p):
+    """最近秩法百分位数"""
+    ordered = sorted(samples)
+    index = max(int(round(p / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize_samples(samples, elapsed):
+    """汇总一组 (是否成功, 耗时, 状态码) 样本"""
+    total = len(samples)
+    latencies = [latency for ok, latency, _ in samples if ok]
+    errors = total - len(latencies)
+    summary = {
+        'requests': total,
+        'ok': len(latencies),
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'throughput': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'status_codes': {},
+    }
+    for _, _, status in samples:
+        summary['status_codes'][str(status)] = summary['status_codes'].get(str(status), 0) + 1
+    if latencies:
+        summary.update({
+            'mean_ms': round(statistics.mean(latencies) * 1000, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+            'max_ms': round(max(latencies) * 1000, 1),
+        })
+    return summary
+
+
+def run_load_level(base_url, concurrency, duration, weights, audio, audio_name, rng, counter, run_tag):
+    """以固定并发持续发送请求（每个工作线程收到响应后立即发下一个），返回各接口的汇总"""
+    samples = {endpoint: [] for endpoint in weights}
+    lock = threading.Lock()
+    names = list(weights)
+    values = list(weights.values())
+    seeds = [rng.random() for _ in range(concurrency)]
+    deadline = time.perf_counter() + duration
+    
+    def worker(seed):
+        local_rng = random.Random(seed)
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            endpoint = local_rng.choices(names, weights=values)[0]
+            with lock:
+                seq = next(counter)
+            start = time.perf_counter()
+            try:
+                ok, status = send_load_request(session, base_url, endpoint, run_tag, seq, audio, audio_name)
+            except requests.exceptions.RequestException:
+                ok, status = False, 0
+            latency = time.perf_counter() - start
+            with lock:
+                samples[endpoint].append((ok, latency, status))
+        session.close()
+    
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(seed,), daemon=True) for seed in seeds]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    
+    return {
+        'concurrency': concurrency,
+        'elapsed': round(elapsed, 2),
+        'endpoints': {endpoint: summarize_samples(items, elapsed) for endpoint, items in samples.items()},
+        'total': summarize_samples([item for items in samples.values() for item in items], elapsed),
+    }
+
+
+def find_knee(levels, min_gain=0.1, max_error_rate=0.01):
+    """找出饱和点：吞吐量增幅低于min_gain或错误率超过max_error_rate之前的最后一级并发"""
+    knee = None
+    for level in levels:
+        total = level['total']
+        if total['error_rate'] > max_error_rate:
+            break
+        if knee and total['throughput'] < knee['total']['throughput'] * (1 + min_gain):
+            break
+        knee = level
+    return knee
+
+
+def write_load_csv(path, levels):
+    """每级并发、每个接口一行"""
+    fields = ['concurrency', 'endpoint', 'requests', 'ok', 'errors', 'error_rate', 'throughput',
+              'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms']
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        for level in levels:
+            rows = dict(level['endpoints'], total=level['total'])
+            for endpoint, summary in rows.items():
+                writer.writerow(dict(summary, concurrency=level['concurrency'], endpoint=endpoint))
+
+
+def print_load_level(level):
+    print(f"\n📶 并发 {level['concurrency']}（{level['elapsed']}s）")
+    rows = dict(level['endpoints'], total=level['total'])
+    for endpoint, summary in rows.items():
+        if not summary['requests']:
+            print(f"   {endpoint:<11} 无请求")
+        elif summary['ok']:
+            print(f"   {endpoint:<11} {summary['throughput']:>7.2f}/s  错误率 {summary['error_rate'] * 100:>5.1f}%  "
+                  f"p50 {summary['p50_ms']:>7.1f}ms  p95 {summary['p95_ms']:>7.1f}ms  p99 {summary['p99_ms']:>7.1f}ms")
+        else:
+            print(f"   {endpoint:<11} 全部失败（{summary['requests']} 次，状态码 {summary['status_codes']}）")
+
+
+def run_load_test(args):
+    """压力测试：逐级提高并发，输出报告并给出饱和点"""
+    test_host = '127.0.0.1' if config.HOST == '0.0.0.0' else config.HOST
+    base_url = (args.base_url or f'http://{test_host}:{config.PORT}').rstrip('/')
+    weights = parse_mix(args.mix)
+    levels_to_run = [int(level) for level in args.concurrency.split(',') if level.strip()]
+    rng = random.Random(args.seed)
+    
+    print("🎯 黄鹏AI对话工具 - 压力测试")
+    print("=" * 50)
+    print(f"🌐 服务地址: {base_url}")
+    print(f"🔀 请求配比: {weights}")
+    print(f"📶 并发级别: {levels_to_run}，每级 {args.duration}s")
+    
+    audio, audio_name = (None, None)
+    if 'recognize' in weights:
+        audio, audio_name = load_sample_audio(base_url, args.audio)
+        print(f"🎤 识别样本: {audio_name}（{len(audio)} bytes）")
+    
+    levels = []
+    counter = itertools.count(1)
+    run_tag = time.strftime('%H%M%S')
+    for concurrency in levels_to_run:
+        level = run_load_level(base_url, concurrency, args.duration, weights, audio, audio_name, rng,
+                               counter, run_tag)
+        levels.append(level)
+        print_load_level(level)
+    
+    knee = find_knee(levels, args.knee_gain, args.max_error_rate)
+    print("\n" + "=" * 50)
+    if knee:
+        print(f"📈 饱和点: 并发 {knee['concurrency']}，吞吐量 {knee['total']['throughput']}/s，"
+              f"p95 {knee['total'].get('p95_ms')}ms")
+        if knee is levels[-1]:
+            print("⚠️ 最高并发级别仍未饱和，可继续提高并发")
+    else:
+        print("❌ 最低并发级别的错误率已超过阈值，未找到饱和点")
+    
+    report = {
+        'base_url': base_url,
+        'mix': weights,
+        'duration': args.duration,
+        'seed': args.seed,
+        'levels': levels,
+        'knee': {
+            'concurrency': knee['concurrency'],
+            'throughput': knee['total']['throughput'],
+            'p95_ms': knee['total'].get('p95_ms'),
+        } if knee else None,
+    }
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"📝 JSON报告: {args.report}")
+    if args.csv:
+        write_load_csv(args.csv, levels)
+        print(f"📝 CSV报告: {args.csv}")
+    return knee is not None
+
 def main():
     """主测试函数"""
     print("🎯 黄鹏AI对话工具 - 系统测试")
@@ -265,6 +547,22 @@ def main():
         print("❌ 多项测试失败，请检查系统配置")
         return False
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='黄鹏AI对话工具系统测试')
+    parser.add_argument('--load', action='store_true', help='运行压力测试而不是功能测试')
+    parser.add_argument('--base-url', help='服务地址，默认取配置中的HOST和PORT')
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help='逗号分隔的并发级别')
+    parser.add_argument('--duration', type=float, default=10, help='每级并发的持续时间（秒）')
+    parser.add_argument('--mix', default='chat=2,recognize=1,synthesize=1', help='请求配比')
+    parser.add_argument('--audio', help='识别用的音频文件，默认使用服务合成的样本语音')
+    parser.add_argument('--seed', type=int, default=1, help='请求配比抽样的随机种子')
+    parser.add_argument('--knee-gain', type=float, default=0.1, help='吞吐量增幅低于该比例即视为饱和')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='错误率超过该值即视为饱和')
+    parser.add_argument('--report', help='JSON报告文件')
+    parser.add_argument('--csv', help='CSV报告文件')
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    success = main()
+    args = parse_args()
+    success = run_load_test(args) if args.load else main()
     sys.exit(0 if success else 1) 
\ No newline at end of file
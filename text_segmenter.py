@@ -0,0 +1,112 @@
+# -*- coding:utf-8 -*-
+"""
+文本分句
+按中英文句末标点把长文本切分为适合单次语音合成的短句
+"""
+
+import re
+
+# 句末标点（中文句号、问号、叹号、分号、省略号、换行），英文句点后需跟空白才算句末
+_SENTENCE_END = re.compile(r'(?<=[。！？!?；;…\n])|(?<=[.])(?=\s)')
+# 超长句子的次级切分点
+_CLAUSE_END = re.compile(r'(?<=[，,、：:])')
+
+
+def _split_long(sentence, max_chars):
+    """把超过长度上限的句子按逗号等切开，仍然过长时按固定长度切分"""
+    pieces = []
+    current = ''
+    for clause in _CLAUSE_END.split(sentence):
+        if not clause:
+            continue
+        if current and len(current) + len(clause) > max_chars:
+            pieces.append(current)
+            current = ''
+        current += clause
+        while len(current) > max_chars:
+            pieces.append(current[:max_chars])
+            current = current[max_chars:]
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _join(left, right):
+    """拼接两段文本，英文之间补回被去掉的空格"""
+    if left and right and left[-1].isascii() and right[0].isascii():
+        return left + ' ' + right
+    return left + right
+
+
+def split_sentences(text, max_chars=80, min_chars=6):
+    """把文本切分为句子列表
+
+    max_chars: 单句长度上限，超出时继续切分
+    min_chars: 过短的句子（如“哈哈！”）并入下一句，减少合成会话数
+    """
+    sentences = []
+    for part in _SENTENCE_END.split(text):
+        part = part.strip()
+        if part:
+            sentences.extend(_split_long(part, max_chars))
+
+    merged = []
+    carry = ''
+    for sentence in sentences:
+        sentence = _join(carry, sentence)
+        if len(sentence) < min_chars:
+            carry = sentence
+            continue
+        merged.append(sentence)
+        carry = ''
+
+    if carry:
+        if merged and len(merged[-1]) + len(carry) <= max_chars:
+            merged[-1] = _join(merged[-1], carry)
+        else:
+            merged.append(carry)
+
+    return merged
+
+
+class SentenceBuffer:
+    """流式分句：逐段喂入增量文本，每凑满一句就立即取出，用于边生成边合成"""
+
+    def __init__(self, max_chars=80, min_chars=6):
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self._buffer = ''
+
+    def feed(self, text):
+        """追加增量文本，返回已经完整的句子列表"""
+        self._buffer += text
+        sentences = []
+        while True:
+            end = self._find_end()
+            if end is None:
+                break
+            sentence = self._buffer[:end].strip()
+            self._buffer = self._buffer[end:]
+            if sentence:
+                sentences.extend(_split_long(sentence, self.max_chars))
+
+        # 迟迟没有句末标点时按长度切出，只保留最后一段继续等待
+        if len(self._buffer) > self.max_chars:
+            pieces = _split_long(self._buffer.strip(), self.max_chars)
+            sentences.extend(pieces[:-1])
+            self._buffer = pieces[-1] if pieces else ''
+        return sentences
+
+    def flush(self):
+        """取出剩余的全部文本"""
+        rest = self._buffer.strip()
+        self._buffer = ''
+        return _split_long(rest, self.max_chars) if rest else []
+
+    def _find_end(self):
+        """查找第一个足够长的句子的结束位置"""
+        for match in _SENTENCE_END.finditer(self._buffer):
+            end = match.end()
+            if len(self._buffer[:end].strip()) >= self.min_chars:
+                return end
+        return None
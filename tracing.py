@@ -0,0 +1,185 @@
+# -*- coding:utf-8 -*-
+"""
+请求级的分阶段耗时追踪
+每个HTTP请求对应一条追踪，记录解码、识别、对话、合成、写文件等阶段（span）的起止时间。
+提交到线程池的任务通过bind()继承提交时所在请求的追踪；没有追踪时span()几乎没有开销。
+结果以Server-Timing响应头返回，并可按采样率或慢请求阈值输出为JSON追踪记录。
+"""
+
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+class Trace:
+    """一个请求的追踪：span列表，可在多个线程中追加"""
+
+    def __init__(self, method, path):
+        self.trace_id = os.urandom(8).hex()
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.spans = []  # [(名称, 相对请求开始的偏移, 耗时, 线程名)]
+
+    def add(self, name, start, end):
+        # list.append是原子操作，工作线程可直接追加
+        self.spans.append((name, start - self.start, end - start, threading.current_thread().name))
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """生成Server-Timing头：同名span合并耗时，多次出现时在desc中注明次数"""
+        totals = {}
+        for name, _, duration, _ in list(self.spans):
+            total = totals.setdefault(name, [0.0, 0])
+            total[0] += duration
+            total[1] += 1
+
+        entries = []
+        for name, (duration, count) in totals.items():
+            entry = f'{name};dur={duration * 1000:.1f}'
+            if count > 1:
+                entry += f';desc="x{count}"'
+            entries.append(entry)
+        entries.append(f'total;dur={self.elapsed() * 1000:.1f}')
+        return ', '.join(entries)
+
+    def to_record(self, status):
+        """JSON追踪记录"""
+        return {
+            'trace_id': self.trace_id,
+            'timestamp': round(self.started_at, 3),
+            'method': self.method,
+            'path': self.path,
+            'status': status,
+            'duration_ms': round(self.elapsed() * 1000, 1),
+            'spans': [
+                {
+                    'name': name,
+                    'offset_ms': round(offset * 1000, 1),
+                    'duration_ms': round(duration * 1000, 1),
+                    'thread': thread,
+                }
+                for name, offset, duration, thread in sorted(self.spans, key=lambda span: span[1])
+            ],
+        }
+
+
+def start_trace(method, path):
+    """为当前请求开始一条追踪"""
+    trace = Trace(method, path)
+    _current.set(trace)
+    return trace
+
+
+def end_trace():
+    """结束当前请求的追踪，返回该追踪"""
+    trace = _current.get()
+    _current.set(None)
+    return trace
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    """记录一个阶段的耗时，不在请求中时什么也不做"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, start, time.perf_counter())
+
+
+def add_span(name, start, end=None):
+    """记录一个已知起止时间（perf_counter）的阶段"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, start, time.perf_counter() if end is None else end)
+
+
+def bind(fn, wait_span=None):
+    """让fn在其他线程中执行时沿用当前请求的追踪
+
+    指定wait_span时，同时记录从提交到开始执行的排队时间。
+    """
+    trace = _current.get()
+    if trace is None:
+        return fn
+    submitted = time.perf_counter()
+
+    def run(*args, **kwargs):
+        token = _current.set(trace)
+        try:
+            if wait_span:
+                trace.add(wait_span, submitted, time.perf_counter())
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return run
+
+
+class TraceRecorder:
+    """按采样率或慢请求阈值输出JSON追踪记录
+
+    path为空时写入日志，否则每条记录一行追加到文件。
+    """
+
+    def __init__(self, sample_rate=0.0, slow_threshold=0, path=None):
+        self.sample_rate = sample_rate  # 随机采样比例，0表示不采样
+        self.slow_threshold = slow_threshold  # 耗时超过该值（秒）的请求总是记录，0表示不启用
+        self.path = path
+        self._lock = threading.Lock()
+        self._stats = {'traced': 0, 'sampled': 0, 'slow': 0, 'failed': 0}
+
+    def finish(self, trace, status):
+        """请求结束时调用，决定是否输出这条追踪"""
+        slow = bool(self.slow_threshold) and trace.elapsed() >= self.slow_threshold
+        sampled = not slow and self.sample_rate > 0 and random.random() < self.sample_rate
+        with self._lock:
+            self._stats['traced'] += 1
+            if slow:
+                self._stats['slow'] += 1
+            elif sampled:
+                self._stats['sampled'] += 1
+        if slow or sampled:
+            self.write(trace.to_record(status))
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        if not self.path:
+            logger.info(f"请求追踪: {line}")
+            return
+        try:
+            with self._lock:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line + '\n')
+        except OSError as e:
+            with self._lock:
+                self._stats['failed'] += 1
+            logger.warning(f"写入追踪记录失败: {str(e)}")
+
+    def get_stats(self):
+        """获取追踪统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['sample_rate'] = self.sample_rate
+        stats['slow_threshold'] = self.slow_threshold
+        return stats
@@ -0,0 +1,133 @@
+# -*- coding:utf-8 -*-
+"""
+语音合成结果缓存
+以合成参数的哈希作为键，将WAV文件保存在磁盘上，相同文本再次合成时直接复用
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TTSCache:
+    """按内容寻址、带容量上限和LRU淘汰的TTS磁盘缓存"""
+
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes  # 缓存文件总大小上限（字节）
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> 文件大小，按最近使用排序
+        self._total_bytes = 0
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+        }
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def make_key(text, params):
+        """根据文本和全部合成参数生成缓存键"""
+        payload = json.dumps({'text': text, 'params': params}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        """缓存文件路径，按键前两位分目录存放"""
+        return os.path.join(self.cache_dir, key[:2], f"{key}.wav")
+
+    def _load(self):
+        """启动时扫描已有缓存文件，按修改时间恢复LRU顺序"""
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.wav'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                found.append((st.st_mtime, name[:-4], st.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+
+        if found:
+            logger.info(f"TTS缓存已加载 {len(found)} 个文件, 共 {self._total_bytes} bytes")
+        self._evict()
+
+    def get(self, key):
+        """命中时返回缓存文件路径，否则返回None"""
+        with self._lock:
+            if key in self._entries:
+                path = self.path_for(key)
+                if os.path.exists(path):
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return path
+                # 文件已被外部删除，同步移除索引
+                self._total_bytes -= self._entries.pop(key)
+            self._stats['misses'] += 1
+            return None
+
+    def put(self, key, write_func):
+        """写入缓存并返回文件路径
+
+        write_func(path) 负责把WAV写入给定的临时路径；
+        写完后原子替换到最终位置，并发写入同一个键也不会读到半个文件。
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+
+        try:
+            if not write_func(tmp_path):
+                return None
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        size = os.path.getsize(path)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries[key]
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+            self._total_bytes += size
+            self._stats['stores'] += 1
+            self._evict()
+        return path
+
+    def _evict(self):
+        """淘汰最久未使用的文件，直到总大小不超过上限（调用方需持有锁或处于初始化阶段）"""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._stats['evictions'] += 1
+            try:
+                os.unlink(self.path_for(key))
+            except OSError as e:
+                logger.warning(f"删除TTS缓存文件失败: {str(e)}")
+
+    def get_stats(self):
+        """获取缓存统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._total_bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        stats['max_bytes'] = self.max_bytes
+        return stats
@@ -1,21 +1,22 @@
 # -*- coding:utf-8 -*-
 import websocket
-import datetime
-import hashlib
 import base64
-import hmac
 import json
-from urllib.parse import urlencode
 import time
-import ssl
-from wsgiref.handlers import format_date_time
-from datetime import datetime
-from time import mktime
-import _thread as thread
-import os
 import logging
-import tempfile
 import wave
+import threading
+import queue
+import struct
+import asyncio
+from concurrent.futures import Future, CancelledError, InvalidStateError, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from audio_storage import AudioStorage
+from text_segmenter import split_sentences
+from single_flight import SingleFlight
+from xfyun_transport import XfyunTransport, TTS_URL
+from metrics import AUDIO_BYTES, UPSTREAM_ERRORS, observe_stage, observe_future
+from tracing import span, bind
 
 logger = logging.getLogger(__name__)
 
@@ -24,49 +25,46 @@ STATUS_CONTINUE_FRAME = 1  # 中间帧标识
 STATUS_LAST_FRAME = 2  # 最后一帧的标识
 
 
-class TTSService:
-    def __init__(self, appid, api_key, api_secret):
-        self.appid = appid
-        self.api_key = api_key
-        self.api_secret = api_secret
+def streaming_wav_header(sample_rate=16000, channels=1, sample_width=2):
+    """生成长度未知的WAV文件头，RIFF和data长度按惯例填0xFFFFFFFF，便于边合成边播放"""
+    byte_rate = sample_rate * channels * sample_width
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 0xFFFFFFFF, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, byte_rate, channels * sample_width, sample_width * 8,
+        b'data', 0xFFFFFFFF
+    )
+
+
+def _resolve(future, result):
+    """完成Future，Future为空或已完成（如已被取消）时忽略"""
+    if future is None or future.done():
+        return
+    try:
+        future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class TTSQueueFullError(Exception):
+    """合成任务排队已满"""
+
+
+class TTSSession:
+    """单次语音合成会话，独立持有本次合成的连接与音频数据"""
+
+    def __init__(self, service, text, on_audio=None, future=None):
+        self.service = service
+        self.text = text
+        self.on_audio = on_audio  # 每收到一帧音频时回调，用于流式输出
+        self.future = future  # 合成结束时直接在消息回调中完成，结果为PCM数据或None
         self.audio_data = bytearray()
         self.synthesis_complete = False
         self.synthesis_error = None
-        
-    def create_url(self):
-        """生成websocket连接URL"""
-        url = 'wss://tts-api.xfyun.cn/v2/tts'
-        # 生成RFC1123格式的时间戳
-        now = datetime.now()
-        date = format_date_time(mktime(now.timetuple()))
-
-        # 拼接字符串
-        signature_origin = "host: " + "ws-api.xfyun.cn" + "\n"
-        signature_origin += "date: " + date + "\n"
-        signature_origin += "GET " + "/v2/tts " + "HTTP/1.1"
-        
-        # 进行hmac-sha256进行加密
-        signature_sha = hmac.new(
-            self.api_secret.encode('utf-8'), 
-            signature_origin.encode('utf-8'),
-            digestmod=hashlib.sha256
-        ).digest()
-        signature_sha = base64.b64encode(signature_sha).decode(encoding='utf-8')
-
-        authorization_origin = "api_key=\"%s\", algorithm=\"%s\", headers=\"%s\", signature=\"%s\"" % (
-            self.api_key, "hmac-sha256", "host date request-line", signature_sha)
-        authorization = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
-        
-        # 将请求的鉴权参数组合为字典
-        v = {
-            "authorization": authorization,
-            "date": date,
-            "host": "ws-api.xfyun.cn"
-        }
-        
-        # 拼接鉴权参数，生成url
-        url = url + '?' + urlencode(v)
-        return url
+        self.ws = None
+        self.cancelled = False
+        if future is not None:
+            future.add_done_callback(self._on_future_done)
 
     def on_message(self, ws, message):
         """处理websocket消息"""
@@ -88,117 +86,607 @@ class TTSService:
             if code != 0:
                 errMsg = message["message"]
                 logger.error(f"TTS Error: {errMsg}, Code: {code}")
+                UPSTREAM_ERRORS.inc('xfyun_tts', str(code))
                 self.synthesis_error = errMsg
+                self._finish(None)
                 ws.close()
             else:
                 # 收集音频数据
                 self.audio_data.extend(audio)
+                if self.on_audio and audio:
+                    self.on_audio(audio)
+                if self.synthesis_complete:
+                    self._finish(bytes(self.audio_data))
                 
         except Exception as e:
             logger.error(f"处理TTS消息失败: {str(e)}")
             self.synthesis_error = str(e)
+            self._finish(None)
             ws.close()
 
     def on_error(self, ws, error):
         """处理websocket错误"""
         logger.error(f"TTS WebSocket错误: {error}")
+        UPSTREAM_ERRORS.inc('xfyun_tts', 'connection')
         self.synthesis_error = str(error)
+        self._finish(None)
 
     def on_close(self, ws, close_status_code, close_msg):
         """处理websocket关闭"""
         logger.info("TTS WebSocket连接已关闭")
 
-    def on_open(self, ws, text):
-        """处理websocket连接打开"""
-        def run(*args):
-            # 公共参数
-            common_args = {"app_id": self.appid}
-            
-            # 业务参数
-            business_args = {
-                "aue": "raw", 
-                "auf": "audio/L16;rate=16000", 
-                "vcn": "aisjiuxu", 
-                "tte": "utf8"
-            }
-            
-            # 数据参数
-            data_args = {
-                "status": 2, 
-                "text": str(base64.b64encode(text.encode('utf-8')), "UTF8")
-            }
-            
-            d = {
-                "common": common_args,
-                "business": business_args,
-                "data": data_args,
-            }
-            
-            d = json.dumps(d)
-            logger.info("发送TTS请求数据")
-            ws.send(d)
+    def abort(self):
+        """取消本次合成：断开连接，唤醒阻塞在recv上的工作线程"""
+        self.cancelled = True
+        ws = self.ws
+        if ws is not None:
+            try:
+                ws.abort()
+            except OSError:
+                pass
 
-        thread.start_new_thread(run, ())
+    def _on_future_done(self, future):
+        if future.cancelled():
+            self.abort()
 
-    def synthesize(self, text):
-        """语音合成主方法"""
+    def _finish(self, result):
+        _resolve(self.future, result)
+        return result
+
+    def run(self, timeout=30):
+        """执行合成，成功返回PCM数据，失败返回None"""
+        if self.cancelled:
+            return None
+        ws = None
+        deadline = time.monotonic() + timeout
         try:
-            # 重置状态
-            self.audio_data = bytearray()
-            self.synthesis_complete = False
-            self.synthesis_error = None
-            
-            # 创建websocket连接
-            ws_url = self.create_url()
-            
-            # 设置websocket选项
-            ws = websocket.WebSocketApp(
-                ws_url,
-                on_message=self.on_message,
-                on_error=self.on_error,
-                on_close=self.on_close
-            )
-            
-            # 设置on_open回调，传递文本
-            ws.on_open = lambda ws: self.on_open(ws, text)
-            
-            # 启动websocket连接
-            ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
-            
-            # 等待合成完成
-            timeout = 30  # 30秒超时
-            start_time = time.time()
-            
-            while not self.synthesis_complete and not self.synthesis_error:
-                if time.time() - start_time > timeout:
-                    logger.error("TTS合成超时")
-                    return None
-                time.sleep(0.1)
-            
-            if self.synthesis_error:
-                logger.error(f"TTS合成失败: {self.synthesis_error}")
+            # 优先取用已完成握手的预热连接
+            with span('tts_connect'):
+                ws = self.service.transport.connect()
+            self.ws = ws
+            if self.cancelled:
+                # 建立连接期间已被取消
                 return None
+            logger.info("发送TTS请求数据")
+            ws.send(json.dumps(self.service.build_request(self.text)))
             
-            # 转换PCM数据为WAV格式
-            return self.convert_pcm_to_wav(self.audio_data)
-            
+            # 阻塞读取服务端推送的音频帧，直到合成完成或出错
+            while not self.synthesis_complete and not self.synthesis_error:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise websocket.WebSocketTimeoutException()
+                ws.settimeout(remaining)
+                message = ws.recv()
+                if not message:
+                    self.synthesis_error = "TTS连接在合成完成前关闭"
+                    break
+                self.on_message(ws, message)
+        
+        except websocket.WebSocketTimeoutException:
+            logger.error("TTS合成超时")
+            return self._finish(None)
+        except (websocket.WebSocketException, OSError) as e:
+            if not self.cancelled:
+                self.on_error(ws, e)
+        finally:
+            if ws is not None:
+                ws.close()
+                self.on_close(ws, None, None)
+        
+        if self.cancelled:
+            logger.info("TTS合成已取消")
+            return None
+        
+        if self.synthesis_error:
+            logger.error(f"TTS合成失败: {self.synthesis_error}")
+            return self._finish(None)
+        
+        return self._finish(bytes(self.audio_data))
+
+
+class _SynthesisStream:
+    """stream()返回的PCM数据块迭代器
+    
+    合成在创建时已经提交；迭代结束、调用close()或迭代器被丢弃（即使从未迭代）时取消未完成的合成，
+    及时释放占用的名额，不必等到截止时间。
+    """
+
+    def __init__(self, chunks, future=None):
+        self._chunks = chunks
+        self._future = future  # 缓存命中时为None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+    def close(self):
+        self._chunks.close()
+        if self._future is not None:
+            self._future.cancel()
+
+    def __del__(self):
+        self.close()
+
+
+class _SegmentedSynthesis:
+    """长文本的分句合成，submit_synthesize和stream共用
+    
+    在并行窗口内提交分句，每句完成时由回调提交下一句，不占用等待线程；没有可用名额且没有在途分句时，
+    登记等待，任一合成任务释放名额后再继续，截止时间已过则失败。各句结果按原顺序放在results中，
+    全部完成后拼接：store为True时写入WAV并以文件路径完成future，否则以拼接后的PCM数据完成。
+    任一句失败或future被取消时撤销其余分句，future以None完成。
+    """
+
+    def __init__(self, service, segments, cache_key, deadline, store=True):
+        self.service = service
+        self.segments = segments
+        self.cache_key = cache_key
+        self.deadline = deadline
+        self.store = store
+        self.future = Future()
+        self.results = [Future() for _ in segments]  # 各句PCM数据，按原顺序
+        self.next_index = 0
+        self.running = 0
+        self.finished = 0
+        self._lock = threading.Lock()
+        self.future.add_done_callback(self._on_done)
+
+    def start(self):
+        """提交第一句（排不上队时抛出TTSQueueFullError），再在并行窗口内提交后续分句"""
+        logger.info(f"TTS分句合成: 共 {len(self.segments)} 句")
+        self.next_index = 1
+        self.running = 1
+        self._launch(0, self.service._submit)
+        self._fill()
+        return self
+
+    def _fill(self):
+        while True:
+            with self._lock:
+                if (self.future.done() or self.next_index >= len(self.segments)
+                        or self.running >= self.service.segment_parallelism):
+                    return
+                releases = self.service._slot_releases
+                if not self.service._slots.acquire(blocking=False):
+                    if self.running:
+                        return  # 在途分句完成时会再次推进
+                    break
+                index = self.next_index
+                self.next_index += 1
+                self.running += 1
+            try:
+                self._launch(index, self.service._dispatch)
+            except Exception as e:
+                logger.error(f"TTS分句提交失败: {str(e)}")
+                _resolve(self.future, None)
+                return
+        
+        if time.monotonic() >= self.deadline:
+            logger.error("TTS分句等待合成名额超时")
+            _resolve(self.future, None)
+        elif not self.service._wait_for_slot(bind(self._fill), releases):
+            self._fill()  # 检查名额之后已有名额释放，立即重试
+
+    def _launch(self, index, submit):
+        result = self.results[index]
+        task = submit(self.service._synthesize_segment, self.segments[index], result, self.deadline)
+        self.service._link(result, task)
+        # 在任务结束（名额已释放）后推进，保证下一句可以取得名额
+        task.add_done_callback(bind(lambda t: self._on_segment(index)))
+
+    def _on_segment(self, index):
+        result = self.results[index]
+        pcm_data = None if result.cancelled() else result.result()
+        with self._lock:
+            self.running -= 1
+            self.finished += 1
+            complete = self.finished == len(self.segments)
+        
+        if pcm_data is None:
+            if not self.future.done():
+                logger.error("TTS分句合成失败")
+            _resolve(self.future, None)
+        elif complete:
+            audio = b''.join(part.result() for part in self.results)
+            _resolve(self.future, self.service._store(audio, self.cache_key) if self.store else audio)
+        else:
+            self._fill()
+
+    def _on_done(self, future):
+        # 已完成的分句不受影响，其余分句撤销或断开连接
+        for result in self.results:
+            result.cancel()
+
+
+class TTSService:
+    def __init__(self, appid, api_key, api_secret, max_workers=4, queue_size=16, timeout=30, cache=None,
+                 storage=None, segment_threshold=60, segment_max_chars=80, segment_parallelism=3,
+                 coalesce=True, transport=None):
+        self.appid = appid
+        self.api_key = api_key
+        self.api_secret = api_secret
+        # 讯飞连接（签名URL缓存、预热连接），未指定时不预热
+        self.transport = transport or XfyunTransport(TTS_URL, api_key, api_secret)
+        self.cache = cache  # TTSCache实例，为None时不缓存
+        self.storage = storage or AudioStorage('audio_files')  # 未缓存的合成结果存放位置
+        
+        # 业务参数（发音人、音频编码、采样率等），同时参与缓存键计算
+        self.business_args = {
+            "aue": "raw", 
+            "auf": "audio/L16;rate=16000", 
+            "vcn": "aisjiuxu", 
+            "tte": "utf8"
+        }
+        self.max_workers = max_workers  # 同时进行的合成会话上限
+        self.queue_size = queue_size  # 排队等待的合成任务上限
+        self.timeout = timeout  # 单次合成超时（秒）
+        self.segment_threshold = segment_threshold  # 超过该长度的文本分句并行合成，0表示不分句
+        self.segment_max_chars = segment_max_chars  # 单个分句的长度上限
+        self.segment_parallelism = max(segment_parallelism, 1)  # 单个请求同时合成的分句数
+        
+        # 并发的相同文本只发起一次合成
+        self._flight = SingleFlight('TTS') if coalesce else None
+        
+        # 工作线程池 + 信号量限制在途任务总数（执行中 + 排队中）
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tts')
+        self._slots = threading.BoundedSemaphore(max_workers + queue_size)
+        self._slot_releases = 0  # 名额释放次数，用于判断登记等待前是否已有名额空出
+        self._slot_waiters = []  # 等待名额的回调，任一名额释放时全部调用
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'rejected': 0,
+            'running': 0,
+            'completed': 0,
+            'failed': 0,
+            'cancelled': 0,
+        }
+        
+    def create_url(self):
+        """生成websocket连接URL（有效期内复用签名）"""
+        return self.transport.create_url()
+
+    def synthesize(self, text):
+        """语音合成主方法
+        
+        命中缓存时直接返回缓存文件；否则提交到有界线程池执行，
+        排队已满时抛出TTSQueueFullError。并发的相同文本共享同一次合成的结果。
+        """
+        with observe_stage('tts'):
+            return self._synthesize_cached(text)
+
+    async def synthesize_async(self, text, timeout=None):
+        """synthesize的协程版本，等待结果时不占用线程；协程被取消时同时取消合成"""
+        return await asyncio.wrap_future(self.submit_synthesize(text, timeout))
+
+    def submit_synthesize(self, text, timeout=None):
+        """提交合成任务，立即返回结果为WAV文件路径的Future（失败时结果为None）
+        
+        命中缓存时返回已完成的Future，未命中时不与并发的相同文本合并。取消Future会断开进行中的连接；
+        timeout为本次调用的截止时间（秒，包含排队时间），默认使用服务的合成超时。
+        排队已满时抛出TTSQueueFullError。
+        """
+        cache_key = None
+        if self.cache:
+            cache_key = self.cache.make_key(text, self.get_cache_params())
+            cached_path = self.cache.get(cache_key)
+            if cached_path:
+                logger.info(f"TTS缓存命中: {cached_path}")
+                future = Future()
+                future.set_result(cached_path)
+                return observe_future('tts', future)
+        return observe_future('tts', self._submit_uncached(text, cache_key, self._deadline(timeout)))
+
+    def _synthesize_cached(self, text):
+        """查找缓存，未命中时合成（相同文本合并为一次）"""
+        cache_key = None
+        if self.cache:
+            cache_key = self.cache.make_key(text, self.get_cache_params())
+            cached_path = self.cache.get(cache_key)
+            if cached_path:
+                logger.info(f"TTS缓存命中: {cached_path}")
+                return cached_path
+        
+        if self._flight:
+            return self._flight.do(text, self._synthesize_uncached, text, cache_key)
+        return self._synthesize_uncached(text, cache_key)
+
+    def _synthesize_uncached(self, text, cache_key):
+        """未命中缓存时的合成流程，返回WAV文件路径"""
+        return self._submit_uncached(text, cache_key, self._deadline()).result()
+
+    def _submit_uncached(self, text, cache_key, deadline):
+        """提交未命中缓存的合成，返回结果为WAV文件路径的Future"""
+        segments = self.split_text(text)
+        if len(segments) > 1:
+            # 长文本：分句并行合成后按顺序拼接
+            return _SegmentedSynthesis(self, segments, cache_key, deadline).start().future
+        
+        future = Future()
+        task = self._submit(self._synthesize, text, cache_key, None, future, deadline)
+        return self._link(future, task)
+
+    def stream(self, text, timeout=None):
+        """流式语音合成，返回PCM数据块的迭代器
+        
+        每收到一帧音频就产出一块，首帧到达即可开始播放；合成完成后结果同样写入缓存。
+        长文本分句并行合成，按顺序逐句产出，第一句完成即可开始播放。
+        timeout为本次调用的截止时间（秒，包含排队时间），默认使用服务的合成超时；
+        调用方提前结束迭代、关闭或丢弃迭代器时撤销未完成的合成。排队已满时抛出TTSQueueFullError。
+        """
+        chunks, future = self._start_stream(text, self._deadline(timeout))
+        return _SynthesisStream(self._observe_stream(chunks), future)
+
+    @staticmethod
+    def _observe_stream(chunks):
+        """统计流式合成从开始读取到读完（或调用方提前结束）的耗时"""
+        with observe_stage('tts_stream'):
+            yield from chunks
+
+    def _start_stream(self, text, deadline):
+        """提交流式合成，返回 (数据块生成器, 合成的Future)，缓存命中时Future为None"""
+        cache_key = None
+        if self.cache:
+            cache_key = self.cache.make_key(text, self.get_cache_params())
+            cached_path = self.cache.get(cache_key)
+            if cached_path:
+                logger.info(f"TTS缓存命中: {cached_path}")
+                return self._iter_wav_file(cached_path), None
+        
+        segments = self.split_text(text)
+        if len(segments) > 1:
+            # 未启用缓存时只逐句产出，不另外写入拼接后的文件
+            job = _SegmentedSynthesis(self, segments, cache_key, deadline, store=bool(cache_key))
+            return self._iter_results(job.start(), deadline), job.future
+        
+        chunks = queue.Queue()
+        future = Future()
+        task = self._submit(self._synthesize, text, cache_key, chunks.put, future, deadline)
+        self._link(future, task)
+        future.add_done_callback(lambda f: chunks.put(None))  # 结束标记
+        return self._iter_queue(chunks, future, deadline), future
+
+    def submit_segment(self, text, timeout=None, wait=True):
+        """提交单句合成任务，返回结果为PCM数据的Future（失败时结果为None）
+        
+        用于调用方自行分句、边生成边合成的场景；Future在收到最后一帧音频时即完成，取消Future会断开连接。
+        timeout为本次调用的截止时间（秒，包含排队时间），默认使用服务的合成超时；
+        截止前仍排不上队则抛出TTSQueueFullError；wait为False时不排队，没有空闲名额立即抛出。
+        """
+        deadline = self._deadline(timeout)
+        if wait:
+            acquired = self._slots.acquire(timeout=max(deadline - time.monotonic(), 0))
+        else:
+            acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                self._stats['rejected'] += 1
+            logger.warning("TTS合成队列已满，拒绝请求")
+            raise TTSQueueFullError("TTS合成队列已满")
+        future = Future()
+        self._link(future, self._dispatch(self._synthesize_segment, text, future, deadline))
+        return observe_future('tts_segment', future)
+
+    def split_text(self, text):
+        """按配置决定是否分句，返回待合成的文本列表"""
+        if not self.segment_threshold or len(text) <= self.segment_threshold:
+            return [text]
+        return split_sentences(text, max_chars=self.segment_max_chars) or [text]
+
+    def _iter_results(self, job, deadline):
+        """按原顺序产出各句PCM，任一句失败或到达截止时间即结束"""
+        try:
+            for result in job.results:
+                try:
+                    pcm_data = result.result(timeout=max(deadline - time.monotonic(), 0))
+                except FutureTimeoutError:
+                    logger.error("TTS流式合成超时")
+                    return
+                except CancelledError:
+                    return
+                if pcm_data is None:
+                    return
+                yield pcm_data
+        finally:
+            job.future.cancel()
+
+    def _submit(self, fn, *args):
+        """提交任务到线程池，占用一个在途名额"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            logger.warning("TTS合成队列已满，拒绝请求")
+            raise TTSQueueFullError("TTS合成队列已满")
+        return self._dispatch(fn, *args)
+
+    def _dispatch(self, fn, *args):
+        """提交任务到线程池，调用方已占用在途名额，任务结束后释放"""
+        try:
+            future = self._executor.submit(bind(fn, 'tts_queue'), *args)
+        except Exception:
+            self._release_slot()
+            raise
+        
+        with self._lock:
+            self._stats['submitted'] += 1
+        future.add_done_callback(lambda f: self._release_slot())
+        return future
+
+    def _release_slot(self):
+        """释放一个在途名额，并通知等待名额的分句合成"""
+        self._slots.release()
+        with self._lock:
+            self._slot_releases += 1
+            waiters, self._slot_waiters = self._slot_waiters, []
+        for waiter in waiters:
+            waiter()
+
+    def _wait_for_slot(self, callback, releases):
+        """登记在下一次名额释放时调用callback；releases之后已有名额释放时不登记，返回False"""
+        with self._lock:
+            if self._slot_releases != releases:
+                return False
+            self._slot_waiters.append(callback)
+            return True
+
+    def _link(self, future, task):
+        """把对外的future与线程池任务关联：future被取消时撤销尚未开始的任务，任务异常结束时以None完成future"""
+        def on_cancel(f):
+            if f.cancelled() and task.cancel():
+                with self._lock:
+                    self._stats['cancelled'] += 1
+        
+        task.add_done_callback(lambda t: _resolve(future, None))
+        future.add_done_callback(on_cancel)
+        return future
+
+    def _deadline(self, timeout=None):
+        """本次调用的截止时间（monotonic），默认使用服务的合成超时"""
+        return time.monotonic() + (timeout or self.timeout)
+
+    def _iter_queue(self, chunks, future, deadline):
+        """从队列中依次取出音频块，直到结束标记或到达截止时间；提前结束时取消合成"""
+        try:
+            while True:
+                try:
+                    chunk = chunks.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    logger.error("TTS流式合成超时")
+                    return
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            future.cancel()
+
+    @staticmethod
+    def _iter_wav_file(wav_path, chunk_size=8192):
+        """按块读取WAV文件中的PCM数据"""
+        with wave.open(wav_path, 'rb') as wav_file:
+            frames_per_chunk = chunk_size // (wav_file.getsampwidth() * wav_file.getnchannels())
+            while True:
+                chunk = wav_file.readframes(frames_per_chunk)
+                if not chunk:
+                    return
+                yield chunk
+
+    def _synthesize(self, text, cache_key=None, on_audio=None, future=None, deadline=None):
+        """在工作线程中执行一次独立的合成会话，返回WAV文件路径（同时完成future）"""
+        session_future = None
+        if future is not None:
+            # 会话以PCM数据完成内部Future，对外的future在写入WAV后才完成；取消时一并取消会话
+            session_future = Future()
+            future.add_done_callback(lambda f: f.cancelled() and session_future.cancel())
+        
+        pcm_data = self._run_session(text, on_audio, session_future, deadline)
+        wav_path = None if pcm_data is None else self._store(pcm_data, cache_key)
+        _resolve(future, wav_path)
+        return wav_path
+
+    def _synthesize_segment(self, text, future=None, deadline=None):
+        """合成一个分句并返回PCM数据（同时完成future），分句同样使用缓存"""
+        cache_key = None
+        if self.cache:
+            cache_key = self.cache.make_key(text, self.get_cache_params())
+            cached_path = self.cache.get(cache_key)
+            if cached_path:
+                pcm_data = b''.join(self._iter_wav_file(cached_path))
+                _resolve(future, pcm_data)
+                return pcm_data
+        
+        pcm_data = self._run_session(text, future=future, deadline=deadline)
+        if pcm_data is not None and cache_key:
+            self.cache.put(cache_key, lambda path: self.convert_pcm_to_wav(pcm_data, path))
+        return pcm_data
+
+    def _run_session(self, text, on_audio=None, future=None, deadline=None):
+        """执行合成会话并统计结果，返回PCM数据"""
+        timeout = self.timeout if deadline is None else deadline - time.monotonic()
+        if timeout <= 0:
+            logger.error("TTS合成任务排队超过截止时间")
+            with self._lock:
+                self._stats['failed'] += 1
+            _resolve(future, None)
+            return None
+        
+        with self._lock:
+            self._stats['running'] += 1
+        try:
+            session = TTSSession(self, text, on_audio=on_audio, future=future)
+            pcm_data = session.run(timeout=timeout)
         except Exception as e:
             logger.error(f"TTS合成异常: {str(e)}")
-            return None
+            pcm_data = None
+        _resolve(future, pcm_data)
+        
+        with self._lock:
+            self._stats['running'] -= 1
+            if future is not None and future.cancelled():
+                self._stats['cancelled'] += 1
+            else:
+                self._stats['completed' if pcm_data is not None else 'failed'] += 1
+        if pcm_data is not None:
+            AUDIO_BYTES.inc('tts_pcm', amount=len(pcm_data))
+        return pcm_data
+
+    def _store(self, pcm_data, cache_key=None):
+        """转换PCM数据为WAV格式，启用缓存时直接写入缓存目录"""
+        if cache_key:
+            return self.cache.put(cache_key, lambda path: self.convert_pcm_to_wav(pcm_data, path))
+        return self.convert_pcm_to_wav(pcm_data)
 
-    def convert_pcm_to_wav(self, pcm_data):
-        """将PCM数据转换为WAV格式"""
+    def build_request(self, text):
+        """构造合成请求帧"""
+        # 公共参数
+        common_args = {"app_id": self.appid}
+        
+        # 数据参数
+        data_args = {
+            "status": 2, 
+            "text": str(base64.b64encode(text.encode('utf-8')), "UTF8")
+        }
+        
+        return {
+            "common": common_args,
+            "business": self.business_args,
+            "data": data_args,
+        }
+
+    def get_cache_params(self):
+        """影响合成结果的全部参数，用于计算缓存键"""
+        return {
+            'business': self.business_args,
+            'format': 'wav',
+            'channels': 1,
+            'sample_width': 2,
+            'sample_rate': 16000,
+        }
+
+    def get_stats(self):
+        """获取合成线程池统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = max(stats['submitted'] - stats['completed'] - stats['failed'] - stats['cancelled']
+                              - stats['running'], 0)
+        stats['max_workers'] = self.max_workers
+        stats['queue_size'] = self.queue_size
+        if self.cache:
+            stats['cache'] = self.cache.get_stats()
+        if self._flight:
+            stats['single_flight'] = self._flight.get_stats()
+        stats['transport'] = self.transport.get_stats()
+        return stats
+
+    def convert_pcm_to_wav(self, pcm_data, wav_path=None):
+        """将PCM数据转换为WAV格式，未指定路径时在音频存储中分配新文件"""
         try:
-            # 创建临时文件
-            timestamp = int(time.time() * 1000)
-            wav_filename = f"audio_{timestamp}.wav"
-            wav_path = os.path.join('audio_files', wav_filename)
-            
-            # 确保目录存在
-            os.makedirs('audio_files', exist_ok=True)
+            if wav_path is None:
+                wav_path = self.storage.new_path('.wav')
             
             # 使用wave模块创建WAV文件
-            with wave.open(wav_path, 'wb') as wav_file:
+            with span('wav'), wave.open(wav_path, 'wb') as wav_file:
                 wav_file.setnchannels(1)  # 单声道
                 wav_file.setsampwidth(2)  # 16位
                 wav_file.setframerate(16000)  # 16kHz采样率
@@ -0,0 +1,130 @@
+# -*- coding:utf-8 -*-
+"""
+基于能量的语音活动检测，识别前裁掉静音
+识别按实时速率发送音频，录音开头结尾每多1秒静音，识别就多等约1秒。
+按帧计算16kHz单声道s16le PCM的能量（NumPy向量化），去掉首尾静音，可选地把过长的句间停顿压缩到上限。
+"""
+
+import logging
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+class SilenceTrimmer:
+    """按帧能量裁剪PCM中的静音
+
+    帧能量（dBFS）高于阈值的帧视为语音，阈值取 threshold_db 与“底噪 + noise_margin_db”中较大者，
+    底噪取各帧能量的低分位数，以适应底噪较大的录音。语音前后各保留 padding_ms，避免切掉弱起音和尾音。
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=20, threshold_db=-45.0, noise_margin_db=10.0,
+                 padding_ms=200, max_pause_ms=0, min_speech_ms=100):
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms  # 分析帧长（毫秒）
+        self.threshold_db = threshold_db  # 语音能量下限（dBFS）
+        self.noise_margin_db = noise_margin_db  # 高出底噪多少才算语音，0表示只用固定阈值
+        self.padding_ms = padding_ms  # 语音前后保留的静音（毫秒）
+        self.max_pause_ms = max_pause_ms  # 句间停顿（不含两侧保留的padding）超过该值时压缩到该值，0表示不压缩
+        self.min_speech_ms = min_speech_ms  # 语音总时长低于该值时视为没有语音，原样返回
+        self._lock = threading.Lock()
+        self._stats = {
+            'processed': 0,
+            'trimmed': 0,
+            'no_speech': 0,
+            'bytes_in': 0,
+            'bytes_out': 0,
+        }
+
+    def trim(self, pcm_data):
+        """返回裁剪后的PCM数据；NumPy不可用、音频过短或检测不到语音时原样返回"""
+        if np is None or not pcm_data:
+            return pcm_data
+
+        frame_len = self.sample_rate * self.frame_ms // 1000
+        frame_bytes = frame_len * 2
+        num_frames = len(pcm_data) // frame_bytes
+        if num_frames < 2:
+            return pcm_data
+
+        samples = np.frombuffer(pcm_data, dtype='<i2', count=num_frames * frame_len)
+        frames = samples.reshape(num_frames, frame_len).astype(np.float32)
+        rms = np.sqrt(np.mean(frames * frames, axis=1)) / 32768.0
+        energy_db = 20 * np.log10(np.maximum(rms, 1e-10))
+
+        threshold = self.threshold_db
+        if self.noise_margin_db:
+            # 底噪阈值不超过峰值以下noise_margin_db，整段都是语音时不会把语音当成底噪
+            noise_floor = np.percentile(energy_db, 10)
+            adaptive = min(noise_floor + self.noise_margin_db, energy_db.max() - self.noise_margin_db)
+            threshold = max(threshold, adaptive)
+        voiced = energy_db > threshold
+
+        speech_frames = int(voiced.sum())
+        if speech_frames * self.frame_ms < self.min_speech_ms:
+            self._record(len(pcm_data), len(pcm_data), no_speech=True)
+            return pcm_data
+
+        # 语音帧前后各扩展padding帧
+        pad = self.padding_ms // self.frame_ms
+        if pad:
+            keep = np.convolve(voiced, np.ones(2 * pad + 1, dtype=np.int32), mode='same') > 0
+        else:
+            keep = voiced.copy()
+
+        # 去掉首尾静音，句间停顿默认原样保留
+        indices = np.flatnonzero(keep)
+        first, last = indices[0], indices[-1] + 1
+        mask = np.ones(last - first, dtype=bool)
+        if self.max_pause_ms:
+            self._compress_pauses(keep[first:last], mask, max(self.max_pause_ms // self.frame_ms, 1))
+
+        # 连续保留的帧合并成区间，按区间拷贝字节
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.view(np.int8), [0])))) + first
+        pieces = []
+        for start, end in zip(edges[0::2], edges[1::2]):
+            end_byte = len(pcm_data) if end == num_frames else end * frame_bytes
+            pieces.append(pcm_data[start * frame_bytes:end_byte])
+        trimmed = b''.join(pieces)
+
+        self._record(len(pcm_data), len(trimmed))
+        if len(trimmed) < len(pcm_data):
+            logger.info(f"静音裁剪: {len(pcm_data)} -> {len(trimmed)} bytes "
+                        f"({len(pcm_data) / 2 / self.sample_rate:.2f}s -> {len(trimmed) / 2 / self.sample_rate:.2f}s)")
+        return trimmed
+
+    @staticmethod
+    def _compress_pauses(keep, mask, max_frames):
+        """在mask中去掉超过max_frames帧的停顿的中间部分，停顿两侧各留一半"""
+        edges = np.flatnonzero(np.diff(np.concatenate(([1], keep.view(np.int8), [1]))))
+        head = max_frames // 2
+        for start, end in zip(edges[0::2], edges[1::2]):
+            if end - start > max_frames:
+                mask[start + head:end - (max_frames - head)] = False
+
+    def _record(self, bytes_in, bytes_out, no_speech=False):
+        with self._lock:
+            self._stats['processed'] += 1
+            self._stats['bytes_in'] += bytes_in
+            self._stats['bytes_out'] += bytes_out
+            if no_speech:
+                self._stats['no_speech'] += 1
+            elif bytes_out < bytes_in:
+                self._stats['trimmed'] += 1
+
+    def get_stats(self):
+        """获取裁剪统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['bytes_saved'] = stats['bytes_in'] - stats['bytes_out']
+        stats['seconds_saved'] = round(stats['bytes_saved'] / 2 / self.sample_rate, 2)
+        stats['saved_ratio'] = round(stats['bytes_saved'] / stats['bytes_in'], 4) if stats['bytes_in'] else 0.0
+        stats['threshold_db'] = self.threshold_db
+        stats['padding_ms'] = self.padding_ms
+        stats['max_pause_ms'] = self.max_pause_ms
+        return stats
@@ -0,0 +1,252 @@
+# -*- coding:utf-8 -*-
+"""
+讯飞websocket接口的共享传输层
+TTS和ASR共用：签名URL在有效期内复用，DNS结果短期缓存，TLS会话复用，
+并在有请求时预先建立好几条已完成握手的连接，新会话直接取用，连接建立不再出现在请求路径上。
+"""
+
+import base64
+import hashlib
+import hmac
+import logging
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from time import mktime
+from urllib.parse import urlencode, urlparse
+from wsgiref.handlers import format_date_time
+
+import websocket
+
+logger = logging.getLogger(__name__)
+
+TTS_URL = 'wss://tts-api.xfyun.cn/v2/tts'
+ASR_URL = 'wss://iat-api.xfyun.cn/v2/iat'
+
+# 签名中使用的host（与讯飞示例保持一致）
+SIGNATURE_HOST = 'ws-api.xfyun.cn'
+
+
+class XfyunWebSocket(websocket.WebSocket):
+    """会话结束时立即断开，不等待服务端回复关闭帧"""
+
+    def close(self, status=websocket.STATUS_NORMAL, reason=b'', timeout=0):
+        super().close(status, reason, timeout)
+
+
+class XfyunTransport:
+    """单个讯飞websocket接口的连接工厂
+
+    每条websocket连接只承载一次会话；预热池中的连接空闲超过max_idle秒即丢弃，
+    最近demand_window秒内没有请求时不再补充，空闲的服务不会持续建立连接。
+    """
+
+    def __init__(self, url, api_key, api_secret, pool_size=0, max_idle=8, url_ttl=240,
+                 connect_timeout=5, dns_ttl=60, demand_window=60):
+        self.url = url
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.pool_size = pool_size  # 预热连接数，0表示不预热
+        self.max_idle = max_idle  # 预热连接的最长空闲时间（秒），需小于讯飞的空闲断开时间
+        self.url_ttl = url_ttl  # 签名URL复用时间（秒），讯飞允许的时钟偏差为300秒
+        self.connect_timeout = connect_timeout
+        self.dns_ttl = dns_ttl
+        self.demand_window = demand_window
+
+        parsed = urlparse(url)
+        self.secure = parsed.scheme == 'wss'  # ws://仅用于本地替身服务
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.secure else 80)
+        self.path = parsed.path
+
+        # 与原实现一致，不校验服务端证书
+        self._ssl_context = ssl.create_default_context()
+        self._ssl_context.check_hostname = False
+        self._ssl_context.verify_mode = ssl.CERT_NONE
+        self._tls_session = None
+
+        self._lock = threading.Lock()
+        self._signed = (None, 0)  # (URL, 签名时间)
+        self._address = (None, 0)  # (地址, 解析时间)
+        self._idle = deque()  # [(连接, 建立时间)]
+        self._last_demand = 0
+        self._stats = {
+            'connects': 0,
+            'warm_hits': 0,
+            'cold_connects': 0,
+            'stale_dropped': 0,
+            'tls_resumed': 0,
+            'url_signed': 0,
+            'failures': 0,
+        }
+
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        if pool_size > 0:
+            self._thread = threading.Thread(target=self._maintain, name='xfyun-warm', daemon=True)
+            self._thread.start()
+
+    def sign_url(self):
+        """生成带HMAC-SHA256鉴权参数的websocket URL"""
+        # 生成RFC1123格式的时间戳
+        date = format_date_time(mktime(datetime.now().timetuple()))
+
+        signature_origin = "host: " + SIGNATURE_HOST + "\n"
+        signature_origin += "date: " + date + "\n"
+        signature_origin += "GET " + self.path + " HTTP/1.1"
+
+        signature_sha = hmac.new(
+            self.api_secret.encode('utf-8'),
+            signature_origin.encode('utf-8'),
+            digestmod=hashlib.sha256
+        ).digest()
+        signature_sha = base64.b64encode(signature_sha).decode(encoding='utf-8')
+
+        authorization_origin = "api_key=\"%s\", algorithm=\"%s\", headers=\"%s\", signature=\"%s\"" % (
+            self.api_key, "hmac-sha256", "host date request-line", signature_sha)
+        authorization = base64.b64encode(authorization_origin.encode('utf-8')).decode(encoding='utf-8')
+
+        v = {
+            "authorization": authorization,
+            "date": date,
+            "host": SIGNATURE_HOST
+        }
+        return self.url + '?' + urlencode(v)
+
+    def create_url(self):
+        """返回签名URL，有效期内复用同一个签名"""
+        now = time.time()
+        with self._lock:
+            url, signed_at = self._signed
+            if url and now - signed_at < self.url_ttl:
+                return url
+        url = self.sign_url()
+        with self._lock:
+            self._signed = (url, now)
+            self._stats['url_signed'] += 1
+        return url
+
+    def _resolve(self):
+        """解析服务端地址，结果缓存dns_ttl秒"""
+        now = time.time()
+        with self._lock:
+            address, resolved_at = self._address
+            if address and now - resolved_at < self.dns_ttl:
+                return address
+        infos = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        address = infos[0][4][:2]
+        with self._lock:
+            self._address = (address, now)
+        return address
+
+    def open_connection(self):
+        """建立一条新的websocket连接（TCP + TLS + 升级握手），复用上一次的TLS会话"""
+        sock = socket.create_connection(self._resolve(), timeout=self.connect_timeout)
+        try:
+            # 与websocket-client默认一致，关闭Nagle算法，小音频帧不被延迟合并
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            ssl_sock = None
+            if self.secure:
+                with self._lock:
+                    tls_session = self._tls_session
+                ssl_sock = self._ssl_context.wrap_socket(sock, server_hostname=self.host, session=tls_session)
+            ws = websocket.create_connection(
+                self.create_url(),
+                timeout=self.connect_timeout,
+                socket=ssl_sock or sock,
+                class_=XfyunWebSocket
+            )
+        except Exception:
+            sock.close()
+            with self._lock:
+                self._stats['failures'] += 1
+            raise
+
+        with self._lock:
+            self._stats['connects'] += 1
+            if ssl_sock is not None:
+                # TLS 1.3的会话票据在握手后才到达，升级握手完成后再保存
+                self._tls_session = ssl_sock.session
+                if ssl_sock.session_reused:
+                    self._stats['tls_resumed'] += 1
+        return ws
+
+    def connect(self):
+        """取得一条可用的websocket连接，优先使用预热连接"""
+        self._last_demand = time.time()
+        ws = self._take()
+        if ws is not None:
+            with self._lock:
+                self._stats['warm_hits'] += 1
+        else:
+            with self._lock:
+                self._stats['cold_connects'] += 1
+            ws = self.open_connection()
+        if self._thread:
+            self._wakeup.set()
+        return ws
+
+    def _take(self):
+        """取出一条未过期的预热连接，没有时返回None"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                ws, opened_at = self._idle.popleft()
+            if time.time() - opened_at < self.max_idle and ws.connected:
+                return ws
+            self._discard(ws)
+
+    def _discard(self, ws):
+        with self._lock:
+            self._stats['stale_dropped'] += 1
+        ws.close()
+
+    def _maintain(self):
+        """丢弃过期的预热连接，有近期请求时补足预热连接数"""
+        while not self._stop.is_set():
+            now = time.time()
+            with self._lock:
+                stale = []
+                while self._idle and now - self._idle[0][1] >= self.max_idle:
+                    stale.append(self._idle.popleft()[0])
+            for ws in stale:
+                self._discard(ws)
+
+            while not self._stop.is_set() and time.time() - self._last_demand < self.demand_window:
+                with self._lock:
+                    if len(self._idle) >= self.pool_size:
+                        break
+                try:
+                    ws = self.open_connection()
+                except Exception as e:
+                    logger.warning(f"预热讯飞连接失败: {str(e)}")
+                    break
+                with self._lock:
+                    self._idle.append((ws, time.time()))
+
+            self._wakeup.wait(self.max_idle / 2)
+            self._wakeup.clear()
+
+    def get_stats(self):
+        """获取连接统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        stats['pool_size'] = self.pool_size
+        return stats
+
+    def close(self):
+        """停止预热并关闭全部空闲连接"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for ws, _ in idle:
+            ws.close()